@@ -0,0 +1,401 @@
+"""
+Customer API Client
+===================
+Fetches products from the customer-facing API for the stock tools.
+
+- Page size: the first request asks for a large page and learns the
+  largest `limit` the backend honours; later pages adapt the size to the
+  observed latency and payload size
+- Decoding: orjson or ujson when installed, the stdlib json otherwise
+- Only the product fields the comparison uses are kept
+
+Every request goes through a RequestController, which the order history
+test uses as well:
+
+- AIMD concurrency: the number of requests in flight grows by one per
+  window of successes and halves on throttling (429/5xx, timeouts)
+- Jittered exponential backoff between retries, honouring Retry-After;
+  only idempotent methods are retried (a login POST is sent once)
+- A circuit breaker that stops calling a backend that keeps failing (the
+  Render backend cold-starts) and lets one trial request through later
+
+A catalog fetch that still misses pages is marked incomplete, so the
+comparison never reports the products on those pages as drift.
+"""
+
+import json
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Fastest installed JSON decoder, picked on first use so importing this
+# module (e.g. for --help) doesn't load orjson/ujson
+_json_decoder = None
+
+
+def json_decoder():
+    """(name, loads) of the decoder in use; the first call picks it"""
+    global _json_decoder
+    if _json_decoder is None:
+        try:
+            import orjson
+            _json_decoder = ('orjson', orjson.loads)
+        except ImportError:
+            try:
+                import ujson
+                _json_decoder = ('ujson', ujson.loads)
+            except ImportError:
+                _json_decoder = ('json', json.loads)
+    return _json_decoder
+
+
+def json_loads(payload):
+    return json_decoder()[1](payload)
+
+# Fields of an API product the stock tools read
+PRODUCT_FIELDS = ('_id', 'stock')
+
+# Page sizes tried in order; a backend that rejects one (4xx) gets the next
+PROBE_LIMITS = (1000, 500, 250, 100)
+MIN_LIMIT = 50
+
+# Adapt the page size to keep each page around this latency and size
+TARGET_PAGE_SECONDS = 1.0
+MAX_PAGE_BYTES = 2 * 1024 * 1024
+
+REQUEST_TIMEOUT = 10
+
+# Responses worth retrying; anything else is returned to the caller as is
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+# Only these are retried by default; a replayed POST (e.g. a login) could
+# act twice
+IDEMPOTENT_METHODS = frozenset({'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'})
+
+
+class ApiUnavailableError(Exception):
+    """The customer API could not answer (after retries)"""
+
+
+class CircuitOpenError(ApiUnavailableError):
+    """Raised instead of calling a backend that keeps failing"""
+
+
+class RequestController:
+    def __init__(self, session, max_concurrency=8, initial_concurrency=2, max_retries=4,
+                 base_delay=0.5, max_delay=20.0, failure_threshold=5, reset_timeout=30.0):
+        """Concurrency, retry and circuit-breaker policy around an HTTP session"""
+        self.session = session
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self.window = float(initial_concurrency)
+        self.in_flight = 0
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.stats = {'requests': 0, 'retries': 0, 'throttled': 0, 'peak_concurrency': 0}
+        self._lock = threading.Condition()
+
+    # Circuit breaker
+
+    def _allow(self):
+        """(allowed, is_trial) for a request about to go out (caller holds the lock)"""
+        if self.opened_at is None:
+            return True, False
+        if time.monotonic() - self.opened_at < self.reset_timeout or self.trial_running:
+            return False, False
+        # Half-open: let a single trial request through
+        self.trial_running = True
+        return True, True
+
+    def _record(self, ok, trial=False):
+        with self._lock:
+            # Requests already in flight when the breaker opened don't end the trial
+            if trial:
+                self.trial_running = False
+            if ok:
+                self.consecutive_failures = 0
+                self.opened_at = None
+                # Additive increase: about +1 slot per window of successes
+                self.window = min(self.max_concurrency, self.window + 1.0 / self.window)
+            else:
+                self.consecutive_failures += 1
+                self.stats['throttled'] += 1
+                # Multiplicative decrease
+                self.window = max(1.0, self.window / 2)
+                if self.consecutive_failures >= self.failure_threshold:
+                    if self.opened_at is None:
+                        print(f"⚠️  API failing repeatedly; pausing calls for {self.reset_timeout:.0f}s")
+                    self.opened_at = time.monotonic()
+            self._lock.notify_all()
+
+    def _acquire(self):
+        with self._lock:
+            while self.in_flight >= int(self.window):
+                self._lock.wait()
+            allowed, trial = self._allow()
+            if not allowed:
+                raise CircuitOpenError("customer API circuit is open")
+            self.in_flight += 1
+            self.stats['requests'] += 1
+            self.stats['peak_concurrency'] = max(self.stats['peak_concurrency'], self.in_flight)
+            return trial
+
+    def _release(self):
+        with self._lock:
+            self.in_flight -= 1
+            self._lock.notify_all()
+
+    def _delay(self, attempt, response=None):
+        """Full-jitter exponential backoff, or the server's Retry-After"""
+        if response is not None:
+            retry_after = response.headers.get('Retry-After')
+            if retry_after and retry_after.isdigit():
+                return min(self.max_delay, float(retry_after))
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def request(self, method, url, retry=None, **kwargs):
+        """Send a request with retries
+
+        Only idempotent methods are retried unless ``retry`` says otherwise.
+        Returns the final response (which may still be a 429/5xx once the
+        retries are used up). Raises CircuitOpenError while the breaker is
+        open, or the last connection error.
+        """
+        from requests.exceptions import ConnectionError, Timeout
+
+        if retry is None:
+            retry = method.upper() in IDEMPOTENT_METHODS
+        max_retries = self.max_retries if retry else 0
+
+        kwargs.setdefault('timeout', REQUEST_TIMEOUT)
+        attempt = 0
+        while True:
+            trial = self._acquire()
+            response = None
+            error = None
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (ConnectionError, Timeout) as e:
+                error = e
+            finally:
+                self._release()
+
+            ok = error is None and response.status_code not in RETRY_STATUSES
+            self._record(ok, trial)
+            if ok or attempt >= max_retries or not getattr(error, 'retryable', True):
+                if error is not None:
+                    raise error
+                return response
+
+            attempt += 1
+            with self._lock:
+                self.stats['retries'] += 1
+            time.sleep(self._delay(attempt, response))
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def map(self, function, items):
+        """Run ``function`` over ``items`` concurrently, in input order
+
+        The worker pool is sized for the maximum; how many requests are in
+        flight at once is governed by the AIMD window.
+        """
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as pool:
+            return list(pool.map(function, items))
+
+
+class CustomerApiClient:
+    def __init__(self, session, api_url, page_size=None, fields=PRODUCT_FIELDS, controller=None):
+        """Client for the /customer/products/ endpoints
+
+        ``page_size`` fixes the page size; by default it is probed. Pass a
+        ``controller`` to share its concurrency and breaker state.
+        """
+        self.controller = controller or RequestController(session)
+        self.api_url = api_url
+        self.page_size = page_size
+        self.fields = fields
+        self.complete = True
+        self.failed_pages = []
+        self.stats = {'pages': 0, 'bytes': 0, 'seconds': 0.0, 'limit': page_size}
+        self._stats_lock = threading.Lock()
+
+    def _slim(self, products):
+        """Keep only the fields the tools use"""
+        fields = self.fields
+        return [{field: product[field] for field in fields if field in product} for product in products]
+
+    def _get_page(self, page, limit):
+        """Fetch one list page
+
+        Returns (status, products, pagination, elapsed_seconds, payload_bytes).
+        """
+        started = time.perf_counter()
+        response = self.controller.get(
+            f"{self.api_url}/customer/products/",
+            params={'page': page, 'limit': limit}
+        )
+        elapsed = time.perf_counter() - started
+
+        if response.status_code != 200:
+            return response.status_code, [], {}, elapsed, 0
+
+        payload = response.content
+        data = json_loads(payload)
+        with self._stats_lock:
+            self.stats['pages'] += 1
+            self.stats['bytes'] += len(payload)
+            self.stats['seconds'] += elapsed
+
+        if not data.get('success') or not data.get('data'):
+            return response.status_code, [], {}, elapsed, len(payload)
+
+        body = data['data']
+        return response.status_code, self._slim(body.get('products', [])), body.get('pagination', {}), elapsed, len(payload)
+
+    def _probe(self):
+        """First page at the largest accepted page size
+
+        Returns (status, products, pagination, limit). A backend that caps
+        `limit` silently still returns a valid first page of the capped size.
+        """
+        status = None
+        for limit in PROBE_LIMITS:
+            status, products, pagination, _elapsed, _size = self._get_page(1, limit)
+            if status == 200:
+                if pagination.get('has_next') and products:
+                    # A full first page shows the real size; an echoed
+                    # `limit` may be what was asked for, not what was served
+                    accepted = len(products)
+                else:
+                    accepted = pagination.get('limit')
+                    if not isinstance(accepted, int) or accepted <= 0:
+                        accepted = limit
+                return status, products, pagination, min(accepted, limit) or limit
+            if status == 429 or not 400 <= status < 500:
+                break
+        return status, [], {}, PROBE_LIMITS[-1]
+
+    def _next_limit(self, limit, max_limit, offset, elapsed, size):
+        """Adapt the page size; the new size must divide the offset so page
+        numbers keep lining up with what has been fetched"""
+        if elapsed > TARGET_PAGE_SECONDS or size > MAX_PAGE_BYTES:
+            smaller = limit // 2
+            if smaller >= MIN_LIMIT and offset % smaller == 0:
+                return smaller
+        elif elapsed < TARGET_PAGE_SECONDS / 3 and size < MAX_PAGE_BYTES / 3:
+            larger = limit * 2
+            if larger <= max_limit and offset % larger == 0:
+                return larger
+        return limit
+
+    def _mark_incomplete(self, page, reason):
+        self.complete = False
+        self.failed_pages.append(page)
+        print(f"⚠️  API page {page} failed ({reason})")
+
+    def _fetch_page_safely(self, page, limit):
+        """(page, products or None) for the concurrent fetch"""
+        try:
+            status, products, _pagination, _elapsed, _size = self._get_page(page, limit)
+        except Exception as e:
+            return page, None, str(e)
+        if status != 200:
+            return page, None, f"status {status}"
+        return page, products, None
+
+    def fetch_products(self):
+        """All products listed by the customer API
+
+        When the first page reports the page count, the rest are fetched
+        concurrently at a fixed page size; otherwise pages are walked in
+        order with an adaptive size. Check ``complete`` afterwards: pages
+        that still failed after retries leave it False.
+        """
+        self.complete = True
+        self.failed_pages = []
+        try:
+            if self.page_size:
+                status, products, pagination, _elapsed, _size = self._get_page(1, self.page_size)
+                limit = max_limit = self.page_size
+            else:
+                status, products, pagination, limit = self._probe()
+                max_limit = limit
+        except Exception as e:
+            self._mark_incomplete(1, str(e))
+            return []
+
+        self.stats['limit'] = limit
+        if status != 200:
+            self._mark_incomplete(1, f"status {status}")
+            return []
+
+        all_products = list(products)
+        if not pagination.get('has_next', False):
+            return all_products
+
+        total_pages = pagination.get('total_pages')
+        if not isinstance(total_pages, int) and isinstance(pagination.get('total'), int):
+            total_pages = -(-pagination['total'] // limit)
+
+        if isinstance(total_pages, int) and total_pages > 1:
+            for page, products, error in self.controller.map(
+                lambda page: self._fetch_page_safely(page, limit), range(2, total_pages + 1)
+            ):
+                if products is None:
+                    self._mark_incomplete(page, error)
+                else:
+                    all_products.extend(products)
+            return all_products
+
+        while pagination.get('has_next', False):
+            offset = len(all_products)
+            page = offset // limit + 1
+            try:
+                status, products, pagination, elapsed, size = self._get_page(page, limit)
+            except Exception as e:
+                self._mark_incomplete(page, str(e))
+                break
+            if status != 200:
+                self._mark_incomplete(page, f"status {status}")
+                break
+            all_products.extend(products)
+            if not products:
+                break
+            limit = self._next_limit(limit, max_limit, len(all_products), elapsed, size)
+
+        self.stats['limit'] = limit
+        return all_products
+
+    def get_product(self, product_id):
+        """One product from the detail endpoint, or None when not visible
+
+        Raises ApiUnavailableError when the API could not answer, so callers
+        can tell "not visible" from "not checked".
+        """
+        response = self.controller.get(f"{self.api_url}/customer/products/{product_id}/")
+        if response.status_code == 404:
+            return None
+        if response.status_code != 200:
+            raise ApiUnavailableError(f"customer API returned status {response.status_code}")
+        data = json_loads(response.content)
+        return (data.get('data') or {}).get('product')
+
+    def describe_stats(self):
+        """One-line summary of the last catalog fetch"""
+        stats = self.stats
+        control = self.controller.stats
+        return (f"{stats['pages']} pages, limit {stats['limit']}, {stats['bytes'] / 1024:,.0f} KiB, "
+                f"{stats['seconds']:.2f}s, {json_decoder()[0]} decoder, "
+                f"{control['retries']} retries, peak concurrency {control['peak_concurrency']}")
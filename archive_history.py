@@ -0,0 +1,422 @@
+"""
+History Array Archival Tool
+===========================
+Every sale appends to batches.usage_history[] and every stock update to
+products.stock_history[] and products.sync_logs[]. These arrays grow
+without bound and make every full-document read slower. This tool moves
+entries older than a cutoff into monthly bucket documents:
+
+- batches.usage_history[]  -> batches_usage_history_archive
+- products.stock_history[] -> products_stock_history_archive
+- products.sync_logs[]     -> products_sync_logs_archive
+
+Bucket documents look like
+{_id: "<doc id>|2025-06", parent_id, product_id, bucket: "2025-06",
+ entries: [...], archive_runs: [...]}.
+
+Entries are moved one by one, never by value: identical entries (the same
+sale recorded twice is what fifo_audit reports as a double deduction) all
+reach the archive and nothing else is removed. Each run has an id, and
+1. the old entries are marked in place with it (_archive_run),
+2. the marked entries are $push-ed to their bucket, unless the bucket's
+   archive_runs already lists that id (the copy was done before a crash),
+3. the entries carrying the mark are $pull-ed from the source.
+Anything appended meanwhile is unmarked and stays put. Work is done in
+chunks of documents ordered by _id, and the last finished _id is
+checkpointed, so an interrupted run resumes where it stopped (with the same
+cutoff and run id); marks left by any interrupted run are finished off by
+the next one. Entries without a timestamp are never archived.
+
+    python archive_history.py --older-than-days 90              # dry run
+    python archive_history.py --older-than-days 90 --live
+    python archive_history.py --live --only usage_history
+
+fifo_audit.py reads the usage_history archive back in, so audits still
+see every sale.
+"""
+
+import sys
+import os
+import time
+import uuid
+from datetime import datetime, timedelta
+from statistics import median
+
+from batch_utils import parse_datetime, ACTIVE_BATCH_QUERY
+from db_connection import ConnectionOptions, add_connection_arguments, confirm_mode, BULK_CHUNK_SIZE
+
+# Configuration
+MONGODB_URI = os.getenv('MONGODB_URI', 'mongodb://localhost:27017/')
+DATABASE_NAME = os.getenv('DATABASE_NAME', 'pos_system')
+
+# (source collection, array field) pairs that are archived
+ARCHIVE_TARGETS = (
+    ('batches', 'usage_history'),
+    ('products', 'stock_history'),
+    ('products', 'sync_logs')
+)
+
+# Entry timestamp fields; the first one present wins
+ENTRY_TIME_FIELDS = ('used_at', 'timestamp', 'date', 'created_at', 'updated_at')
+
+DEFAULT_OLDER_THAN_DAYS = 90
+CHECKPOINT_FILE = 'archive_history_checkpoint.json'
+LATENCY_RUNS = 3
+# Set on an entry while it is being moved: the id of the archival run
+ARCHIVE_MARKER = '_archive_run'
+
+
+def archive_collection_name(source, field):
+    """Name of the archive collection for one history array"""
+    return f"{source}_{field}_archive"
+
+
+def entry_time(entry):
+    """Timestamp of a history entry, or None"""
+    if not isinstance(entry, dict):
+        return None
+    for field in ENTRY_TIME_FIELDS:
+        value = parse_datetime(entry.get(field))
+        if value is not None:
+            return value
+    return None
+
+
+def is_archivable(entry, cutoff):
+    """Entries (marked or not) with a timestamp older than the cutoff"""
+    timestamp = entry_time(entry)
+    return timestamp is not None and timestamp < cutoff
+
+
+def _unmarked(entry):
+    return {name: value for name, value in entry.items() if name != ARCHIVE_MARKER}
+
+
+def old_entries_query(field, cutoff):
+    """Documents with at least one entry older than the cutoff
+
+    Timestamps may be stored as dates or ISO strings; both are matched here
+    and every entry is checked again with parse_datetime().
+    """
+    conditions = []
+    for time_field in ENTRY_TIME_FIELDS:
+        conditions.append({time_field: {'$lt': cutoff}})
+        conditions.append({time_field: {'$lt': cutoff.isoformat(), '$type': 'string'}})
+    return {field: {'$elemMatch': {'$or': conditions}}}
+
+
+class HistoryArchiver:
+    def __init__(self, mongodb_uri=MONGODB_URI, db_name=DATABASE_NAME, dry_run=True, checkpoint_file=CHECKPOINT_FILE,
+                 chunk_size=BULK_CHUNK_SIZE, options=None):
+        """Initialize connection to MongoDB (writes go to the primary)"""
+        self.dry_run = dry_run
+        self.checkpoint_file = checkpoint_file
+        self.chunk_size = chunk_size
+        try:
+            self.options = options or ConnectionOptions()
+            self.client = self.options.client(mongodb_uri)
+
+            from pymongo import ReadPreference
+            self.db = self.client.get_database(db_name, read_preference=ReadPreference.PRIMARY)
+            self.client.server_info()
+
+            mode = "DRY RUN MODE" if dry_run else "LIVE MODE - WILL MODIFY DATABASE"
+            print(f"✅ Connected to MongoDB: {db_name}")
+            print(f"⚠️  Running in: {mode}")
+            print("=" * 80)
+        except Exception as e:
+            print(f"❌ Failed to connect to MongoDB: {e}")
+            sys.exit(1)
+
+    # Checkpoint
+
+    def _load_checkpoint(self):
+        from bson import json_util
+
+        try:
+            with open(self.checkpoint_file, 'r') as f:
+                # json_util keeps ObjectId _ids comparable on resume
+                return json_util.loads(f.read())
+        except FileNotFoundError:
+            return {}
+
+    def _save_checkpoint(self, checkpoint):
+        from bson import json_util
+
+        tmp_file = f"{self.checkpoint_file}.tmp"
+        with open(tmp_file, 'w') as f:
+            f.write(json_util.dumps(checkpoint, indent=2))
+        os.replace(tmp_file, self.checkpoint_file)
+
+    # Measurements
+
+    def collection_size(self, name):
+        """Uncompressed data size of a collection in bytes, or None"""
+        try:
+            return self.db.command('collStats', name).get('size')
+        except Exception:
+            return None
+
+    def reconciliation_latency(self):
+        """Median seconds of the full product and active-batch reads the comparison does"""
+        queries = {
+            'products': (self.db.products, {'isDeleted': {'$ne': True}}),
+            'batches': (self.db.batches, ACTIVE_BATCH_QUERY)
+        }
+        latency = {}
+        for name, (collection, query) in queries.items():
+            runs = []
+            for _ in range(LATENCY_RUNS):
+                started = time.perf_counter()
+                for _doc in collection.find(query).batch_size(self.options.batch_size):
+                    pass
+                runs.append(time.perf_counter() - started)
+            latency[name] = median(runs)
+        return latency
+
+    # Archival
+
+    def archive_field(self, source, field, cutoff, checkpoint):
+        """Archive one array field; returns (documents, entries, bytes) moved"""
+        from bson import encode
+        from pymongo import UpdateOne
+
+        state = checkpoint.setdefault(f"{source}.{field}", {})
+        if state.get('done'):
+            print(f"⏭️  {source}.{field}: already archived in this run (checkpoint)")
+            return state.get('documents', 0), state.get('entries', 0), state.get('bytes', 0)
+
+        source_collection = self.db[source]
+        archive = self.db[archive_collection_name(source, field)]
+        if not self.dry_run:
+            archive.create_index([('parent_id', 1), ('bucket', 1)])
+            archive.create_index([('product_id', 1), ('bucket', 1)])
+
+        run_id = checkpoint['run_id']
+        marked_query = {f"{field}.{ARCHIVE_MARKER}": {'$exists': True}}
+        # Entries marked by an interrupted run are finished off as well
+        query = {'$or': [old_entries_query(field, cutoff), marked_query]}
+        last_id = state.get('last_id')
+        documents = state.get('documents', 0)
+        entries_moved = state.get('entries', 0)
+        bytes_moved = state.get('bytes', 0)
+        skipped = 0
+
+        print(f"\n📦 {source}.{field} -> {archive.name}")
+        while True:
+            chunk_query = dict(query, _id={'$gt': last_id}) if last_id is not None else query
+            chunk = list(source_collection.find(chunk_query, {field: 1, 'product_id': 1})
+                         .sort('_id', 1).limit(self.chunk_size))
+            if not chunk:
+                break
+
+            if self.dry_run:
+                for doc in chunk:
+                    old = [entry for entry in doc.get(field) or [] if is_archivable(entry, cutoff)]
+                    if old:
+                        documents += 1
+                        entries_moved += len(old)
+                        bytes_moved += sum(len(encode({'e': _unmarked(entry)})) for entry in old)
+                last_id = chunk[-1]['_id']
+                print(f"   ... {documents} documents, {entries_moved} entries")
+                continue
+
+            # 1. Mark the old entries in place, by position. The filter pins
+            #    each marked position to the entry that was read, so a
+            #    concurrent rewrite of the array makes the mark miss (the
+            #    document is left for the next run); appends don't shift them
+            mark_ops = []
+            for doc in chunk:
+                entries = doc.get(field) or []
+                positions = [index for index, entry in enumerate(entries)
+                             if is_archivable(entry, cutoff) and ARCHIVE_MARKER not in entry]
+                if positions:
+                    guard = {f"{field}.{index}": entries[index] for index in positions}
+                    mark_ops.append(UpdateOne(
+                        dict(guard, _id=doc['_id']),
+                        {'$set': {f"{field}.{index}.{ARCHIVE_MARKER}": run_id for index in positions}}
+                    ))
+            if mark_ops:
+                skipped += len(mark_ops) - source_collection.bulk_write(mark_ops, ordered=False).matched_count
+
+            # 2. Copy every marked entry into its bucket. A bucket lists the
+            #    marks it received, so a copy repeated after a crash is a no-op
+            #    while identical entries (repeated sales) are all kept
+            archive_ops = []
+            pull_ops = []
+            ids = [doc['_id'] for doc in chunk]
+            for doc in source_collection.find(dict(marked_query, _id={'$in': ids}), {field: 1, 'product_id': 1}):
+                marked = [entry for entry in doc.get(field) or []
+                          if isinstance(entry, dict) and ARCHIVE_MARKER in entry]
+                if not marked:
+                    continue
+
+                copies = {}
+                for entry in marked:
+                    key = (entry[ARCHIVE_MARKER], entry_time(entry).strftime('%Y-%m'))
+                    copies.setdefault(key, []).append(_unmarked(entry))
+                product_id = doc.get('product_id', doc['_id'])
+                for (marker, bucket), bucket_entries in copies.items():
+                    archive_ops.append(UpdateOne(
+                        {'_id': f"{doc['_id']}|{bucket}", 'archive_runs': {'$ne': marker}},
+                        {
+                            '$setOnInsert': {'parent_id': doc['_id'], 'product_id': product_id, 'bucket': bucket},
+                            '$push': {'entries': {'$each': bucket_entries}, 'archive_runs': marker}
+                        },
+                        upsert=True
+                    ))
+                # 3. Remove exactly the marked entries
+                markers = sorted({marker for marker, _bucket in copies})
+                pull_ops.append(UpdateOne({'_id': doc['_id']},
+                                          {'$pull': {field: {ARCHIVE_MARKER: {'$in': markers}}}}))
+
+                documents += 1
+                entries_moved += len(marked)
+                bytes_moved += sum(len(encode({'e': entry})) for entries in copies.values() for entry in entries)
+
+            if pull_ops:
+                self._copy_to_archive(archive, archive_ops)
+                source_collection.bulk_write(pull_ops, ordered=False)
+
+            last_id = chunk[-1]['_id']
+            print(f"   ... {documents} documents, {entries_moved} entries")
+            state.update(last_id=last_id, documents=documents, entries=entries_moved, bytes=bytes_moved)
+            self._save_checkpoint(checkpoint)
+
+        if skipped:
+            print(f"   ⚠️  {skipped} documents changed while being marked; their entries stay for the next run")
+        if not self.dry_run:
+            state['done'] = True
+            self._save_checkpoint(checkpoint)
+        return documents, entries_moved, bytes_moved
+
+    @staticmethod
+    def _copy_to_archive(archive, operations):
+        """Upsert bucket copies; a duplicate key means the bucket already has that mark"""
+        from pymongo.errors import BulkWriteError
+
+        try:
+            archive.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            # The guarded upsert of an already copied mark tries to insert the
+            # existing bucket again; anything else is a real failure
+            if any(error['code'] != 11000 for error in e.details['writeErrors']):
+                raise
+
+    def run(self, older_than_days=DEFAULT_OLDER_THAN_DAYS, only=None, restart=False, measure=True):
+        """Archive every target array (or only the named ones)"""
+        checkpoint = {} if restart else self._load_checkpoint()
+        if checkpoint.get('cutoff'):
+            cutoff = datetime.fromisoformat(checkpoint['cutoff'])
+            print(f"↩️  Resuming from {self.checkpoint_file} (cutoff {cutoff.isoformat()})")
+        else:
+            cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+            checkpoint = {'cutoff': cutoff.isoformat()}
+        checkpoint.setdefault('run_id', uuid.uuid4().hex)
+        print(f"🗓️  Archiving entries older than {cutoff.isoformat()}")
+
+        targets = [(source, field) for source, field in ARCHIVE_TARGETS if not only or field in only]
+        sources = sorted({source for source, _field in targets})
+
+        sizes_before = {source: self.collection_size(source) for source in sources}
+        # A dry run moves nothing, so there is no before/after to compare
+        measure = measure and not self.dry_run
+        latency_before = self.reconciliation_latency() if measure else None
+
+        totals = []
+        for source, field in targets:
+            totals.append((source, field) + self.archive_field(source, field, cutoff, checkpoint))
+
+        sizes_after = {source: self.collection_size(source) for source in sources}
+        latency_after = self.reconciliation_latency() if measure else None
+
+        self._display_results(totals, sizes_before, sizes_after, latency_before, latency_after)
+
+        if not self.dry_run:
+            # Finished: the next run starts over with a new cutoff
+            os.remove(self.checkpoint_file)
+        return totals
+
+    def _display_results(self, totals, sizes_before, sizes_after, latency_before, latency_after):
+        from tabulate import tabulate
+
+        print("\n" + "=" * 80)
+        print("📊 ARCHIVAL SUMMARY" + (" (dry run: nothing moved)" if self.dry_run else ""))
+        print("=" * 80)
+        table_data = [
+            [f"{source}.{field}", documents, entries, f"{size / 1024:,.1f}"]
+            for source, field, documents, entries, size in totals
+        ]
+        print(tabulate(table_data, headers=['Array', 'Documents', 'Entries', 'Entry KiB'], tablefmt='grid'))
+
+        print("\n💾 Collection data size (uncompressed):")
+        for source in sizes_before:
+            before, after = sizes_before[source], sizes_after[source]
+            if before is None:
+                print(f"   {source}: not available")
+            elif self.dry_run:
+                print(f"   {source}: {before / 1024:,.1f} KiB")
+            else:
+                print(f"   {source}: {before / 1024:,.1f} KiB -> {after / 1024:,.1f} KiB "
+                      f"({(before - after) / 1024:,.1f} KiB reclaimed)")
+        if not self.dry_run:
+            print("   On-disk storage is reused by new writes; run `compact` to return it to the OS")
+
+        if latency_before:
+            print("\n⏱️  Reconciliation read latency (median of 3 full reads):")
+            for name, seconds in latency_before.items():
+                if latency_after:
+                    print(f"   {name}: {seconds * 1000:,.1f} ms -> {latency_after[name] * 1000:,.1f} ms")
+                else:
+                    print(f"   {name}: {seconds * 1000:,.1f} ms")
+
+    def close(self):
+        """Close MongoDB connection"""
+        self.client.close()
+        print("\n✅ Connection closed")
+
+
+def main():
+    """Main entry point"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Archive old usage_history, stock_history and sync_logs entries')
+    parser.add_argument('--mongodb-uri', default=MONGODB_URI, help='MongoDB connection URI')
+    parser.add_argument('--db-name', default=DATABASE_NAME, help='Database name')
+    parser.add_argument('--older-than-days', type=int, default=DEFAULT_OLDER_THAN_DAYS,
+                        help=f'Archive entries older than this many days (default {DEFAULT_OLDER_THAN_DAYS})')
+    parser.add_argument('--only', action='append', choices=[field for _source, field in ARCHIVE_TARGETS],
+                        help='Archive only this array (repeatable)')
+    parser.add_argument('--chunk-size', type=int, default=BULK_CHUNK_SIZE,
+                        help=f'Documents per bulk write (default {BULK_CHUNK_SIZE})')
+    parser.add_argument('--checkpoint', default=CHECKPOINT_FILE, help=f'Resume file (default {CHECKPOINT_FILE})')
+    parser.add_argument('--restart', action='store_true', help='Ignore an existing checkpoint and start over')
+    parser.add_argument('--no-latency', action='store_true', help='Skip the before/after read latency measurement')
+    parser.add_argument('--live', action='store_true', help='Move the entries (default is dry-run)')
+    parser.add_argument('--yes', action='store_true', help='Skip the live-mode confirmation prompt (for cron)')
+    add_connection_arguments(parser, reads=False)
+
+    args = parser.parse_args()
+
+    dry_run = not args.live
+    if not confirm_mode(dry_run, args.yes):
+        sys.exit(0)
+
+    archiver = HistoryArchiver(
+        mongodb_uri=args.mongodb_uri,
+        db_name=args.db_name,
+        dry_run=dry_run,
+        checkpoint_file=args.checkpoint,
+        chunk_size=args.chunk_size,
+        options=ConnectionOptions.from_args(args)
+    )
+
+    try:
+        archiver.run(args.older_than_days, args.only, args.restart, measure=not args.no_latency)
+    finally:
+        archiver.close()
+        archiver.options.print_traffic()
+
+
+if __name__ == '__main__':
+    main()
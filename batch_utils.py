@@ -0,0 +1,93 @@
+"""
+Batch Helpers
+=============
+Small helpers shared by the stock tools for reading batch documents.
+"""
+
+from datetime import datetime, timezone
+
+
+def parse_datetime(value):
+    """Convert a stored date (datetime or string) to a naive UTC datetime
+
+    Returns None when the value is missing or cannot be parsed.
+    """
+    if value is None or value == '':
+        return None
+
+    if not isinstance(value, datetime):
+        if not isinstance(value, str):
+            return None
+        try:
+            # Fast path for ISO strings, dateutil only for the odd formats
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            try:
+                from dateutil import parser
+                value = parser.parse(value)
+            except Exception:
+                return None
+
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+# Returned for products without any active batch
+EMPTY_BATCH_INFO = {'total_stock': 0, 'active_batches': 0, 'expired_batches': 0}
+
+# Batches that can still count towards sellable stock
+ACTIVE_BATCH_QUERY = {'status': 'active', 'quantity_remaining': {'$gt': 0}}
+
+
+def summarize_batches(batches, now):
+    """Sellable stock and batch counts for one product's active batches
+
+    A batch counts while its expiry_date is >= ``now``; batches without a
+    (parseable) expiry date never expire. Every tool computes batch stock
+    through this function or ExpiryTimeline, which applies the same rules.
+    """
+    total_stock = 0
+    active = 0
+    expired = 0
+    for batch in batches:
+        expiry = parse_datetime(batch.get('expiry_date'))
+        if expiry is None or expiry >= now:
+            total_stock += batch.get('quantity_remaining', 0)
+            active += 1
+        else:
+            expired += 1
+
+    return {'total_stock': total_stock, 'active_batches': active, 'expired_batches': expired}
+
+
+def calculate_batch_stock(batches_collection, product_id, now=None):
+    """Batch stock for a single product (one query)"""
+    query = dict(ACTIVE_BATCH_QUERY, product_id=product_id)
+    batches = batches_collection.find(query, {'expiry_date': 1, 'quantity_remaining': 1})
+    return summarize_batches(batches, now or datetime.utcnow())
+
+
+def batch_stock_stages(batches_collection_name):
+    """Aggregation stages that add ``batch_stock`` to product documents
+
+    Server-side version of summarize_batches(): string expiry dates are
+    converted, and unparseable ones count as non-expiring.
+    """
+    return [
+        {'$lookup': {
+            'from': batches_collection_name,
+            'let': {'pid': '$_id'},
+            'pipeline': [
+                {'$match': dict(ACTIVE_BATCH_QUERY, **{'$expr': {'$eq': ['$product_id', '$$pid']}})},
+                {'$project': {
+                    'quantity_remaining': 1,
+                    'expiry': {'$convert': {'input': '$expiry_date', 'to': 'date', 'onError': None, 'onNull': None}}
+                }},
+                {'$match': {'$or': [{'expiry': None}, {'$expr': {'$gte': ['$expiry', '$$NOW']}}]}},
+                {'$group': {'_id': None, 'stock': {'$sum': '$quantity_remaining'}}}
+            ],
+            'as': 'batch'
+        }},
+        {'$addFields': {'batch_stock': {'$ifNull': [{'$arrayElemAt': ['$batch.stock', 0]}, 0]}}}
+    ]
@@ -11,31 +11,61 @@ This helps identify stock mismatches and data inconsistencies.
 
 import sys
 import os
-from pymongo import MongoClient
-import requests
 from datetime import datetime
-from tabulate import tabulate
 import json
 
+from batch_utils import parse_datetime, calculate_batch_stock, EMPTY_BATCH_INFO
+from stock_projection import project_stock, catalog_next_drops
+from db_connection import ConnectionOptions, add_connection_arguments
+from api_client import CustomerApiClient, RequestController
+from profiling import profiled, profile_run, add_profiling_arguments
+from stock_alerts import add_alert_arguments, alerts_from_args
+from reconcile import (
+    ReconciliationEngine, MongoProductSource, BatchTimelineSource, StockViewSource, CustomerApiSource
+)
+
+# pymongo, requests and tabulate are imported where they are used, so that
+# --help and the report commands start without loading them
+
 # Configuration
 MONGODB_URI = os.getenv('MONGODB_URI', 'mongodb://localhost:27017/')
 DATABASE_NAME = os.getenv('DATABASE_NAME', 'pos_system')
 API_BASE_URL = os.getenv('API_BASE_URL', 'https://pann-pos.netlify.app/api')
 
 class StockComparison:
-    def __init__(self, mongodb_uri=MONGODB_URI, db_name=DATABASE_NAME, api_url=API_BASE_URL):
-        """Initialize connection to MongoDB and API"""
+    def __init__(self, mongodb_uri=MONGODB_URI, db_name=DATABASE_NAME, api_url=API_BASE_URL, session=None, client=None,
+                 options=None):
+        """Initialize connection to MongoDB and API
+        
+        Pass ``client``/``session`` to share one MongoClient and HTTP session
+        with other tools in the same run; a shared client is not pinged or
+        closed here. ``options`` (db_connection.ConnectionOptions) tunes the
+        client and routes the comparison reads.
+        """
         try:
-            self.client = MongoClient(mongodb_uri, serverSelectionTimeoutMS=5000)
-            self.db = self.client[db_name]
+            if session is None:
+                import requests
+                session = requests.Session()
+            self.session = session
+            # One controller for every customer API call of this tool, so
+            # backoff and the circuit breaker see all of them
+            self.api_controller = RequestController(session)
+            
+            self.options = options or ConnectionOptions()
+            self._owns_client = client is None
+            if client is None:
+                client = self.options.client(mongodb_uri)
+            self.client = client
+            self.db = self.options.read_database(self.client, db_name)
             self.products_collection = self.db.products
             self.batches_collection = self.db.batches
             self.categories_collection = self.db.category
             self.api_url = api_url
             
             # Test connection
-            self.client.server_info()
-            print(f"✅ Connected to MongoDB: {db_name}")
+            if self._owns_client:
+                self.client.server_info()
+                print(f"✅ Connected to MongoDB: {db_name}")
             print(f"✅ API URL: {api_url}")
             print("=" * 80)
         except Exception as e:
@@ -45,199 +75,123 @@ class StockComparison:
     def get_cloud_products(self, include_deleted=False):
         """Get all products directly from MongoDB (cloud database)"""
         try:
-            query = {'isDeleted': {'$ne': True}} if not include_deleted else {}
-            products = list(self.products_collection.find(query))
-            
-            print(f"📦 Found {len(products)} products in cloud database")
-            return products
+            return MongoProductSource(self.products_collection, include_deleted=include_deleted).load()
         except Exception as e:
             print(f"❌ Error fetching cloud products: {e}")
             return []
     
     def get_api_products(self):
         """Get products from customer-facing API (what PANNRamyeonCorner sees)"""
-        try:
-            all_products = []
-            page = 1
-            limit = 100
-            
-            while True:
-                url = f"{self.api_url}/customer/products/"
-                params = {'page': page, 'limit': limit}
-                
-                response = requests.get(url, params=params, timeout=10)
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    if data.get('success') and data.get('data'):
-                        products = data['data'].get('products', [])
-                        all_products.extend(products)
-                        
-                        pagination = data['data'].get('pagination', {})
-                        if not pagination.get('has_next', False):
-                            break
-                        page += 1
-                    else:
-                        break
-                else:
-                    print(f"⚠️  API returned status {response.status_code}")
-                    break
-            
-            print(f"🌐 Found {len(all_products)} products from customer API")
-            return all_products
-        except Exception as e:
-            print(f"❌ Error fetching API products: {e}")
-            return []
+        return CustomerApiSource(self.session, self.api_url, controller=self.api_controller).load()
     
     def calculate_batch_stock(self, product_id):
         """Calculate actual stock from active batches (FIFO system)"""
         try:
-            now = datetime.utcnow()
-            
-            # Get all active batches for this product
-            batches = list(self.batches_collection.find({
-                'product_id': product_id,
-                'status': 'active',
-                'quantity_remaining': {'$gt': 0}
-            }))
-            
-            # Filter out expired batches
-            non_expired_batches = []
-            for batch in batches:
-                expiry_date = batch.get('expiry_date')
-                if not expiry_date:
-                    non_expired_batches.append(batch)
-                else:
-                    # Handle both datetime and string dates
-                    if isinstance(expiry_date, str):
-                        try:
-                            from dateutil import parser
-                            expiry_date = parser.parse(expiry_date)
-                        except Exception:
-                            non_expired_batches.append(batch)
-                            continue
-                    
-                    if isinstance(expiry_date, datetime) and expiry_date >= now:
-                        non_expired_batches.append(batch)
-            
-            # Calculate total stock from non-expired batches
-            total_stock = sum(batch['quantity_remaining'] for batch in non_expired_batches)
-            
-            return {
-                'total_stock': total_stock,
-                'active_batches': len(non_expired_batches),
-                'expired_batches': len(batches) - len(non_expired_batches)
-            }
+            return calculate_batch_stock(self.batches_collection, product_id)
         except Exception as e:
             print(f"❌ Error calculating batch stock for {product_id}: {e}")
-            return {'total_stock': 0, 'active_batches': 0, 'expired_batches': 0}
+            return dict(EMPTY_BATCH_INFO)
     
-    def compare_stocks(self, show_matches=False, export_file=None):
-        """Compare stock across all three sources"""
-        print("\n🔍 Starting Stock Comparison...\n")
+    def build_projection(self, timelines, now, projection_times=None, next_expiries=0):
+        """Project batch stock forward from the expiry timelines"""
+        projection_times = sorted(projection_times or [])
+        per_product = {}
         
-        # Fetch data from all sources
-        cloud_products = self.get_cloud_products()
-        api_products = self.get_api_products()
+        if projection_times:
+            for product_id, values in project_stock(timelines, projection_times).items():
+                per_product[product_id] = {
+                    'stock_at': {when.isoformat(): value for when, value in zip(projection_times, values)}
+                }
         
-        # Create lookup dictionaries
-        cloud_dict = {str(p['_id']): p for p in cloud_products}
-        api_dict = {str(p['_id']): p for p in api_products}
+        if next_expiries:
+            for product_id, timeline in timelines.items():
+                drops = timeline.next_drops(now, next_expiries)
+                if drops:
+                    per_product.setdefault(product_id, {})['next_drops'] = drops
         
-        # Comparison results
-        mismatches = []
-        matches = []
-        missing_from_api = []
+        catalog_totals = {
+            when.isoformat(): sum(timeline.stock_at(when) for timeline in timelines.values())
+            for when in projection_times
+        }
         
-        print(f"\n📊 Analyzing {len(cloud_dict)} products...\n")
+        return {
+            'as_of': now.isoformat(),
+            'times': [when.isoformat() for when in projection_times],
+            'catalog_stock_at': catalog_totals,
+            'catalog_next_drops': catalog_next_drops(timelines, now, next_expiries) if next_expiries else [],
+            'products': per_product
+        }
+    
+    def build_engine(self, product_ids=None, use_stock_view=False):
+        """ReconciliationEngine over this database and customer API"""
+        if use_stock_view:
+            batch_source = StockViewSource(self.db)
+        else:
+            batch_source = BatchTimelineSource(self.batches_collection, product_ids, self.options.batch_size)
         
-        for product_id, cloud_product in cloud_dict.items():
-            api_product = api_dict.get(product_id)
-            
-            # Get stock values
-            cloud_stock = int(cloud_product.get('stock', 0))
-            cloud_total_stock = int(cloud_product.get('total_stock', cloud_stock))
-            
-            # Calculate batch stock
-            batch_info = self.calculate_batch_stock(product_id)
-            batch_stock = batch_info['total_stock']
-            
-            product_name = cloud_product.get('product_name', 'Unknown')
-            sku = cloud_product.get('SKU', 'N/A')
-            
-            # Check if product appears in customer API
-            if api_product:
-                api_stock = int(api_product.get('stock', 0))
-                
-                # Check for mismatches
-                has_mismatch = False
-                mismatch_type = []
-                
-                if cloud_stock != api_stock:
-                    has_mismatch = True
-                    mismatch_type.append('cloud_vs_api')
-                
-                if cloud_stock != batch_stock:
-                    has_mismatch = True
-                    mismatch_type.append('cloud_vs_batch')
-                
-                if cloud_stock != cloud_total_stock:
-                    has_mismatch = True
-                    mismatch_type.append('stock_vs_total_stock')
-                
-                comparison = {
-                    'product_id': product_id,
-                    'product_name': product_name,
-                    'sku': sku,
-                    'cloud_stock': cloud_stock,
-                    'cloud_total_stock': cloud_total_stock,
-                    'api_stock': api_stock,
-                    'batch_stock': batch_stock,
-                    'active_batches': batch_info['active_batches'],
-                    'expired_batches': batch_info['expired_batches'],
-                    'status': cloud_product.get('status', 'N/A'),
-                    'has_mismatch': has_mismatch,
-                    'mismatch_type': ', '.join(mismatch_type) if mismatch_type else 'none'
-                }
-                
-                if has_mismatch:
-                    mismatches.append(comparison)
-                else:
-                    matches.append(comparison)
-            else:
-                # Product exists in cloud but not in API
-                # This could be normal if stock is 0 or status is not active
-                if cloud_stock > 0 and cloud_product.get('status') == 'active':
-                    missing_from_api.append({
-                        'product_id': product_id,
-                        'product_name': product_name,
-                        'sku': sku,
-                        'cloud_stock': cloud_stock,
-                        'cloud_total_stock': cloud_total_stock,
-                        'batch_stock': batch_stock,
-                        'status': cloud_product.get('status', 'N/A'),
-                        'reason': 'Missing from customer API despite having stock > 0'
-                    })
+        return ReconciliationEngine(
+            MongoProductSource(self.products_collection, product_ids, batch_size=self.options.batch_size,
+                               categories_collection=self.categories_collection),
+            batch_source,
+            CustomerApiSource(self.session, self.api_url, controller=self.api_controller)
+        )
+    
+    @profiled
+    def compare_stocks(self, show_matches=False, export_file=None, projection_times=None, next_expiries=0,
+                       use_stock_view=False, repair=None, product_ids=None, digest=None, alerts=None):
+        """Compare stock across all three sources
+        
+        Batch stock for the whole catalog is loaded with one query (or read
+        from product_stock_view). Pass a reconcile.RepairPlanner as
+        ``repair`` to fix the drift found in the same pass, and
+        ``product_ids`` to check only those products. ``digest`` (snapshot
+        summary) is stored with the results. ``alerts``
+        (stock_alerts.StockAlerts) gets every product's batch stock.
+        """
+        print("\n🔍 Starting Stock Comparison...\n")
+        
+        # Projection needs the timelines, so it always reads batches directly
+        projecting = bool(projection_times or next_expiries)
+        engine = self.build_engine(product_ids, use_stock_view and not projecting)
+        batch_source = engine.batch_source
+        now = datetime.utcnow()
+        results = engine.run(repair=repair, now=now, alerts=alerts)
+        
+        projection = None
+        if projecting:
+            projection = self.build_projection(batch_source.timelines, now, projection_times, next_expiries)
+        results['projection'] = projection
+        results['digest'] = digest
+        # Only the listed products were checked
+        results['partial'] = product_ids is not None
         
         # Display results
-        self._display_results(mismatches, matches, missing_from_api, show_matches)
+        self._display_results(results['mismatches'], results['matches'], results['missing_from_api'], show_matches)
+        self._display_categories(results['categories'])
+        if not results['api_complete']:
+            print("\n⚠️  The customer API listing was incomplete: missing-from-API and API stock")
+            print("   checks only cover the products it returned. Re-run when the API is healthy.")
+        if projection:
+            self._display_projection(projection, engine.products)
         
         # Export if requested
         if export_file:
-            self._export_results(mismatches, matches, missing_from_api, export_file)
+            self._export_results(results['mismatches'], results['matches'], results['missing_from_api'],
+                                 export_file, projection=projection, digest=digest,
+                                 api_complete=results['api_complete'], categories=results['categories'])
         
-        return {
-            'mismatches': mismatches,
-            'matches': matches,
-            'missing_from_api': missing_from_api,
-            'total_checked': len(cloud_dict),
-            'mismatch_count': len(mismatches),
-            'match_count': len(matches),
-            'missing_count': len(missing_from_api)
-        }
+        if alerts is not None:
+            results['alerts_sent'] = alerts.flush()
+        
+        if repair is not None:
+            results['repaired_count'] = repair.apply()
+        
+        return results
     
+    @profiled
     def _display_results(self, mismatches, matches, missing_from_api, show_matches):
         """Display comparison results in a formatted table"""
+        from tabulate import tabulate
         
         print("\n" + "=" * 80)
         print("📊 STOCK COMPARISON SUMMARY")
@@ -308,28 +262,110 @@ class StockComparison:
             if len(matches) > 20:
                 print(f"\n... and {len(matches) - 20} more matching products")
     
-    def _export_results(self, mismatches, matches, missing_from_api, filename):
-        """Export comparison results to a JSON file"""
+    def _display_projection(self, projection, cloud_dict):
+        """Display forward stock projection from batch expiry"""
+        from tabulate import tabulate
+        
+        print("\n" + "=" * 80)
+        print("⏳ STOCK PROJECTION (batch expiry)")
+        print("=" * 80)
+        
+        for when, total in projection['catalog_stock_at'].items():
+            print(f"   Catalog stock at {when}: {total}")
+        
+        drops = projection['catalog_next_drops']
+        if drops:
+            table_data = []
+            for drop in drops:
+                product = cloud_dict.get(drop['product_id'], {})
+                table_data.append([
+                    drop['expires_at'],
+                    product.get('product_name', 'Unknown')[:30],
+                    product.get('SKU', 'N/A'),
+                    drop['quantity'],
+                    drop['stock_after']
+                ])
+            
+            headers = ['Expires At', 'Product Name', 'SKU', 'Qty Dropping', 'Stock After']
+            print(tabulate(table_data, headers=headers, tablefmt='grid'))
+    
+    def _display_categories(self, categories, limit=15):
+        """Per-category rollup, most drifted categories first"""
+        from tabulate import tabulate
+        
+        if not categories:
+            return
+        
+        print("\n" + "=" * 80)
+        print("🗂️  STOCK BY CATEGORY")
+        print("=" * 80)
+        
+        table_data = []
+        for entry in categories[:limit]:
+            largest = ', '.join(f"{item['sku']} ({item['delta']:+d})" for item in entry['largest_deltas'])
+            table_data.append([
+                entry['category_name'][:25],
+                entry['products'],
+                entry['sellable_stock'],
+                entry['out_of_stock'],
+                entry['low_stock'],
+                entry['mismatch_count'],
+                entry['missing_count'],
+                largest or '-'
+            ])
+        
+        headers = ['Category', 'Products', 'Sellable Stock', 'Out of Stock', 'Low Stock', 'Mismatches', 'Missing', 'Largest Deltas']
+        print(tabulate(table_data, headers=headers, tablefmt='grid'))
+        if len(categories) > limit:
+            print(f"\n... and {len(categories) - limit} more categories (see the export)")
+    
+    @profiled
+    def _export_results(self, mismatches, matches, missing_from_api, filename, projection=None, digest=None,
+                        api_complete=True, categories=None):
+        """Export comparison results to a JSON file (NDJSON for .ndjson/.ndjson.gz names)
+
+        Rows are sorted by product_id so two exports can be diffed in one pass.
+        """
+        from report_diff import is_ndjson, write_ndjson_report
+        
         try:
+            by_product = lambda row: row['product_id']
+            mismatches = sorted(mismatches, key=by_product)
+            matches = sorted(matches, key=by_product)
+            missing_from_api = sorted(missing_from_api, key=by_product)
+            
             results = {
                 'generated_at': datetime.utcnow().isoformat(),
                 'summary': {
                     'total_mismatches': len(mismatches),
                     'total_matches': len(matches),
-                    'total_missing_from_api': len(missing_from_api)
+                    'total_missing_from_api': len(missing_from_api),
+                    'api_complete': api_complete
                 },
                 'mismatches': mismatches,
                 'matches': matches,
                 'missing_from_api': missing_from_api
             }
+            if categories:
+                results['categories'] = categories
+            if projection:
+                results['projection'] = projection
+            if digest:
+                results['digest'] = digest
             
-            with open(filename, 'w') as f:
-                json.dump(results, f, indent=2, default=str)
+            if is_ndjson(filename):
+                header = {key: value for key, value in results.items()
+                          if key not in ('mismatches', 'matches', 'missing_from_api')}
+                write_ndjson_report(filename, header, mismatches, matches, missing_from_api)
+            else:
+                with open(filename, 'w') as f:
+                    json.dump(results, f, indent=2, default=str)
             
             print(f"\n💾 Results exported to: {filename}")
         except Exception as e:
             print(f"❌ Error exporting results: {e}")
     
+    @profiled
     def check_specific_product(self, product_id):
         """Check stock for a specific product ID"""
         print(f"\n🔍 Checking product: {product_id}\n")
@@ -341,13 +377,13 @@ class StockComparison:
             return
         
         # Get from API
+        api_error = None
         try:
-            url = f"{self.api_url}/customer/products/{product_id}/"
-            response = requests.get(url, timeout=10)
-            api_product = response.json().get('data', {}).get('product') if response.status_code == 200 else None
+            api_product = CustomerApiClient(self.session, self.api_url, controller=self.api_controller).get_product(product_id)
         except Exception as e:
             print(f"❌ Error fetching from API: {e}")
             api_product = None
+            api_error = str(e)
         
         # Calculate batch stock
         batch_info = self.calculate_batch_stock(product_id)
@@ -364,7 +400,9 @@ class StockComparison:
         print(f"   Low Stock Threshold: {cloud_product.get('low_stock_threshold', 0)}")
         
         print(f"\n🌐 Customer API:")
-        if api_product:
+        if api_error:
+            print(f"   Status: Could not be checked ({api_error})")
+        elif api_product:
             print(f"   Stock: {api_product.get('stock', 0)}")
             print(f"   Status: Visible in API")
         else:
@@ -383,15 +421,140 @@ class StockComparison:
         if api_product and cloud_product.get('stock', 0) != api_product.get('stock', 0):
             print(f"   ⚠️  MISMATCH: Cloud stock ({cloud_product.get('stock', 0)}) != API stock ({api_product.get('stock', 0)})")
         
-        if not api_product and cloud_product.get('stock', 0) > 0:
+        if not api_product and not api_error and cloud_product.get('stock', 0) > 0:
             print(f"   ⚠️  ISSUE: Product has stock but not visible in customer API")
         
         print("=" * 80)
     
     def close(self):
-        """Close MongoDB connection"""
-        self.client.close()
-        print("\n✅ Connection closed")
+        """Close MongoDB connection (unless it is shared)"""
+        if self._owns_client:
+            self.client.close()
+            print("\n✅ Connection closed")
+
+
+def add_compare_arguments(parser):
+    """Add the comparison options (shared with stock_tools.py)"""
+    parser.add_argument('--show-matches', action='store_true', help='Show matching products too')
+    parser.add_argument('--export', type=str, help='Export results to JSON file')
+    parser.add_argument('--project-at', type=str, action='append', metavar='ISO_TIME',
+                        help='Project batch stock at a future UTC time (repeatable), e.g. 2025-12-10T18:00')
+    parser.add_argument('--next-expiries', type=int, default=0, metavar='N',
+                        help='List the next N expiry drops per product and for the whole catalog')
+    parser.add_argument('--use-stock-view', action='store_true',
+                        help='Read batch stock from the incrementally maintained product_stock_view')
+    parser.add_argument('--digest', type=str, metavar='SNAPSHOT',
+                        help='Only check products changed since this digest snapshot, then update it')
+    parser.add_argument('--history-db', type=str, metavar='FILE',
+                        help='Append this run and its mismatches to a SQLite history store')
+    add_alert_arguments(parser)
+
+
+def add_cassette_arguments(parser):
+    """Add the HTTP cassette options (shared with stock_tools.py)"""
+    parser.add_argument('--cassette', type=str, help='Replay customer API responses from this cassette file')
+    parser.add_argument('--record', action='store_true', help='Record customer API responses into --cassette instead of replaying')
+
+
+def parse_projection_times(parser, args):
+    """Turn --project-at values into datetimes"""
+    projection_times = []
+    for value in args.project_at or []:
+        when = parse_datetime(value)
+        if when is None:
+            parser.error(f'Invalid --project-at time: {value}')
+        projection_times.append(when)
+    return projection_times
+
+
+def open_session(args):
+    """Create the HTTP session, mounting a cassette if requested
+
+    Returns (session, cassette or None).
+    """
+    import requests
+    
+    session = requests.Session()
+    cassette = None
+    if args.cassette:
+        from http_cassette import use_cassette, RECORD, REPLAY
+        cassette = use_cassette(session, args.cassette, RECORD if args.record else REPLAY)
+        print(f"📼 Cassette {'recording' if args.record else 'replay'}: {args.cassette}")
+    return session, cassette
+
+
+def run_comparison(comparison, args, projection_times, repair=None):
+    """Run a full comparison and print the closing summary"""
+    product_ids = None
+    snapshot = None
+    digest = None
+    if args.digest:
+        from digest import changed_since
+        product_ids, snapshot, _ = changed_since(comparison.db, args.digest)
+        digest = {
+            'snapshot': args.digest,
+            'hash': snapshot.hash_mode,
+            'root': snapshot.root,
+            'changed_products': None if product_ids is None else len(product_ids)
+        }
+    
+    if product_ids is not None and not product_ids:
+        # Nothing changed since the snapshot: skip the reads and the API listing
+        print("\n🌳 No ranges changed since the digest snapshot; nothing to compare")
+        results = {
+            'mismatches': [], 'matches': [], 'missing_from_api': [],
+            'total_checked': 0, 'mismatch_count': 0, 'match_count': 0, 'missing_count': 0,
+            'api_complete': None, 'categories': [], 'projection': None, 'digest': digest, 'partial': True
+        }
+        snapshot.save(args.digest)
+        return results
+    
+    results = comparison.compare_stocks(
+        show_matches=args.show_matches,
+        export_file=args.export,
+        projection_times=projection_times,
+        next_expiries=args.next_expiries,
+        use_stock_view=args.use_stock_view,
+        repair=repair,
+        product_ids=product_ids,
+        digest=digest,
+        alerts=alerts_from_args(args)
+    )
+    
+    # Only record the new state once the changed products have been checked
+    if snapshot is not None:
+        snapshot.save(args.digest)
+        print(f"🌳 Digest snapshot saved: {args.digest}")
+    
+    if getattr(args, 'history_db', None) and results.get('partial'):
+        # Only the changed products were checked; recording the run would
+        # make drifters count the unchanged mismatches one run short
+        print(f"🗃️  Digest run covers only changed products; not recorded in {args.history_db}")
+    elif getattr(args, 'history_db', None):
+        from history_store import HistoryStore
+        store = HistoryStore(args.history_db)
+        try:
+            run_id = store.record_run(results, database=comparison.db.name)
+        finally:
+            store.close()
+        print(f"🗃️  Run {run_id} recorded in history: {args.history_db}")
+    
+    # Print summary
+    print("\n" + "=" * 80)
+    print("✅ Comparison Complete!")
+    print("=" * 80)
+    print(f"Total Products Checked: {results['total_checked']}")
+    print(f"Mismatches: {results['mismatch_count']}")
+    print(f"Matches: {results['match_count']}")
+    print(f"Missing from API: {results['missing_count']}")
+    
+    if results['mismatch_count'] > 0:
+        print(f"\n⚠️  Found {results['mismatch_count']} products with stock mismatches!")
+        print("   Please review the detailed report above.")
+    else:
+        print("\n✅ All product stocks are in sync!")
+    
+    return results
 
 
 def main():
@@ -402,49 +565,45 @@ def main():
     parser.add_argument('--mongodb-uri', default=MONGODB_URI, help='MongoDB connection URI')
     parser.add_argument('--db-name', default=DATABASE_NAME, help='Database name')
     parser.add_argument('--api-url', default=API_BASE_URL, help='API base URL')
-    parser.add_argument('--show-matches', action='store_true', help='Show matching products too')
-    parser.add_argument('--export', type=str, help='Export results to JSON file')
     parser.add_argument('--product-id', type=str, help='Check specific product ID only')
+    add_compare_arguments(parser)
+    add_cassette_arguments(parser)
+    add_connection_arguments(parser)
+    add_profiling_arguments(parser)
     
     args = parser.parse_args()
     
-    # Initialize comparison tool
-    comparison = StockComparison(
-        mongodb_uri=args.mongodb_uri,
-        db_name=args.db_name,
-        api_url=args.api_url
-    )
+    projection_times = parse_projection_times(parser, args)
     
-    try:
-        if args.product_id:
-            # Check specific product
-            comparison.check_specific_product(args.product_id)
-        else:
-            # Full comparison
-            results = comparison.compare_stocks(
-                show_matches=args.show_matches,
-                export_file=args.export
-            )
-            
-            # Print summary
-            print("\n" + "=" * 80)
-            print("✅ Comparison Complete!")
-            print("=" * 80)
-            print(f"Total Products Checked: {results['total_checked']}")
-            print(f"Mismatches: {results['mismatch_count']}")
-            print(f"Matches: {results['match_count']}")
-            print(f"Missing from API: {results['missing_count']}")
-            
-            if results['mismatch_count'] > 0:
-                print(f"\n⚠️  Found {results['mismatch_count']} products with stock mismatches!")
-                print("   Please review the detailed report above.")
-            else:
-                print("\n✅ All product stocks are in sync!")
+    if args.record and not args.cassette:
+        parser.error('--record requires --cassette')
     
-    finally:
-        comparison.close()
+    with profile_run(args):
+        session, cassette = open_session(args)
+        
+        # Initialize comparison tool
+        comparison = StockComparison(
+            mongodb_uri=args.mongodb_uri,
+            db_name=args.db_name,
+            api_url=args.api_url,
+            session=session,
+            options=ConnectionOptions.from_args(args)
+        )
+        
+        try:
+            if args.product_id:
+                # Check specific product
+                comparison.check_specific_product(args.product_id)
+            else:
+                # Full comparison
+                run_comparison(comparison, args, projection_times)
+        
+        finally:
+            comparison.close()
+            comparison.options.print_traffic()
+            if cassette:
+                cassette.save()
 
 
 if __name__ == '__main__':
     main()
-
@@ -0,0 +1,169 @@
+"""
+MongoDB Connection Options
+==========================
+Builds the MongoClient used by the stock tools with tunable settings:
+
+- maxPoolSize: connections per server (default 100, like pymongo)
+- compressors: wire compression, e.g. zstd,snappy,zlib (zstd needs the
+  `zstandard` package, snappy needs `python-snappy`; unavailable ones are
+  skipped by pymongo with a warning)
+- batch size: documents per cursor batch for the large catalog reads
+- read preference: comparison reads can go to secondaries
+  (secondaryPreferred + maxStalenessSeconds) to keep load off the primary
+  that serves live orders. Repairs always read and write on the primary.
+
+With --wire-stats a command listener counts commands and BSON bytes sent
+and received per run. Sizes are measured before wire compression, so they
+show how much data the tools move rather than the compressed byte count.
+
+confirm_mode() is the dry-run/live prompt every writing tool shows first.
+"""
+
+import os
+
+# pymongo is imported where it is used, so the tools' --help stays fast
+
+DEFAULT_BATCH_SIZE = 5000
+SERVER_SELECTION_TIMEOUT_MS = 5000
+# Write operations per bulk_write call in the repair and archival tools
+BULK_CHUNK_SIZE = 500
+
+# Local SQLite run history (history_store.py); here so the CLI can show the
+# defaults without importing sqlite3
+HISTORY_DB = os.getenv('STOCK_HISTORY_DB', 'stock_history.db')
+HISTORY_RETENTION_DAYS = int(os.getenv('HISTORY_RETENTION_DAYS', '180'))
+
+READ_PREFERENCES = ('primary', 'primaryPreferred', 'secondary', 'secondaryPreferred', 'nearest')
+
+
+class TrafficCounter:
+    """Counts commands and BSON bytes sent to / received from MongoDB"""
+
+    def __init__(self):
+        self.commands = {}
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def listener(self):
+        """pymongo CommandListener feeding this counter"""
+        from bson import encode
+        from pymongo import monitoring
+
+        counter = self
+
+        class Listener(monitoring.CommandListener):
+            def started(self, event):
+                counter.bytes_sent += len(encode(event.command))
+                counter.commands[event.command_name] = counter.commands.get(event.command_name, 0) + 1
+
+            def succeeded(self, event):
+                counter.bytes_received += len(encode(event.reply))
+
+            def failed(self, event):
+                pass
+
+        return Listener()
+
+    def print_report(self):
+        print("\n📡 MongoDB traffic (BSON, before compression):")
+        print(f"   Sent:     {self.bytes_sent / 1024:,.1f} KiB")
+        print(f"   Received: {self.bytes_received / 1024:,.1f} KiB")
+        for name, count in sorted(self.commands.items(), key=lambda entry: -entry[1]):
+            print(f"   {name:<12} {count}")
+
+
+class ConnectionOptions:
+    def __init__(self, max_pool_size=None, compressors=None, batch_size=DEFAULT_BATCH_SIZE,
+                 read_preference='primary', max_staleness=None, wire_stats=False):
+        """Client settings shared by the tools of one run"""
+        self.max_pool_size = max_pool_size
+        self.compressors = compressors
+        self.batch_size = batch_size
+        self.read_preference = read_preference
+        self.max_staleness = max_staleness
+        self.traffic = TrafficCounter() if wire_stats else None
+
+    @classmethod
+    def from_args(cls, args):
+        """Build options from parsed add_connection_arguments() flags"""
+        return cls(
+            max_pool_size=getattr(args, 'max_pool_size', None),
+            compressors=getattr(args, 'compressors', None),
+            batch_size=getattr(args, 'batch_size', DEFAULT_BATCH_SIZE),
+            read_preference=getattr(args, 'read_preference', 'primary'),
+            max_staleness=getattr(args, 'max_staleness', None),
+            wire_stats=getattr(args, 'wire_stats', False)
+        )
+
+    def client(self, mongodb_uri):
+        """Create a MongoClient (not yet connected)"""
+        from pymongo import MongoClient
+
+        kwargs = {'serverSelectionTimeoutMS': SERVER_SELECTION_TIMEOUT_MS}
+        if self.max_pool_size:
+            kwargs['maxPoolSize'] = self.max_pool_size
+        if self.compressors:
+            kwargs['compressors'] = self.compressors
+        if self.traffic is not None:
+            kwargs['event_listeners'] = [self.traffic.listener()]
+        return MongoClient(mongodb_uri, **kwargs)
+
+    def read_database(self, client, db_name):
+        """Database handle for comparison reads, honouring the read preference
+
+        The preference is set per database, so a client shared with the
+        fixer keeps its writes (and the fixer's reads) on the primary.
+        """
+        from pymongo import read_preferences
+
+        if self.read_preference == 'primary':
+            return client[db_name]
+
+        mode = {
+            'primaryPreferred': read_preferences.PrimaryPreferred,
+            'secondary': read_preferences.Secondary,
+            'secondaryPreferred': read_preferences.SecondaryPreferred,
+            'nearest': read_preferences.Nearest
+        }[self.read_preference]
+        preference = mode(max_staleness=self.max_staleness) if self.max_staleness else mode()
+        return client.get_database(db_name, read_preference=preference)
+
+    def print_traffic(self):
+        if self.traffic is not None:
+            self.traffic.print_report()
+
+
+def add_connection_arguments(parser, reads=True):
+    """Add the client tuning options; ``reads`` adds the read preference flags"""
+    parser.add_argument('--max-pool-size', type=int, help='MongoDB connections per server (default 100)')
+    parser.add_argument('--compressors', type=str, metavar='LIST',
+                        help='Wire compression, e.g. zstd,snappy,zlib (first one the server supports wins)')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help=f'Documents per cursor batch for catalog reads (default {DEFAULT_BATCH_SIZE})')
+    parser.add_argument('--wire-stats', action='store_true', help='Report MongoDB commands and bytes transferred')
+    if reads:
+        parser.add_argument('--read-preference', choices=READ_PREFERENCES, default='primary',
+                            help='Where comparison reads go; repairs always use the primary')
+        parser.add_argument('--max-staleness', type=int, metavar='SECONDS',
+                            help='With a secondary read preference: skip secondaries lagging more than this (min 90)')
+
+
+def confirm_mode(dry_run, assume_yes=False):
+    """Announce dry-run/live mode; live mode needs a typed 'yes' unless assume_yes"""
+    if dry_run:
+        print("\n" + "=" * 80)
+        print("⚠️  DRY RUN MODE - No changes will be made to the database")
+        print("   Use --live flag to execute actual fixes")
+        print("=" * 80 + "\n")
+        return True
+
+    print("\n" + "=" * 80)
+    print("🚨 LIVE MODE - This will modify the database!")
+    print("=" * 80)
+    if not assume_yes:
+        response = input("\nAre you sure you want to continue? (yes/no): ")
+        if response.lower() != 'yes':
+            print("Aborted.")
+            return False
+    print()
+    return True
@@ -0,0 +1,368 @@
+"""
+Range Digests for Changed-Product Detection
+===========================================
+Keeps a Merkle-style snapshot of the catalog so a run can find the products
+that changed since the last verified state without reading every product.
+
+Each product is hashed over (_id, stock, total_stock, status, batch_stock).
+Products are cut into _id ranges of LEAF_SIZE, and each range's digest is the
+XOR of its product hashes; FANOUT ranges combine into a parent range, up to
+a top level of at most FANOUT ranges.
+
+Diffing against a snapshot computes range digests inside MongoDB with one
+aggregation per level ($toHashedIndexKey + $bitXor, MongoDB 7.0+), descends
+only into ranges whose digest changed, and pulls per-product hashes only for
+the changed leaf ranges. Transfer is O(changed ranges), not O(catalog).
+
+Servers without those operators fall back to hashing on the client, which
+reads every product once but still reports the same changes. Snapshots
+remember which hash they were built with; switching modes forces a full
+comparison.
+"""
+
+import sys
+import os
+import gzip
+import json
+import hashlib
+from bisect import bisect_left
+from datetime import datetime
+
+from batch_utils import batch_stock_stages
+from stock_projection import build_timelines
+
+# Configuration
+MONGODB_URI = os.getenv('MONGODB_URI', 'mongodb://localhost:27017/')
+DATABASE_NAME = os.getenv('DATABASE_NAME', 'pos_system')
+
+SNAPSHOT_VERSION = 1
+LEAF_SIZE = 256
+FANOUT = 16
+
+SERVER_HASH = 'server'
+CLIENT_HASH = 'client'
+
+# $bucket key for _ids outside the snapshot's boundaries (new products)
+OUTSIDE = -1
+
+PRODUCT_QUERY = {'isDeleted': {'$ne': True}}
+
+
+def row_key(product_id, stock, total_stock, status, batch_stock):
+    """Canonical string hashed for one product"""
+    return '|'.join(str(value) if value is not None else '' for value in (product_id, stock, total_stock, status, batch_stock))
+
+
+def client_hash(key):
+    """Signed 64-bit hash of a row key (client-side mode)"""
+    return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'little', signed=True)
+
+
+def xor_all(values):
+    digest = 0
+    for value in values:
+        digest ^= value
+    return digest
+
+
+def build_levels(rows, leaf_size=LEAF_SIZE, fanout=FANOUT):
+    """Range tree over {product_id: hash}; levels[0] is the top level
+
+    Each level is {'bounds': [...], 'digests': [...], 'counts': [...]} where
+    range i covers bounds[i] <= _id < bounds[i + 1].
+    """
+    ids = sorted(rows)
+    if not ids:
+        return []
+
+    # The last bound sorts after every id sharing the last id as a prefix
+    bounds = ids[::leaf_size] + [ids[-1] + '\uffff']
+    digests = []
+    counts = []
+    for start in range(0, len(ids), leaf_size):
+        chunk = ids[start:start + leaf_size]
+        digests.append(xor_all(rows[product_id] for product_id in chunk))
+        counts.append(len(chunk))
+
+    levels = [{'bounds': bounds, 'digests': digests, 'counts': counts}]
+    while len(levels[0]['digests']) > fanout:
+        child = levels[0]
+        size = len(child['digests'])
+        levels.insert(0, {
+            'bounds': child['bounds'][:-1:fanout] + [child['bounds'][-1]],
+            'digests': [xor_all(child['digests'][i:i + fanout]) for i in range(0, size, fanout)],
+            'counts': [sum(child['counts'][i:i + fanout]) for i in range(0, size, fanout)]
+        })
+    return levels
+
+
+class DigestSnapshot:
+    def __init__(self, rows, hash_mode, created_at=None):
+        """Per-product hashes plus the range tree built from them"""
+        self.rows = rows
+        self.hash_mode = hash_mode
+        self.created_at = created_at or datetime.utcnow()
+        self.levels = build_levels(rows)
+        self._sorted_ids = None
+
+    @property
+    def root(self):
+        """Digest of the whole catalog"""
+        return xor_all(self.levels[0]['digests']) if self.levels else 0
+
+    def ids_in_range(self, low, high):
+        """Product IDs with low <= _id < high"""
+        if self._sorted_ids is None:
+            self._sorted_ids = sorted(self.rows)
+        return self._sorted_ids[bisect_left(self._sorted_ids, low):bisect_left(self._sorted_ids, high)]
+
+    def save(self, path):
+        """Write the snapshot as gzipped JSON (the tree is rebuilt on load)"""
+        with gzip.open(path, 'wt', encoding='utf-8') as f:
+            json.dump({
+                'digest': SNAPSHOT_VERSION,
+                'created_at': self.created_at.isoformat(),
+                'hash': self.hash_mode,
+                'root': self.root,
+                'rows': self.rows
+            }, f)
+
+    @classmethod
+    def load(cls, path):
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('digest') != SNAPSHOT_VERSION:
+            raise ValueError(f"Not a stock digest snapshot: {path}")
+        return cls(data['rows'], data['hash'], datetime.fromisoformat(data['created_at']))
+
+
+class RangeDigest:
+    def __init__(self, db):
+        """Compute product digests for a database"""
+        self.products_collection = db.products
+        self.batches_collection = db.batches
+        self.hash_mode = None
+        self.stats = {'ranges_compared': 0, 'rows_pulled': 0}
+
+    def _hashed_pipeline(self, match):
+        """Stages producing {_id, h} per product, hashed inside MongoDB"""
+        def text(expression):
+            return {'$ifNull': [{'$toString': expression}, '']}
+
+        key = {'$concat': [
+            text('$_id'), '|',
+            text({'$ifNull': ['$stock', 0]}), '|',
+            text({'$ifNull': ['$total_stock', {'$ifNull': ['$stock', 0]}]}), '|',
+            text('$status'), '|',
+            text('$batch_stock')
+        ]}
+        return [{'$match': match}] + batch_stock_stages(self.batches_collection.name) + [
+            {'$project': {'h': {'$toHashedIndexKey': key}}}
+        ]
+
+    def _server_supported(self):
+        """Probe once whether the server has the operators server mode needs"""
+        if self.hash_mode is None:
+            from pymongo.errors import OperationFailure
+
+            try:
+                list(self.products_collection.aggregate([
+                    {'$limit': 1},
+                    {'$project': {'h': {'$bitXor': [{'$toHashedIndexKey': 'probe'}, {'$toLong': 0}]}}}
+                ]))
+                self.hash_mode = SERVER_HASH
+            except OperationFailure:
+                print("⚠️  Server lacks $toHashedIndexKey/$bitXor (MongoDB 7.0+); hashing on the client")
+                self.hash_mode = CLIENT_HASH
+        return self.hash_mode == SERVER_HASH
+
+    def _client_rows(self):
+        """Hash every product on the client (reads the whole catalog)"""
+        now = datetime.utcnow()
+        timelines = build_timelines(self.batches_collection)
+        rows = {}
+        projection = {'stock': 1, 'total_stock': 1, 'status': 1}
+        for product in self.products_collection.find(PRODUCT_QUERY, projection, batch_size=5000):
+            product_id = str(product['_id'])
+            stock = int(product.get('stock', 0))
+            total_stock = int(product.get('total_stock', stock))
+            timeline = timelines.get(product_id)
+            batch_stock = timeline.stock_at(now) if timeline else 0
+            rows[product_id] = client_hash(row_key(product_id, stock, total_stock, product.get('status'), batch_stock))
+        self.stats['rows_pulled'] += len(rows)
+        return rows
+
+    def _server_rows(self, match):
+        rows = {str(row['_id']): row['h'] for row in self.products_collection.aggregate(self._hashed_pipeline(match))}
+        self.stats['rows_pulled'] += len(rows)
+        return rows
+
+    def _level_digests(self, level, candidates):
+        """(digest, count) per candidate range of one level, plus the OUTSIDE bucket"""
+        bounds = level['bounds']
+        match = dict(PRODUCT_QUERY)
+        if len(candidates) < len(level['digests']):
+            match['$or'] = [{'_id': {'$gte': bounds[i], '$lt': bounds[i + 1]}} for i in candidates]
+
+        pipeline = self._hashed_pipeline(match) + [
+            {'$bucket': {
+                'groupBy': '$_id',
+                'boundaries': bounds,
+                'default': OUTSIDE,
+                'output': {'count': {'$sum': 1}, 'hashes': {'$push': '$h'}}
+            }},
+            {'$project': {
+                'count': 1,
+                'digest': {'$reduce': {
+                    'input': '$hashes',
+                    'initialValue': {'$toLong': 0},
+                    'in': {'$bitXor': ['$$value', '$$this']}
+                }}
+            }}
+        ]
+
+        index = {bound: i for i, bound in enumerate(bounds[:-1])}
+        digests = {}
+        outside = (0, 0)
+        for bucket in self.products_collection.aggregate(pipeline, allowDiskUse=True):
+            if bucket['_id'] == OUTSIDE:
+                outside = (bucket['digest'], bucket['count'])
+            else:
+                digests[index[bucket['_id']]] = (bucket['digest'], bucket['count'])
+        self.stats['ranges_compared'] += len(candidates)
+        return digests, outside
+
+    def snapshot(self):
+        """Hash the whole catalog into a new snapshot"""
+        if self._server_supported():
+            rows = self._server_rows(dict(PRODUCT_QUERY))
+        else:
+            rows = self._client_rows()
+        return DigestSnapshot(rows, self.hash_mode)
+
+    def diff(self, previous):
+        """Products changed since ``previous``
+
+        Returns (changed_product_ids, new_snapshot). Added and removed
+        products count as changed.
+        """
+        if not self._server_supported() or previous.hash_mode != self.hash_mode or not previous.levels:
+            current = self.snapshot()
+            return _changed_rows(previous.rows, current.rows), current
+
+        levels = previous.levels
+        candidates = list(range(len(levels[0]['digests'])))
+        changed_leaves = []
+        outside_changed = False
+
+        for depth, level in enumerate(levels):
+            digests, outside = self._level_digests(level, candidates)
+            if depth == 0:
+                outside_changed = outside[1] > 0
+
+            changed = [
+                i for i in candidates
+                if digests.get(i, (0, 0)) != (level['digests'][i], level['counts'][i])
+            ]
+            if depth == len(levels) - 1:
+                changed_leaves = changed
+                break
+
+            child_count = len(levels[depth + 1]['digests'])
+            candidates = [child for i in changed for child in range(i * FANOUT, min((i + 1) * FANOUT, child_count))]
+            if not candidates:
+                break
+
+        leaf_bounds = levels[-1]['bounds']
+        ranges = [(leaf_bounds[i], leaf_bounds[i + 1]) for i in changed_leaves]
+        clauses = [{'_id': {'$gte': low, '$lt': high}} for low, high in ranges]
+        if outside_changed:
+            clauses += [{'_id': {'$lt': leaf_bounds[0]}}, {'_id': {'$gte': leaf_bounds[-1]}}]
+
+        rows = dict(previous.rows)
+        changed_ids = []
+        if clauses:
+            fresh = self._server_rows(dict(PRODUCT_QUERY, **{'$or': clauses}))
+            stale = {}
+            for low, high in ranges:
+                for product_id in previous.ids_in_range(low, high):
+                    stale[product_id] = rows.pop(product_id)
+            changed_ids = _changed_rows(stale, fresh)
+            rows.update(fresh)
+
+        return changed_ids, DigestSnapshot(rows, self.hash_mode)
+
+
+def _changed_rows(before, after):
+    """IDs added, removed or rehashed between two {product_id: hash} maps"""
+    changed = [product_id for product_id, value in after.items() if before.get(product_id) != value]
+    changed.extend(product_id for product_id in before if product_id not in after)
+    return sorted(changed)
+
+
+def changed_since(db, path):
+    """Products changed since the snapshot at ``path``
+
+    Returns (product_ids or None when there is no snapshot yet, new snapshot,
+    RangeDigest with transfer stats). Save the new snapshot once the changed
+    products have been verified.
+    """
+    digest = RangeDigest(db)
+    if not os.path.exists(path):
+        print(f"🌳 No digest snapshot at {path}; checking the whole catalog")
+        return None, digest.snapshot(), digest
+
+    previous = DigestSnapshot.load(path)
+    product_ids, current = digest.diff(previous)
+    print(f"🌳 {len(product_ids)} products changed since {previous.created_at.isoformat()} "
+          f"({digest.stats['ranges_compared']} ranges compared, {digest.stats['rows_pulled']} rows pulled, "
+          f"{len(current.rows)} products in catalog)")
+    return product_ids, current, digest
+
+
+def main():
+    """Main entry point"""
+    import argparse
+    from pymongo import MongoClient
+
+    parser = argparse.ArgumentParser(description='Find products changed since the last digest snapshot')
+    parser.add_argument('--mongodb-uri', default=MONGODB_URI, help='MongoDB connection URI')
+    parser.add_argument('--db-name', default=DATABASE_NAME, help='Database name')
+    parser.add_argument('--snapshot', required=True, help='Digest snapshot file (.json.gz), updated after the run')
+    parser.add_argument('--rebuild', action='store_true', help='Ignore the existing snapshot and hash the whole catalog')
+
+    args = parser.parse_args()
+
+    try:
+        client = MongoClient(args.mongodb_uri, serverSelectionTimeoutMS=5000)
+        client.server_info()
+        print(f"✅ Connected to MongoDB: {args.db_name}")
+    except Exception as e:
+        print(f"❌ Failed to connect to MongoDB: {e}")
+        sys.exit(1)
+
+    try:
+        db = client[args.db_name]
+        if args.rebuild:
+            digest = RangeDigest(db)
+            snapshot = digest.snapshot()
+            product_ids = None
+        else:
+            product_ids, snapshot, digest = changed_since(db, args.snapshot)
+
+        if product_ids:
+            for product_id in product_ids[:20]:
+                print(f"   - {product_id}")
+            if len(product_ids) > 20:
+                print(f"   ... and {len(product_ids) - 20} more")
+
+        snapshot.save(args.snapshot)
+        print(f"💾 Snapshot saved: {args.snapshot} ({len(snapshot.rows)} products, {snapshot.hash_mode} hash, "
+              f"root {snapshot.root & 0xFFFFFFFFFFFFFFFF:016x})")
+    finally:
+        client.close()
+        print("\n✅ Connection closed")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,336 @@
+"""
+FIFO Consumption Audit Tool
+===========================
+Verifies that sales were deducted from batches the way
+BatchService.process_sale_fifo() is supposed to do it:
+
+1. Loads each product's batches ordered by date_received
+2. Replays every usage_history[] entry in time order through a
+   priority-queue FIFO simulation
+3. Compares the simulated result with each batch's quantity_remaining
+
+Findings:
+- out_of_order: a newer batch was used while an older, non-expired batch
+  still had stock
+- consumed_before_received: a batch was used before its date_received
+- double_deduction: the same sale was deducted twice from one batch
+- expired_consumed: a batch was used after its expiry_date
+- over_deduction: more was deducted from a batch than it ever held
+- remaining_mismatch: replayed usage doesn't explain quantity_remaining
+
+Batches are streamed from MongoDB one product at a time, so memory stays
+bounded by the largest product rather than the whole collection.
+Usage entries moved out by archive_history.py are merged back in from
+the archive collection, so archived sales are still replayed.
+"""
+
+import sys
+import os
+import heapq
+import time
+from itertools import groupby
+from pymongo import MongoClient
+from datetime import datetime
+from tabulate import tabulate
+import json
+
+from batch_utils import parse_datetime
+from archive_history import archive_collection_name
+
+# Configuration
+MONGODB_URI = os.getenv('MONGODB_URI', 'mongodb://localhost:27017/')
+DATABASE_NAME = os.getenv('DATABASE_NAME', 'pos_system')
+
+# Field names used by BatchService; the first one present wins
+INITIAL_QTY_FIELDS = ('quantity_received', 'initial_quantity', 'original_quantity')
+USAGE_QTY_FIELDS = ('quantity_used', 'quantity', 'qty')
+USAGE_TIME_FIELDS = ('used_at', 'timestamp', 'date', 'created_at')
+USAGE_REF_FIELDS = ('order_id', 'transaction_id', 'sale_id', 'reference')
+
+BATCH_PROJECTION = dict.fromkeys(
+    ('product_id', 'date_received', 'expiry_date', 'quantity_remaining', 'usage_history') + INITIAL_QTY_FIELDS,
+    1
+)
+
+
+def _first(doc, fields):
+    """Return the first present, non-None field value"""
+    for field in fields:
+        value = doc.get(field)
+        if value is not None:
+            return value
+    return None
+
+
+def audit_product(product_id, batches):
+    """Replay one product's usage history through a FIFO simulation
+
+    ``batches`` must be ordered by date_received; the list position is the
+    FIFO rank. Returns (findings, usage_record_count).
+    """
+    findings = []
+    received = []
+    expiry = []
+    remaining = []
+    events = []
+    untimed = []
+    inferred = []
+
+    for rank, batch in enumerate(batches):
+        usage = batch.get('usage_history') or []
+        received.append(parse_datetime(batch.get('date_received')))
+        expiry.append(parse_datetime(batch.get('expiry_date')))
+
+        timed = []
+        used_total = 0
+        for seq, entry in enumerate(usage):
+            qty = int(_first(entry, USAGE_QTY_FIELDS) or 0)
+            used_total += qty
+            event = (parse_datetime(_first(entry, USAGE_TIME_FIELDS)), rank, seq, _first(entry, USAGE_REF_FIELDS), qty)
+            if event[0] is None:
+                untimed.append(event)
+            else:
+                timed.append(event)
+
+        initial = _first(batch, INITIAL_QTY_FIELDS)
+        if initial is None:
+            # No recorded starting quantity: assume history explains the remainder
+            initial = int(batch.get('quantity_remaining', 0)) + used_total
+            inferred.append(True)
+        else:
+            inferred.append(False)
+        remaining.append(int(initial))
+
+        # usage_history is appended chronologically; sort is O(n) when it is
+        timed.sort()
+        events.append(timed)
+
+    def flag(kind, rank, detail):
+        batch = batches[rank]
+        findings.append({
+            'product_id': product_id,
+            'batch_id': str(batch.get('_id')),
+            'type': kind,
+            'detail': detail
+        })
+
+    # Batches not yet received, as a FIFO-ordered queue of ranks
+    arrivals = sorted(range(len(batches)), key=lambda r: (received[r] is not None, received[r] or datetime.min, r))
+    next_arrival = 0
+    available = []
+    seen_refs = set()
+    over_flagged = set()
+    record_count = 0
+
+    def deduct(rank, ref, qty, when):
+        if ref is not None:
+            key = (ref, rank)
+            if key in seen_refs:
+                flag('double_deduction', rank, f"{ref} deducted more than once")
+            seen_refs.add(key)
+
+        remaining[rank] -= qty
+        if remaining[rank] < 0 and rank not in over_flagged:
+            over_flagged.add(rank)
+            flag('over_deduction', rank, f"deducted {-remaining[rank]} more than received (at {when})")
+
+    for when, rank, _seq, ref, qty in heapq.merge(*events):
+        record_count += 1
+
+        # Admit every batch received by this point in time
+        while next_arrival < len(arrivals):
+            candidate = arrivals[next_arrival]
+            if received[candidate] is not None and received[candidate] > when:
+                break
+            heapq.heappush(available, candidate)
+            next_arrival += 1
+
+        if received[rank] is not None and received[rank] > when:
+            flag('consumed_before_received', rank, f"used at {when}, received {received[rank]}")
+
+        if expiry[rank] is not None and expiry[rank] < when:
+            flag('expired_consumed', rank, f"used at {when}, expired {expiry[rank]}")
+
+        # Drop batches that are empty or already expired at sale time
+        while available and (remaining[available[0]] <= 0 or (expiry[available[0]] is not None and expiry[available[0]] < when)):
+            heapq.heappop(available)
+
+        oldest = available[0] if available else None
+        if oldest is not None and oldest < rank and received[oldest] != received[rank]:
+            flag('out_of_order', rank,
+                 f"used at {when} while older batch {batches[oldest].get('_id')} had {remaining[oldest]} left")
+
+        deduct(rank, ref, qty, when)
+
+    for _when, rank, _seq, ref, qty in untimed:
+        record_count += 1
+        deduct(rank, ref, qty, 'unknown time')
+
+    for rank, batch in enumerate(batches):
+        actual = int(batch.get('quantity_remaining', 0))
+        if not inferred[rank] and remaining[rank] != actual:
+            flag('remaining_mismatch', rank,
+                 f"replay leaves {remaining[rank]}, quantity_remaining is {actual}")
+
+    return findings, record_count
+
+
+class FifoAuditor:
+    def __init__(self, mongodb_uri=MONGODB_URI, db_name=DATABASE_NAME):
+        """Initialize connection to MongoDB"""
+        try:
+            self.client = MongoClient(mongodb_uri, serverSelectionTimeoutMS=5000)
+            self.db = self.client[db_name]
+            self.batches_collection = self.db.batches
+            self.usage_archive = self.db[archive_collection_name('batches', 'usage_history')]
+
+            # Test connection
+            self.client.server_info()
+            print(f"✅ Connected to MongoDB: {db_name}")
+            print("=" * 80)
+        except Exception as e:
+            print(f"❌ Failed to connect to MongoDB: {e}")
+            sys.exit(1)
+
+    def stream_batches(self, product_id=None):
+        """Yield (product_id, batches) with batches ordered by date_received"""
+        query = {'product_id': product_id} if product_id else {}
+        cursor = self.batches_collection.find(
+            query,
+            BATCH_PROJECTION,
+            sort=[('product_id', 1), ('date_received', 1), ('_id', 1)],
+            batch_size=1000,
+            allow_disk_use=True
+        )
+        archived = groupby(self.usage_archive.find(
+            query,
+            sort=[('product_id', 1), ('bucket', 1)],
+            batch_size=1000,
+            allow_disk_use=True
+        ), key=lambda bucket: bucket.get('product_id'))
+        archived_pid, buckets = next(archived, (None, None))
+
+        for pid, group in groupby(cursor, key=lambda batch: batch.get('product_id')):
+            batches = list(group)
+
+            # Merge in usage moved out by archive_history.py (both sorted by product_id)
+            while archived_pid is not None and pid is not None and archived_pid < pid:
+                archived_pid, buckets = next(archived, (None, None))
+            if archived_pid is not None and archived_pid == pid:
+                entries = {}
+                for bucket in buckets:
+                    entries.setdefault(bucket['parent_id'], []).extend(bucket.get('entries') or [])
+                for batch in batches:
+                    if batch['_id'] in entries:
+                        batch['usage_history'] = entries[batch['_id']] + (batch.get('usage_history') or [])
+                archived_pid, buckets = next(archived, (None, None))
+
+            yield pid, batches
+
+    def run_audit(self, product_id=None, export_file=None):
+        """Audit FIFO consumption for all products (or one)"""
+        print("\n🔍 Replaying batch usage history through FIFO...\n")
+
+        started = time.perf_counter()
+        findings = []
+        product_count = 0
+        batch_count = 0
+        record_count = 0
+
+        for pid, batches in self.stream_batches(product_id):
+            product_findings, records = audit_product(pid, batches)
+            findings.extend(product_findings)
+            product_count += 1
+            batch_count += len(batches)
+            record_count += records
+
+        elapsed = time.perf_counter() - started
+
+        self._display_results(findings, product_count, batch_count, record_count, elapsed)
+
+        if export_file:
+            self._export_results(findings, product_count, batch_count, record_count, export_file)
+
+        return findings
+
+    def _display_results(self, findings, product_count, batch_count, record_count, elapsed):
+        """Display audit results"""
+        print("=" * 80)
+        print("📊 FIFO AUDIT SUMMARY")
+        print("=" * 80)
+        print(f"Products: {product_count}")
+        print(f"Batches: {batch_count}")
+        print(f"Usage records replayed: {record_count}")
+        rate = record_count / elapsed if elapsed else 0
+        print(f"Elapsed: {elapsed:.2f}s ({rate:,.0f} records/s)")
+
+        if not findings:
+            print("\n✅ All batch consumption follows FIFO!")
+            return
+
+        counts = {}
+        for finding in findings:
+            counts[finding['type']] = counts.get(finding['type'], 0) + 1
+
+        print(f"\n❌ Findings: {len(findings)}")
+        for kind, count in sorted(counts.items()):
+            print(f"   {kind}: {count}")
+
+        table_data = [
+            [f['product_id'], f['batch_id'], f['type'], f['detail'][:70]]
+            for f in findings[:50]
+        ]
+        print(tabulate(table_data, headers=['Product', 'Batch', 'Type', 'Detail'], tablefmt='grid'))
+
+        if len(findings) > 50:
+            print(f"\n... and {len(findings) - 50} more findings")
+
+    def _export_results(self, findings, product_count, batch_count, record_count, filename):
+        """Export audit findings to a JSON file"""
+        try:
+            results = {
+                'generated_at': datetime.utcnow().isoformat(),
+                'summary': {
+                    'products': product_count,
+                    'batches': batch_count,
+                    'usage_records': record_count,
+                    'total_findings': len(findings)
+                },
+                'findings': findings
+            }
+
+            with open(filename, 'w') as f:
+                json.dump(results, f, indent=2, default=str)
+
+            print(f"\n💾 Results exported to: {filename}")
+        except Exception as e:
+            print(f"❌ Error exporting results: {e}")
+
+    def close(self):
+        """Close MongoDB connection"""
+        self.client.close()
+        print("\n✅ Connection closed")
+
+
+def main():
+    """Main entry point"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Audit batch usage_history against FIFO consumption rules')
+    parser.add_argument('--mongodb-uri', default=MONGODB_URI, help='MongoDB connection URI')
+    parser.add_argument('--db-name', default=DATABASE_NAME, help='Database name')
+    parser.add_argument('--product-id', type=str, help='Audit specific product ID only')
+    parser.add_argument('--export', type=str, help='Export findings to JSON file')
+
+    args = parser.parse_args()
+
+    auditor = FifoAuditor(mongodb_uri=args.mongodb_uri, db_name=args.db_name)
+
+    try:
+        auditor.run_audit(product_id=args.product_id, export_file=args.export)
+    finally:
+        auditor.close()
+
+
+if __name__ == '__main__':
+    main()
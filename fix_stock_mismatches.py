@@ -3,31 +3,57 @@ Stock Mismatch Auto-Fix Tool
 =============================
 Automatically fixes common stock mismatches identified by the comparison tool.
 
-CAUTION: This tool modifies database records. Always backup before running!
+CAUTION: This tool modifies database records. Live runs write an undo
+journal of every field they change; keep it until the fix is verified.
 """
 
 import sys
 import os
-from pymongo import MongoClient
 from datetime import datetime
 import json
 
+from batch_utils import calculate_batch_stock, batch_stock_stages
+from db_connection import ConnectionOptions, add_connection_arguments, confirm_mode, BULK_CHUNK_SIZE
+from profiling import profiled, profile_run, add_profiling_arguments
+
+# pymongo (and bson via the undo journal) is imported where it is used, so
+# --help and the report commands start without loading it
+
 # Configuration
 MONGODB_URI = os.getenv('MONGODB_URI', 'mongodb://localhost:27017/')
 DATABASE_NAME = os.getenv('DATABASE_NAME', 'pos_system')
 
+# Optimistic concurrency: writes only apply if these fields are unchanged
+CAS_FIELDS = ('stock', 'updated_at')
+CAS_MAX_RETRIES = 3
+
 class StockFixer:
-    def __init__(self, mongodb_uri=MONGODB_URI, db_name=DATABASE_NAME, dry_run=True):
-        """Initialize connection to MongoDB"""
+    def __init__(self, mongodb_uri=MONGODB_URI, db_name=DATABASE_NAME, dry_run=True, journal_path=None, client=None,
+                 options=None):
+        """Initialize connection to MongoDB
+        
+        Pass ``client`` to share one MongoClient with other tools in the same
+        run; a shared client is not pinged or closed here. Reads and writes
+        always go to the primary, whatever ``options`` says for comparisons.
+        """
+        self.journal_path = journal_path
+        self.journal = None
         try:
-            self.client = MongoClient(mongodb_uri, serverSelectionTimeoutMS=5000)
-            self.db = self.client[db_name]
+            self.options = options or ConnectionOptions()
+            self._owns_client = client is None
+            if client is None:
+                client = self.options.client(mongodb_uri)
+            self.client = client
+            
+            from pymongo import ReadPreference
+            self.db = self.client.get_database(db_name, read_preference=ReadPreference.PRIMARY)
             self.products_collection = self.db.products
             self.batches_collection = self.db.batches
             self.dry_run = dry_run
             
             # Test connection
-            self.client.server_info()
+            if self._owns_client:
+                self.client.server_info()
             
             mode = "DRY RUN MODE" if dry_run else "LIVE MODE - WILL MODIFY DATABASE"
             print(f"✅ Connected to MongoDB: {db_name}")
@@ -40,39 +66,169 @@ class StockFixer:
     def calculate_batch_stock(self, product_id):
         """Calculate actual stock from active batches"""
         try:
+            return calculate_batch_stock(self.batches_collection, product_id)['total_stock']
+        except Exception as e:
+            print(f"❌ Error calculating batch stock for {product_id}: {e}")
+            return 0
+    
+    @profiled
+    def _conditional_update(self, planned, replan, before_chunk=None):
+        """Apply planned $set updates with compare-and-set bulk writes
+        
+        ``planned`` is a list of (observed_product, changes). Each write only
+        matches if the product still has the observed stock, updated_at and
+        changed fields, so a sale landing in between is never overwritten.
+        Products that lost the race are re-read, re-planned with
+        ``replan(product)`` (which returns changes or None) and retried up to
+        CAS_MAX_RETRIES times.
+        
+        ``before_chunk()`` is called before every bulk write; an exception
+        it raises (e.g. a lost work lease) stops the writes there.
+        
+        Returns (applied_count, conflicted_product_ids).
+        """
+        from pymongo import UpdateOne
+        
+        applied = 0
+        attempt = 0
+        
+        while planned:
+            # BSON dates keep milliseconds only; truncate so the stamp can be
+            # matched again below
             now = datetime.utcnow()
+            stamp = now.replace(microsecond=now.microsecond // 1000 * 1000)
+            
+            journal = self._get_journal()
+            matched = 0
+            for start in range(0, len(planned), BULK_CHUNK_SIZE):
+                if before_chunk is not None:
+                    before_chunk()
+                operations = []
+                for product, changes in planned[start:start + BULK_CHUNK_SIZE]:
+                    update = dict(changes, updated_at=stamp)
+                    condition = {'_id': product['_id']}
+                    for field in CAS_FIELDS + tuple(changes):
+                        condition[field] = product.get(field)
+                    operations.append(UpdateOne(condition, {'$set': update}))
+                    journal.record(product, update)
+                
+                # Undo information must be on disk before the write happens
+                journal.flush()
+                result = self.products_collection.bulk_write(operations, ordered=False)
+                matched += result.matched_count
+            applied += matched
             
-            batches = list(self.batches_collection.find({
-                'product_id': product_id,
-                'status': 'active',
-                'quantity_remaining': {'$gt': 0}
-            }))
+            if matched == len(planned):
+                break
             
-            # Filter out expired batches
-            non_expired_batches = []
-            for batch in batches:
-                expiry_date = batch.get('expiry_date')
-                if not expiry_date:
-                    non_expired_batches.append(batch)
-                else:
-                    if isinstance(expiry_date, str):
-                        try:
-                            from dateutil import parser
-                            expiry_date = parser.parse(expiry_date)
-                        except Exception:
-                            non_expired_batches.append(batch)
-                            continue
-                    
-                    if isinstance(expiry_date, datetime) and expiry_date >= now:
-                        non_expired_batches.append(batch)
+            # Anything not carrying our stamp and values was changed by
+            # someone else (a same-millisecond writer can share the stamp)
+            wanted = {product['_id']: changes for product, changes in planned}
+            fresh = [
+                product for product in self.products_collection.find({'_id': {'$in': list(wanted)}})
+                if product.get('updated_at') != stamp
+                or any(product.get(field) != value for field, value in wanted[product['_id']].items())
+            ]
             
-            total_stock = sum(batch['quantity_remaining'] for batch in non_expired_batches)
-            return total_stock
-        except Exception as e:
-            print(f"❌ Error calculating batch stock for {product_id}: {e}")
+            attempt += 1
+            if attempt > CAS_MAX_RETRIES:
+                return applied, [product['_id'] for product in fresh]
+            
+            print(f"   🔁 {len(fresh)} products changed during the write, retrying ({attempt}/{CAS_MAX_RETRIES})")
+            planned = []
+            for product in fresh:
+                changes = replan(product)
+                if changes:
+                    planned.append((product, changes))
+        
+        return applied, []
+    
+    def _get_journal(self):
+        """Open the undo journal on first use"""
+        if self.journal is None:
+            from repair_journal import RepairJournal, default_journal_path
+            self.journal = RepairJournal(
+                self.journal_path or default_journal_path(),
+                self.db.name,
+                self.products_collection.name
+            )
+            print(f"📝 Writing undo journal: {self.journal.path}")
+        return self.journal
+    
+    @profiled
+    def undo_journal(self, journal_file):
+        """Restore the values recorded in an undo journal
+        
+        Products changed again since the repair (their current values no
+        longer match what the repair wrote) are skipped.
+        """
+        from pymongo import UpdateOne
+        from repair_journal import read_journal
+        
+        print(f"\n⏪ Undoing repairs from journal: {journal_file}\n")
+        
+        try:
+            header, entries = read_journal(journal_file)
+        except FileNotFoundError:
+            print(f"❌ Journal file not found: {journal_file}")
+            return 0
+        
+        if header.get('database') != self.db.name:
+            print(f"⚠️  Journal was written for database '{header.get('database')}', not '{self.db.name}'")
+        
+        # Entries are undone newest first. Each one only matches while the
+        # product still holds the values that write produced, so a product
+        # fixed by several methods unwinds step by step, and retry attempts
+        # that never applied are skipped.
+        operations = []
+        for entry in reversed(list(entries)):
+            condition = {'_id': entry['_id']}
+            condition.update(entry['after'])
+            update = {}
+            if entry['before']:
+                update['$set'] = entry['before']
+            if entry['unset']:
+                update['$unset'] = {field: '' for field in entry['unset']}
+            if update:
+                operations.append(UpdateOne(condition, update))
+        
+        if self.dry_run:
+            print(f"[DRY RUN] Would undo up to {len(operations)} journal entries")
             return 0
+        
+        restored = 0
+        for start in range(0, len(operations), BULK_CHUNK_SIZE):
+            # Ordered, so entries for the same product apply in sequence
+            result = self.products_collection.bulk_write(operations[start:start + BULK_CHUNK_SIZE], ordered=True)
+            restored += result.matched_count
+        
+        print("=" * 80)
+        print(f"✅ Undid {restored} journal entries")
+        if restored < len(operations):
+            print(f"⚠️  Skipped {len(operations) - restored} entries (never applied, or changed since the repair)")
+        
+        return restored
     
-    def sync_stock_with_batches(self, product_id=None):
+    def _report_fix_result(self, fixed_count, conflicts, errors):
+        """Print the summary shared by all fix methods"""
+        print("=" * 80)
+        if self.dry_run:
+            print(f"[DRY RUN] Would fix {fixed_count} products")
+        else:
+            print(f"✅ Fixed {fixed_count} products")
+        
+        if conflicts:
+            print(f"⚠️  Still changing after {CAS_MAX_RETRIES} retries (left untouched): {len(conflicts)}")
+            for product_id in conflicts[:5]:
+                print(f"   - {product_id}")
+        
+        if errors:
+            print(f"❌ Errors: {len(errors)}")
+            for error in errors[:5]:
+                print(f"   - {error['product_id']}: {error['error']}")
+    
+    @profiled
+    def sync_stock_with_batches(self, product_id=None, use_stock_view=False):
         """Fix products where stock doesn't match batch calculation"""
         print("\n🔧 Syncing product stock with batch system...\n")
         
@@ -82,14 +238,32 @@ class StockFixer:
         
         products = list(self.products_collection.find(query))
         
-        fixed_count = 0
+        stock_view = None
+        if use_stock_view:
+            from stock_view import StockView
+            stock_view = StockView(self.db)
+            stock_view.load()
+        
+        def replan(product):
+            # Retries always use a fresh batch computation
+            if product.get('isDeleted') is True:
+                return None
+            batch_stock = self.calculate_batch_stock(product['_id'])
+            if int(product.get('stock', 0)) == batch_stock:
+                return None
+            return {'stock': batch_stock, 'total_stock': batch_stock}
+        
+        planned = []
         errors = []
         
         for product in products:
             try:
                 product_id = product['_id']
                 current_stock = int(product.get('stock', 0))
-                batch_stock = self.calculate_batch_stock(product_id)
+                if stock_view is not None:
+                    batch_stock = stock_view.batch_info(product_id)['total_stock']
+                else:
+                    batch_stock = self.calculate_batch_stock(product_id)
                 
                 if current_stock != batch_stock:
                     print(f"📦 {product.get('product_name', 'Unknown')} ({product.get('SKU', 'N/A')})")
@@ -97,43 +271,160 @@ class StockFixer:
                     
                     if self.dry_run:
                         print(f"   [DRY RUN] Would update to: {batch_stock}")
-                    else:
-                        # Update both stock and total_stock
-                        result = self.products_collection.update_one(
-                            {'_id': product_id},
-                            {
-                                '$set': {
-                                    'stock': batch_stock,
-                                    'total_stock': batch_stock,
-                                    'updated_at': datetime.utcnow()
-                                }
-                            }
-                        )
-                        
-                        if result.modified_count > 0:
-                            print(f"   ✅ Updated to: {batch_stock}")
-                            fixed_count += 1
-                        else:
-                            print(f"   ⚠️  Update failed")
                     
+                    # Update both stock and total_stock
+                    planned.append((product, {'stock': batch_stock, 'total_stock': batch_stock}))
                     print()
             except Exception as e:
                 errors.append({'product_id': product_id, 'error': str(e)})
                 print(f"   ❌ Error: {e}\n")
         
-        print("=" * 80)
+        fixed_count, conflicts = len(planned), []
+        if planned and not self.dry_run:
+            fixed_count, conflicts = self._conditional_update(planned, replan)
+        
+        self._report_fix_result(fixed_count, conflicts, errors)
+        return fixed_count
+    
+    def _batch_drift_pipeline(self, product_id=None):
+        """Aggregation stages yielding products whose stock != batch stock
+
+        Runs over products (not batches) so products whose batches are all
+        gone or expired still come out with batch_stock 0.
+        """
+        match = {'isDeleted': {'$ne': True}}
+        if product_id:
+            match['_id'] = product_id
+        
+        return [{'$match': match}] + batch_stock_stages(self.batches_collection.name) + [
+            {'$project': {'product_name': 1, 'SKU': 1, 'stock': 1, 'total_stock': 1, 'updated_at': 1, 'batch_stock': 1}},
+            {'$match': {'$expr': {'$ne': [{'$ifNull': ['$stock', 0]}, '$batch_stock']}}}
+        ]
+    
+    @profiled
+    def sync_stock_with_batches_server_side(self, product_id=None, sample_size=20):
+        """Resync stock with batches entirely inside MongoDB using $merge
+        
+        Only products whose value differs are written, and no batch
+        documents travel to the client. In live mode one aggregation
+        snapshots the drifted products (observed stock, total_stock,
+        updated_at and batch stock) into a staging collection; the undo
+        journal and the $merge are both built from that snapshot, and the
+        merge only writes products that still hold the journaled values.
+        Products changed in between are skipped and reported. Returns counts
+        and a sample of changed IDs for the audit log.
+        """
+        print("\n🔧 Syncing product stock with batch system (server-side)...\n")
+        
+        pipeline = self._batch_drift_pipeline(product_id)
+        started = datetime.utcnow()
+        
         if self.dry_run:
-            print(f"[DRY RUN] Would fix {fixed_count} products")
-        else:
-            print(f"✅ Fixed {fixed_count} products")
+            preview = list(self.products_collection.aggregate(pipeline + [
+                {'$facet': {
+                    'count': [{'$count': 'n'}],
+                    'sample': [{'$limit': sample_size}]
+                }}
+            ]))[0]
+            drift_count = preview['count'][0]['n'] if preview['count'] else 0
+            sample = preview['sample']
+            self._print_drift_sample(sample, drift_count)
+            
+            print("\n" + "=" * 80)
+            print(f"[DRY RUN] Would fix {drift_count} products")
+            return {
+                'started_at': started.isoformat(),
+                'finished_at': datetime.utcnow().isoformat(),
+                'dry_run': True,
+                'drift_count': drift_count,
+                'merged': False,
+                'skipped': [],
+                'changed_id_sample': [str(product['_id']) for product in sample]
+            }
         
-        if errors:
-            print(f"❌ Errors: {len(errors)}")
-            for error in errors[:5]:
-                print(f"   - {error['product_id']}: {error['error']}")
+        # BSON dates keep milliseconds only; truncate so the stamp can be
+        # matched (and undone) exactly
+        stamp = started.replace(microsecond=started.microsecond // 1000 * 1000)
+        staging = self.db[f"{self.products_collection.name}_resync_{stamp.strftime('%Y%m%d%H%M%S%f')}"]
         
-        return fixed_count
+        try:
+            # The single drift aggregation; everything below reads its snapshot
+            self.products_collection.aggregate(pipeline + [{'$out': staging.name}])
+            
+            drift_count = staging.count_documents({})
+            sample = list(staging.find({}).sort('_id', 1).limit(sample_size))
+            self._print_drift_sample(sample, drift_count)
+            
+            # Undo information must be on disk before the write happens
+            journaled = []
+            if drift_count:
+                journal = self._get_journal()
+                for product in staging.find({}, {'product_name': 0, 'SKU': 0}).sort('_id', 1):
+                    batch_stock = product.pop('batch_stock')
+                    journal.record(product, {'stock': batch_stock, 'total_stock': batch_stock, 'updated_at': stamp})
+                    journaled.append(product['_id'])
+                journal.flush()
+            
+            if journaled:
+                # Compare-and-set like _conditional_update: only products still
+                # holding the journaled stock, total_stock and updated_at change
+                unchanged = {'$and': [
+                    {'$eq': ['$' + field, '$$new.' + field]} for field in ('stock', 'total_stock', 'updated_at')
+                ]}
+                staging.aggregate([
+                    {'$project': {'stock': 1, 'total_stock': 1, 'updated_at': 1, 'batch_stock': 1}},
+                    {'$merge': {
+                        'into': self.products_collection.name,
+                        'on': '_id',
+                        'whenMatched': [{'$replaceWith': {'$cond': [
+                            unchanged,
+                            {'$mergeObjects': ['$$ROOT', {
+                                'stock': '$$new.batch_stock',
+                                'total_stock': '$$new.batch_stock',
+                                'updated_at': stamp
+                            }]},
+                            '$$ROOT'
+                        ]}}],
+                        'whenNotMatched': 'discard'
+                    }}
+                ])
+        finally:
+            staging.drop()
+        
+        # Journaled products not carrying our stamp were changed by someone else
+        skipped = [
+            product['_id'] for product in self.products_collection.find(
+                {'_id': {'$in': journaled}, 'updated_at': {'$ne': stamp}}, {'_id': 1}
+            )
+        ] if journaled else []
+        fixed_count = len(journaled) - len(skipped)
+        
+        print("\n" + "=" * 80)
+        print(f"✅ Fixed {fixed_count} products")
+        if skipped:
+            print(f"⚠️  Changed since the snapshot (left untouched): {len(skipped)}")
+            for skipped_id in skipped[:5]:
+                print(f"   - {skipped_id}")
+        
+        return {
+            'started_at': started.isoformat(),
+            'finished_at': datetime.utcnow().isoformat(),
+            'dry_run': False,
+            'drift_count': drift_count,
+            'fixed_count': fixed_count,
+            'merged': bool(journaled),
+            'skipped': [str(skipped_id) for skipped_id in skipped],
+            'changed_id_sample': [str(product['_id']) for product in sample]
+        }
     
+    def _print_drift_sample(self, sample, drift_count):
+        for product in sample:
+            print(f"📦 {product.get('product_name', 'Unknown')} ({product.get('SKU', 'N/A')})")
+            print(f"   Current: {product.get('stock')} | Batch Calculated: {product['batch_stock']}")
+        if drift_count > len(sample):
+            print(f"\n... and {drift_count - len(sample)} more products")
+    
+    @profiled
     def sync_stock_and_total_stock(self, product_id=None):
         """Fix products where stock and total_stock don't match"""
         print("\n🔧 Syncing stock and total_stock fields...\n")
@@ -144,7 +435,16 @@ class StockFixer:
         
         products = list(self.products_collection.find(query))
         
-        fixed_count = 0
+        def replan(product):
+            # Use stock as the source of truth
+            if product.get('isDeleted') is True:
+                return None
+            stock = int(product.get('stock', 0))
+            if stock == int(product.get('total_stock', stock)):
+                return None
+            return {'total_stock': stock}
+        
+        planned = []
         errors = []
         
         for product in products:
@@ -157,42 +457,23 @@ class StockFixer:
                     print(f"📦 {product.get('product_name', 'Unknown')} ({product.get('SKU', 'N/A')})")
                     print(f"   stock: {stock} | total_stock: {total_stock}")
                     
-                    # Use stock as the source of truth
                     if self.dry_run:
                         print(f"   [DRY RUN] Would set both to: {stock}")
-                    else:
-                        result = self.products_collection.update_one(
-                            {'_id': product_id},
-                            {
-                                '$set': {
-                                    'total_stock': stock,
-                                    'updated_at': datetime.utcnow()
-                                }
-                            }
-                        )
-                        
-                        if result.modified_count > 0:
-                            print(f"   ✅ Set both to: {stock}")
-                            fixed_count += 1
-                        else:
-                            print(f"   ⚠️  Update failed")
                     
+                    planned.append((product, {'total_stock': stock}))
                     print()
             except Exception as e:
                 errors.append({'product_id': product_id, 'error': str(e)})
                 print(f"   ❌ Error: {e}\n")
         
-        print("=" * 80)
-        if self.dry_run:
-            print(f"[DRY RUN] Would fix {fixed_count} products")
-        else:
-            print(f"✅ Fixed {fixed_count} products")
-        
-        if errors:
-            print(f"❌ Errors: {len(errors)}")
+        fixed_count, conflicts = len(planned), []
+        if planned and not self.dry_run:
+            fixed_count, conflicts = self._conditional_update(planned, replan)
         
+        self._report_fix_result(fixed_count, conflicts, errors)
         return fixed_count
     
+    @profiled
     def fix_missing_from_api(self, product_id=None):
         """Fix products that should appear in API but don't"""
         print("\n🔧 Fixing products missing from customer API...\n")
@@ -207,7 +488,15 @@ class StockFixer:
         
         products = list(self.products_collection.find(query))
         
-        fixed_count = 0
+        def replan(product):
+            if product.get('isDeleted') is True or product.get('stock', 0) <= 0:
+                return None
+            if product.get('status', 'unknown') == 'active':
+                return None
+            return {'status': 'active'}
+        
+        planned = []
+        errors = []
         
         for product in products:
             try:
@@ -221,35 +510,75 @@ class StockFixer:
                     
                     if self.dry_run:
                         print(f"   [DRY RUN] Would set status to: active")
-                    else:
-                        result = self.products_collection.update_one(
-                            {'_id': product_id},
-                            {
-                                '$set': {
-                                    'status': 'active',
-                                    'updated_at': datetime.utcnow()
-                                }
-                            }
-                        )
-                        
-                        if result.modified_count > 0:
-                            print(f"   ✅ Set status to: active")
-                            fixed_count += 1
-                        else:
-                            print(f"   ⚠️  Update failed")
                     
+                    planned.append((product, {'status': 'active'}))
                     print()
             except Exception as e:
+                errors.append({'product_id': product_id, 'error': str(e)})
                 print(f"   ❌ Error: {e}\n")
         
-        print("=" * 80)
-        if self.dry_run:
-            print(f"[DRY RUN] Would fix {fixed_count} products")
-        else:
-            print(f"✅ Fixed {fixed_count} products")
+        fixed_count, conflicts = len(planned), []
+        if planned and not self.dry_run:
+            fixed_count, conflicts = self._conditional_update(planned, replan)
         
+        self._report_fix_result(fixed_count, conflicts, errors)
         return fixed_count
     
+    @profiled
+    def reconcile(self, product_ids=None, batches=True, fields=True, missing=True, use_stock_view=False, fixes=None):
+        """Run the selected fixes in one pass over the products
+        
+        Products and batches are each read once (instead of once per fix
+        and one batch query per product) and every product gets at most one
+        conditional write. The outcome is the same as running the fix
+        methods one after another. ``fixes`` limits each product to the
+        fixes listed for it (see RepairPlanner).
+        """
+        from reconcile import ReconciliationEngine, MongoProductSource, BatchTimelineSource, StockViewSource, RepairPlanner
+        
+        print("\n🔧 Reconciling products with the batch system...\n")
+        
+        if use_stock_view and product_ids is None:
+            batch_source = StockViewSource(self.db)
+        else:
+            batch_source = BatchTimelineSource(self.batches_collection, product_ids, self.options.batch_size)
+        
+        planner = RepairPlanner(self, batches=batches, fields=fields, missing=missing, fixes=fixes)
+        products = MongoProductSource(self.products_collection, product_ids, batch_size=self.options.batch_size)
+        engine = ReconciliationEngine(products, batch_source)
+        engine.run(repair=planner)
+        return planner.apply()
+    
+    @profiled
+    def fix_from_results(self, data):
+        """Fix the mismatches listed in comparison results (report JSON or
+        the dict returned by StockComparison.compare_stocks)
+        
+        The listed products are re-checked and repaired in one pass, so the
+        fixes are based on their current state rather than the report's.
+        """
+        mismatches = data.get('mismatches', [])
+        missing_from_api = data.get('missing_from_api', [])
+        
+        print(f"Found {len(mismatches)} mismatches and {len(missing_from_api)} missing products\n")
+        
+        # Each product only gets the fixes for the mismatches it was reported with
+        fixes = {}
+        for mismatch in mismatches:
+            kinds = mismatch['mismatch_type'].split(', ')
+            if 'cloud_vs_batch' in kinds:
+                fixes.setdefault(str(mismatch['product_id']), set()).add('batches')
+            if 'stock_vs_total_stock' in kinds:
+                fixes.setdefault(str(mismatch['product_id']), set()).add('fields')
+        for missing in missing_from_api:
+            fixes.setdefault(str(missing['product_id']), set()).add('missing')
+        
+        if not fixes:
+            print("Nothing to fix.")
+            return 0
+        
+        return self.reconcile(product_ids=sorted(fixes), fixes=fixes)
+    
     def load_comparison_report(self, report_file):
         """Load mismatches from comparison report and fix them"""
         print(f"\n📂 Loading comparison report: {report_file}\n")
@@ -258,29 +587,7 @@ class StockFixer:
             with open(report_file, 'r') as f:
                 data = json.load(f)
             
-            mismatches = data.get('mismatches', [])
-            missing_from_api = data.get('missing_from_api', [])
-            
-            print(f"Found {len(mismatches)} mismatches and {len(missing_from_api)} missing products\n")
-            
-            # Fix each mismatch based on type
-            for mismatch in mismatches:
-                product_id = mismatch['product_id']
-                mismatch_type = mismatch['mismatch_type']
-                
-                if 'cloud_vs_batch' in mismatch_type:
-                    print(f"Fixing batch mismatch for {product_id}...")
-                    self.sync_stock_with_batches(product_id)
-                
-                if 'stock_vs_total_stock' in mismatch_type:
-                    print(f"Fixing stock/total_stock mismatch for {product_id}...")
-                    self.sync_stock_and_total_stock(product_id)
-            
-            # Fix missing products
-            for missing in missing_from_api:
-                product_id = missing['product_id']
-                print(f"Fixing missing product {product_id}...")
-                self.fix_missing_from_api(product_id)
+            self.fix_from_results(data)
             
         except FileNotFoundError:
             print(f"❌ Report file not found: {report_file}")
@@ -291,17 +598,17 @@ class StockFixer:
     
     def close(self):
         """Close MongoDB connection"""
-        self.client.close()
-        print("\n✅ Connection closed")
+        if self.journal is not None:
+            self.journal.close()
+            print(f"\n📝 Undo journal saved: {self.journal.path} ({self.journal.entries} entries)")
+            print(f"   Roll back with: python fix_stock_mismatches.py --undo {self.journal.path} --live")
+        if self._owns_client:
+            self.client.close()
+            print("\n✅ Connection closed")
 
 
-def main():
-    """Main entry point"""
-    import argparse
-    
-    parser = argparse.ArgumentParser(description='Fix stock mismatches in database')
-    parser.add_argument('--mongodb-uri', default=MONGODB_URI, help='MongoDB connection URI')
-    parser.add_argument('--db-name', default=DATABASE_NAME, help='Database name')
+def add_fix_arguments(parser):
+    """Add the fix options (shared with stock_tools.py)"""
     parser.add_argument('--live', action='store_true', help='Execute fixes (default is dry-run)')
     parser.add_argument('--product-id', type=str, help='Fix specific product ID only')
     parser.add_argument('--from-report', type=str, help='Load and fix from comparison report JSON file')
@@ -309,66 +616,85 @@ def main():
     parser.add_argument('--fix-fields', action='store_true', help='Sync stock and total_stock fields')
     parser.add_argument('--fix-missing', action='store_true', help='Fix products missing from API')
     parser.add_argument('--fix-all', action='store_true', help='Run all fixes')
+    parser.add_argument('--journal', type=str, help='Undo journal file for live fixes (default: stock_fix_journal_<time>.ndjson.gz)')
+    parser.add_argument('--undo', type=str, metavar='JOURNAL', help='Restore prior values from an undo journal')
+    parser.add_argument('--server-side', action='store_true', help='Run the batch sync as a single $merge aggregation inside MongoDB')
+    parser.add_argument('--use-stock-view', action='store_true', help='Read batch stock from the product_stock_view collection')
+
+
+def run_fixes(fixer, args):
+    """Run the fixes selected on the command line"""
+    if args.undo:
+        fixer.undo_journal(args.undo)
+    elif args.from_report:
+        # Fix from report file
+        fixer.load_comparison_report(args.from_report)
+    elif args.fix_all and args.server_side:
+        # Run all fixes, batch sync inside MongoDB
+        fixer.sync_stock_with_batches_server_side(args.product_id)
+        fixer.sync_stock_and_total_stock(args.product_id)
+        fixer.fix_missing_from_api(args.product_id)
+    elif args.fix_all:
+        # Run all fixes in a single pass
+        product_ids = [args.product_id] if args.product_id else None
+        fixer.reconcile(product_ids, use_stock_view=args.use_stock_view)
+    else:
+        # Run specific fixes
+        if args.fix_batches and args.server_side:
+            fixer.sync_stock_with_batches_server_side(args.product_id)
+        elif args.fix_batches:
+            fixer.sync_stock_with_batches(args.product_id, use_stock_view=args.use_stock_view)
+        
+        if args.fix_fields:
+            fixer.sync_stock_and_total_stock(args.product_id)
+        
+        if args.fix_missing:
+            fixer.fix_missing_from_api(args.product_id)
+        
+        if not (args.fix_batches or args.fix_fields or args.fix_missing):
+            print("No fix option specified. Use --help to see available options.")
+            print("\nQuick examples:")
+            print("  Dry run batch fix:     python fix_stock_mismatches.py --fix-batches")
+            print("  Live batch fix:        python fix_stock_mismatches.py --fix-batches --live")
+            print("  Fix all:               python fix_stock_mismatches.py --fix-all --live")
+            print("  Fix from report:       python fix_stock_mismatches.py --from-report report.json --live")
+
+
+def main():
+    """Main entry point"""
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='Fix stock mismatches in database')
+    parser.add_argument('--mongodb-uri', default=MONGODB_URI, help='MongoDB connection URI')
+    parser.add_argument('--db-name', default=DATABASE_NAME, help='Database name')
+    add_fix_arguments(parser)
+    add_connection_arguments(parser, reads=False)
+    add_profiling_arguments(parser)
     
     args = parser.parse_args()
     
     # Determine dry-run mode
     dry_run = not args.live
     
-    if dry_run:
-        print("\n" + "=" * 80)
-        print("⚠️  DRY RUN MODE - No changes will be made to the database")
-        print("   Use --live flag to execute actual fixes")
-        print("=" * 80 + "\n")
-    else:
-        print("\n" + "=" * 80)
-        print("🚨 LIVE MODE - This will modify the database!")
-        print("=" * 80)
-        response = input("\nAre you sure you want to continue? (yes/no): ")
-        if response.lower() != 'yes':
-            print("Aborted.")
-            sys.exit(0)
-        print()
-    
-    # Initialize fixer
-    fixer = StockFixer(
-        mongodb_uri=args.mongodb_uri,
-        db_name=args.db_name,
-        dry_run=dry_run
-    )
+    if not confirm_mode(dry_run):
+        sys.exit(0)
     
-    try:
-        if args.from_report:
-            # Fix from report file
-            fixer.load_comparison_report(args.from_report)
-        elif args.fix_all:
-            # Run all fixes
-            fixer.sync_stock_with_batches(args.product_id)
-            fixer.sync_stock_and_total_stock(args.product_id)
-            fixer.fix_missing_from_api(args.product_id)
-        else:
-            # Run specific fixes
-            if args.fix_batches:
-                fixer.sync_stock_with_batches(args.product_id)
-            
-            if args.fix_fields:
-                fixer.sync_stock_and_total_stock(args.product_id)
-            
-            if args.fix_missing:
-                fixer.fix_missing_from_api(args.product_id)
-            
-            if not (args.fix_batches or args.fix_fields or args.fix_missing):
-                print("No fix option specified. Use --help to see available options.")
-                print("\nQuick examples:")
-                print("  Dry run batch fix:     python fix_stock_mismatches.py --fix-batches")
-                print("  Live batch fix:        python fix_stock_mismatches.py --fix-batches --live")
-                print("  Fix all:               python fix_stock_mismatches.py --fix-all --live")
-                print("  Fix from report:       python fix_stock_mismatches.py --from-report report.json --live")
-    
-    finally:
-        fixer.close()
+    with profile_run(args):
+        # Initialize fixer
+        fixer = StockFixer(
+            mongodb_uri=args.mongodb_uri,
+            db_name=args.db_name,
+            dry_run=dry_run,
+            journal_path=args.journal,
+            options=ConnectionOptions.from_args(args)
+        )
+        
+        try:
+            run_fixes(fixer, args)
+        finally:
+            fixer.close()
+            fixer.options.print_traffic()
 
 
 if __name__ == '__main__':
     main()
-
@@ -0,0 +1,193 @@
+"""
+Reconciliation History Store
+============================
+Appends every comparison run (summary plus one row per product and
+mismatch type) to a local SQLite database, so trend questions don't need
+the exported JSON files:
+
+    python stock_tools.py history drifters --days 7 --min-count 3
+    python stock_tools.py history product PROD-00123
+    python stock_tools.py history runs
+
+Tables:
+- runs: one row per comparison (counts, database, API completeness)
+- mismatches: run_id, run_at, product_id, sku, mismatch_type and the stock
+  values; indexed by product, SKU, type and run time (the time-range
+  scans of prune, drifters and types use the run_at index)
+
+Runs older than the retention period (HISTORY_RETENTION_DAYS, default 180)
+are pruned whenever a run is recorded; `history prune --compact` reclaims
+the space. Only full runs are recorded: --digest runs (and their exports)
+check just the changed products and would skew the per-run counts.
+"""
+
+import os
+import sqlite3
+from datetime import datetime, timedelta
+
+from db_connection import HISTORY_DB, HISTORY_RETENTION_DAYS
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_at TEXT NOT NULL,
+    database TEXT,
+    source TEXT,
+    total_checked INTEGER,
+    mismatch_count INTEGER,
+    match_count INTEGER,
+    missing_count INTEGER,
+    api_complete INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_runs_run_at ON runs (run_at);
+
+CREATE TABLE IF NOT EXISTS mismatches (
+    run_id INTEGER NOT NULL,
+    run_at TEXT NOT NULL,
+    product_id TEXT NOT NULL,
+    sku TEXT,
+    product_name TEXT,
+    mismatch_type TEXT NOT NULL,
+    cloud_stock INTEGER,
+    cloud_total_stock INTEGER,
+    api_stock INTEGER,
+    batch_stock INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_mismatches_product ON mismatches (product_id, run_at);
+CREATE INDEX IF NOT EXISTS idx_mismatches_sku ON mismatches (sku, run_at);
+CREATE INDEX IF NOT EXISTS idx_mismatches_type ON mismatches (mismatch_type, run_at);
+CREATE INDEX IF NOT EXISTS idx_mismatches_run ON mismatches (run_id);
+CREATE INDEX IF NOT EXISTS idx_mismatches_run_at ON mismatches (run_at);
+"""
+
+# Products missing from the customer API are stored as this mismatch type
+MISSING_FROM_API = 'missing_from_api'
+
+
+def _mismatch_rows(run_id, run_at, results):
+    """Flatten comparison results into one row per product and mismatch type"""
+    for item in results.get('mismatches', []):
+        for kind in item.get('mismatch_type', 'none').split(', '):
+            yield (run_id, run_at, item['product_id'], item.get('sku'), item.get('product_name'), kind,
+                   item.get('cloud_stock'), item.get('cloud_total_stock'), item.get('api_stock'),
+                   item.get('batch_stock'))
+
+    for item in results.get('missing_from_api', []):
+        yield (run_id, run_at, item['product_id'], item.get('sku'), item.get('product_name'), MISSING_FROM_API,
+               item.get('cloud_stock'), item.get('cloud_total_stock'), None, item.get('batch_stock'))
+
+
+class HistoryStore:
+    def __init__(self, path=HISTORY_DB, retention_days=HISTORY_RETENTION_DAYS):
+        """Open (and create if needed) the history database"""
+        self.path = path
+        self.retention_days = retention_days
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(SCHEMA)
+
+    def record_run(self, results, run_at=None, database=None, source='compare'):
+        """Append one comparison run; returns the run id"""
+        run_at = (run_at or datetime.utcnow()).isoformat()
+        api_complete = results.get('api_complete')
+
+        with self.conn:
+            cursor = self.conn.execute(
+                'INSERT INTO runs (run_at, database, source, total_checked, mismatch_count, match_count, '
+                'missing_count, api_complete) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (
+                    run_at, database, source,
+                    results.get('total_checked'),
+                    results.get('mismatch_count', len(results.get('mismatches', []))),
+                    results.get('match_count', len(results.get('matches', []))),
+                    results.get('missing_count', len(results.get('missing_from_api', []))),
+                    None if api_complete is None else int(api_complete)
+                )
+            )
+            run_id = cursor.lastrowid
+            self.conn.executemany(
+                'INSERT INTO mismatches VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                _mismatch_rows(run_id, run_at, results)
+            )
+
+        if self.retention_days:
+            self.prune(self.retention_days)
+        return run_id
+
+    def import_report(self, report_file):
+        """Record an exported comparison report, JSON or NDJSON (backfill)"""
+        from report_diff import load_report
+
+        data = load_report(report_file)
+        if (data.get('digest') or {}).get('changed_products') is not None:
+            raise ValueError("report of a --digest run (changed products only); only full runs are recorded")
+
+        summary = data.get('summary', {})
+        results = {
+            'mismatches': data.get('mismatches', []),
+            'missing_from_api': data.get('missing_from_api', []),
+            'mismatch_count': summary.get('total_mismatches'),
+            'match_count': summary.get('total_matches'),
+            'missing_count': summary.get('total_missing_from_api'),
+            'api_complete': summary.get('api_complete')
+        }
+        if results['match_count'] is not None and results['mismatch_count'] is not None:
+            results['total_checked'] = results['match_count'] + results['mismatch_count'] + (results['missing_count'] or 0)
+
+        generated_at = data.get('generated_at')
+        run_at = datetime.fromisoformat(generated_at) if generated_at else None
+        return self.record_run(results, run_at=run_at, source=os.path.basename(report_file))
+
+    def prune(self, keep_days):
+        """Delete runs older than ``keep_days``; returns the number removed"""
+        cutoff = (datetime.utcnow() - timedelta(days=keep_days)).isoformat()
+        with self.conn:
+            self.conn.execute('DELETE FROM mismatches WHERE run_at < ?', (cutoff,))
+            removed = self.conn.execute('DELETE FROM runs WHERE run_at < ?', (cutoff,)).rowcount
+        return removed
+
+    def compact(self):
+        """Reclaim space left by pruning and refresh the query planner stats"""
+        self.conn.execute('ANALYZE')
+        self.conn.execute('VACUUM')
+        self.conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+    def recent_runs(self, limit=20):
+        return self.conn.execute(
+            'SELECT id, run_at, source, total_checked, mismatch_count, missing_count, api_complete '
+            'FROM runs ORDER BY run_at DESC LIMIT ?', (limit,)
+        ).fetchall()
+
+    def frequent_drifters(self, since, min_count=1, mismatch_type=None, limit=50):
+        """Products that mismatched in at least ``min_count`` runs since ``since``"""
+        query = ('SELECT product_id, MAX(sku), MAX(product_name), COUNT(DISTINCT run_id) AS runs, '
+                 'MIN(run_at), MAX(run_at), GROUP_CONCAT(DISTINCT mismatch_type) '
+                 'FROM mismatches WHERE run_at >= ?')
+        params = [since.isoformat()]
+        if mismatch_type:
+            query += ' AND mismatch_type = ?'
+            params.append(mismatch_type)
+        query += ' GROUP BY product_id HAVING runs >= ? ORDER BY runs DESC, product_id LIMIT ?'
+        params += [min_count, limit]
+        return self.conn.execute(query, params).fetchall()
+
+    def product_history(self, product_id):
+        """Every recorded mismatch row of one product (by ID or SKU), oldest first"""
+        return self.conn.execute(
+            'SELECT run_at, mismatch_type, cloud_stock, cloud_total_stock, api_stock, batch_stock '
+            'FROM mismatches WHERE product_id = ? OR sku = ? ORDER BY run_at, mismatch_type',
+            (product_id, product_id)
+        ).fetchall()
+
+    def type_counts(self, since):
+        """Mismatch rows per day and type since ``since``"""
+        return self.conn.execute(
+            'SELECT substr(run_at, 1, 10) AS day, mismatch_type, COUNT(*) '
+            'FROM mismatches WHERE run_at >= ? GROUP BY day, mismatch_type ORDER BY day, mismatch_type',
+            (since.isoformat(),)
+        ).fetchall()
+
+    def close(self):
+        self.conn.execute('PRAGMA optimize')
+        self.conn.close()
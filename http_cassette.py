@@ -0,0 +1,232 @@
+"""
+HTTP Cassette Record / Replay
+=============================
+Captures customer API responses into compact on-disk cassettes and serves
+them back from an in-process transport, so the stock tools and the order
+history test can run offline, fast and deterministically.
+
+Modes:
+1. record - requests go to the live backend and every response is captured
+2. replay - requests are answered from the cassette, no network is touched
+
+Cassettes are gzip-compressed JSON. Request bodies and headers are never
+stored (the login call carries the customer password), but response bodies
+are, so treat recorded cassettes like any other fixture containing tokens.
+"""
+
+import sys
+import os
+import gzip
+import json
+import time
+import threading
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+CASSETTE_VERSION = 1
+RECORD = 'record'
+REPLAY = 'replay'
+
+# Only these response headers are kept; the rest is noise for the tools
+KEPT_HEADERS = ('Content-Type', 'ETag', 'Retry-After')
+
+
+class CassetteMissError(requests.exceptions.ConnectionError):
+    """Raised in replay mode when a request has no recorded response"""
+
+    # Replaying again gives the same miss, so request retry loops give up
+    retryable = False
+
+
+def request_key(method, url):
+    """Build a stable lookup key from the method and URL (query params sorted)"""
+    parts = urlsplit(url)
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return f"{method.upper()} {urlunsplit((parts.scheme, parts.netloc, parts.path, query, ''))}"
+
+
+class Cassette:
+    def __init__(self, path, mode=REPLAY):
+        """Load an existing cassette (replay) or start an empty one (record)"""
+        if mode not in (RECORD, REPLAY):
+            raise ValueError(f"Unknown cassette mode: {mode}")
+
+        self.path = path
+        self.mode = mode
+        self.interactions = {}
+        self._play_counts = {}
+        # Pages are fetched from several threads; each response is played once
+        self._play_lock = threading.Lock()
+
+        if mode == REPLAY:
+            self.load()
+
+    def load(self):
+        """Read interactions from disk"""
+        with gzip.open(self.path, 'rt', encoding='utf-8') as f:
+            data = json.load(f)
+
+        if data.get('version') != CASSETTE_VERSION:
+            raise ValueError(f"Unsupported cassette version: {data.get('version')}")
+
+        self.interactions = data.get('interactions', {})
+
+    def save(self):
+        """Write recorded interactions to disk (no-op in replay mode)"""
+        if self.mode != RECORD:
+            return
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        data = {
+            'version': CASSETTE_VERSION,
+            'recorded_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'interactions': self.interactions
+        }
+
+        with gzip.open(self.path, 'wt', encoding='utf-8') as f:
+            json.dump(data, f, separators=(',', ':'))
+
+    def record(self, method, url, response):
+        """Store a live response under its request key"""
+        headers = {name: response.headers[name] for name in KEPT_HEADERS if name in response.headers}
+        self.interactions.setdefault(request_key(method, url), []).append({
+            'status': response.status_code,
+            'reason': response.reason,
+            'headers': headers,
+            'body': response.content.decode('utf-8', errors='replace')
+        })
+
+    def play(self, method, url):
+        """Return the next recorded response for a request key
+
+        Repeated calls walk through the recorded responses in order and then
+        keep returning the last one, so polling loops replay deterministically.
+        """
+        key = request_key(method, url)
+        recorded = self.interactions.get(key)
+        if not recorded:
+            raise CassetteMissError(f"No recorded response for {key} in {self.path}")
+
+        with self._play_lock:
+            index = self._play_counts.get(key, 0)
+            self._play_counts[key] = index + 1
+        return recorded[min(index, len(recorded) - 1)]
+
+    def request_count(self):
+        """Total number of recorded responses"""
+        return sum(len(responses) for responses in self.interactions.values())
+
+
+class CassetteAdapter(BaseAdapter):
+    """Transport adapter that records through, or replays from, a cassette"""
+
+    def __init__(self, cassette):
+        super().__init__()
+        self.cassette = cassette
+        self._live = HTTPAdapter() if cassette.mode == RECORD else None
+
+    def send(self, request, **kwargs):
+        if self._live is not None:
+            response = self._live.send(request, **kwargs)
+            self.cassette.record(request.method, request.url, response)
+            return response
+
+        return self._build_response(request, self.cassette.play(request.method, request.url))
+
+    def _build_response(self, request, recorded):
+        response = requests.Response()
+        response.status_code = recorded['status']
+        response.reason = recorded.get('reason')
+        response.headers = CaseInsensitiveDict(recorded.get('headers', {}))
+        response._content = recorded['body'].encode('utf-8')
+        response.encoding = 'utf-8'
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        if self._live is not None:
+            self._live.close()
+
+
+def use_cassette(session, path, mode=REPLAY):
+    """Mount a cassette on a requests session and return it
+
+    Call ``cassette.save()`` when the run is over to persist a recording.
+    """
+    cassette = Cassette(path, mode)
+    adapter = CassetteAdapter(cassette)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    # Replay never touches the network, so skip the proxy/netrc lookups
+    # requests performs on every call
+    if mode == REPLAY:
+        session.trust_env = False
+    return cassette
+
+
+def show_info(path):
+    """Print a summary of a cassette"""
+    cassette = Cassette(path, REPLAY)
+    print(f"📼 Cassette: {path}")
+    print(f"   Size on disk: {os.path.getsize(path)} bytes")
+    print(f"   Request keys: {len(cassette.interactions)}")
+    print(f"   Responses: {cassette.request_count()}")
+    for key, responses in sorted(cassette.interactions.items()):
+        statuses = ', '.join(str(r['status']) for r in responses)
+        print(f"   - {key} [{statuses}]")
+
+
+def run_benchmark(path, rounds=100):
+    """Replay every recorded request ``rounds`` times and report throughput
+
+    Gives a fixed, network-free workload for performance regression checks.
+    """
+    session = requests.Session()
+    cassette = use_cassette(session, path, REPLAY)
+
+    urls = []
+    for key in cassette.interactions:
+        method, url = key.split(' ', 1)
+        urls.extend([(method, url)] * len(cassette.interactions[key]))
+
+    started = time.perf_counter()
+    for _ in range(rounds):
+        cassette._play_counts.clear()
+        for method, url in urls:
+            session.request(method, url).json()
+    elapsed = time.perf_counter() - started
+
+    total = len(urls) * rounds
+    print(f"⏱️  Replayed {total} responses in {elapsed * 1000:.1f} ms "
+          f"({total / elapsed if elapsed else 0:.0f} req/s)")
+
+
+def main():
+    """Main entry point"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Inspect or benchmark recorded HTTP cassettes')
+    parser.add_argument('cassette', help='Path to cassette file')
+    parser.add_argument('--bench', type=int, metavar='ROUNDS', help='Replay all responses ROUNDS times and report throughput')
+
+    args = parser.parse_args()
+
+    if not os.path.exists(args.cassette):
+        print(f"❌ Cassette not found: {args.cassette}")
+        sys.exit(1)
+
+    show_info(args.cassette)
+    if args.bench:
+        run_benchmark(args.cassette, args.bench)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,242 @@
+"""
+Profiling Hooks
+===============
+CPU and memory profiling for the stock tools, enabled from the command line:
+
+    python compare_stock.py --profile compare_profile --trace-memory
+    python fix_stock_mismatches.py --fix-all --profile fix_profile
+    python stock_tools.py --profile run compare --export report.json
+    python test_order_history_sync.py --trace-memory
+
+--profile PREFIX writes:
+- PREFIX.pstats: deterministic cProfile of the main thread
+  (python -m pstats PREFIX.pstats, or snakeviz)
+- PREFIX.collapsed: wall-clock stack samples of every thread (API fetch
+  workers included) in collapsed format, for flamegraph.pl or speedscope
+
+--trace-memory runs tracemalloc and reports, per phase, the peak traced
+memory and the source lines that allocated the most. Snapshots are taken
+at every phase boundary, so expect the run to be noticeably slower.
+
+Phases are the functions decorated with @profiled (compare_stocks,
+_display_results, the fixer loops, ...) plus the stock_tools run phases.
+Only whole phases are decorated, never per-product helpers such as
+calculate_batch_stock. Without either flag the decorators cost one check.
+"""
+
+import os
+import sys
+import time
+import functools
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+SAMPLE_INTERVAL = 0.005
+TOP_SITES = 5
+
+# The profiler of the current run, if profiling is enabled
+_active = None
+
+
+class Profiler:
+    def __init__(self, profile_prefix=None, trace_memory=False, sample_interval=SAMPLE_INTERVAL):
+        """CPU profile (cProfile + stack sampler) and/or per-phase tracemalloc"""
+        self.profile_prefix = profile_prefix
+        self.trace_memory = trace_memory
+        self.sample_interval = sample_interval
+
+        self.phases = {}
+        self.order = []
+        self.samples = Counter()
+        self.overall_peak = 0
+        self._stack = []
+        self._cprofile = None
+        self._sampler = None
+        self._stop = threading.Event()
+
+    # Lifecycle
+
+    def start(self):
+        if self.trace_memory:
+            import tracemalloc
+            tracemalloc.start(10)
+        if self.profile_prefix:
+            import cProfile
+            self._sampler = threading.Thread(target=self._sample, name='profiler-sampler', daemon=True)
+            self._sampler.start()
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+
+    def stop(self):
+        """Stop profiling, write the profile files and print the report"""
+        if self._cprofile is not None:
+            self._cprofile.disable()
+            self._stop.set()
+            self._sampler.join()
+            self._cprofile.dump_stats(f"{self.profile_prefix}.pstats")
+            with open(f"{self.profile_prefix}.collapsed", 'w') as f:
+                for stack, count in self.samples.most_common():
+                    f.write(f"{stack} {count}\n")
+        if self.trace_memory:
+            import tracemalloc
+            self.overall_peak = max(self.overall_peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+        self.print_report()
+
+    # Sampling
+
+    def _sample(self):
+        """Record the stack of every other thread every sample_interval seconds"""
+        me = threading.get_ident()
+        while not self._stop.wait(self.sample_interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, 'thread'))
+                self.samples[';'.join(reversed(stack))] += 1
+
+    # Phases
+
+    def _stats(self, name):
+        stats = self.phases.get(name)
+        if stats is None:
+            stats = self.phases[name] = {'calls': 0, 'seconds': 0.0, 'peak': 0, 'net': 0, 'sites': Counter()}
+            self.order.append(name)
+        return stats
+
+    @contextmanager
+    def phase(self, name):
+        """Time a phase and, with --trace-memory, its peak memory and allocation sites"""
+        # Phases only nest on the thread that runs the tool
+        if threading.current_thread() is not threading.main_thread():
+            yield
+            return
+
+        frame = {'peak': 0, 'snapshot': None}
+        if self.trace_memory:
+            import tracemalloc
+            # Fold the peak so far into the enclosing phase before resetting it
+            if self._stack:
+                self._stack[-1]['peak'] = max(self._stack[-1]['peak'], tracemalloc.get_traced_memory()[1])
+            frame['snapshot'] = tracemalloc.take_snapshot()
+            tracemalloc.reset_peak()
+
+        self._stack.append(frame)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - started
+            self._stack.pop()
+            stats = self._stats(name)
+            stats['calls'] += 1
+            stats['seconds'] += seconds
+
+            if self.trace_memory:
+                import tracemalloc
+                peak = max(frame['peak'], tracemalloc.get_traced_memory()[1])
+                stats['peak'] = max(stats['peak'], peak)
+                self.overall_peak = max(self.overall_peak, peak)
+                if self._stack:
+                    self._stack[-1]['peak'] = max(self._stack[-1]['peak'], peak)
+
+                ignore = (tracemalloc.__file__, __file__)
+                for diff in tracemalloc.take_snapshot().compare_to(frame['snapshot'], 'lineno'):
+                    where = diff.traceback[0]
+                    if where.filename in ignore:
+                        continue
+                    stats['net'] += diff.size_diff
+                    if diff.size_diff > 0:
+                        stats['sites'][f"{os.path.basename(where.filename)}:{where.lineno}"] += diff.size_diff
+
+    # Report
+
+    def print_report(self):
+        print("\n" + "=" * 80)
+        print("🔬 PROFILE")
+        print("=" * 80)
+        if self.profile_prefix:
+            print(f"📈 CPU profile: {self.profile_prefix}.pstats (python -m pstats / snakeviz)")
+            print(f"🔥 Stack samples: {self.profile_prefix}.collapsed "
+                  f"({sum(self.samples.values())} samples; flamegraph.pl / speedscope)")
+        if self.trace_memory:
+            print(f"💾 Peak traced memory: {self.overall_peak / 1024 / 1024:,.1f} MiB")
+
+        if not self.order:
+            return
+        print(f"\n{'Phase':<45} {'Calls':>6} {'Seconds':>9}" + (f" {'Peak MiB':>9} {'Net KiB':>9}" if self.trace_memory else ''))
+        for name in self.order:
+            stats = self.phases[name]
+            line = f"{name[:45]:<45} {stats['calls']:>6} {stats['seconds']:>9.3f}"
+            if self.trace_memory:
+                line += f" {stats['peak'] / 1024 / 1024:>9.1f} {stats['net'] / 1024:>9.1f}"
+            print(line)
+
+        if self.trace_memory:
+            print("\nTop allocation sites per phase:")
+            for name in self.order:
+                sites = self.phases[name]['sites'].most_common(TOP_SITES)
+                if sites:
+                    print(f"   {name}:")
+                    for where, size in sites:
+                        print(f"      {size / 1024:>10.1f} KiB  {where}")
+
+
+def phase(name):
+    """Context manager timing a phase of the active profiler (no-op otherwise)"""
+    if _active is None:
+        return _null_phase()
+    return _active.phase(name)
+
+
+@contextmanager
+def _null_phase():
+    yield
+
+
+def profiled(function):
+    """Decorator: run the function as a profiling phase named after it"""
+    name = function.__qualname__
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if _active is None:
+            return function(*args, **kwargs)
+        with _active.phase(name):
+            return function(*args, **kwargs)
+    return wrapper
+
+
+@contextmanager
+def profile_run(args):
+    """Profile the enclosed run if --profile or --trace-memory was given"""
+    global _active
+
+    prefix = getattr(args, 'profile', None)
+    trace_memory = getattr(args, 'trace_memory', False)
+    if not prefix and not trace_memory:
+        yield None
+        return
+
+    _active = Profiler(prefix, trace_memory)
+    _active.start()
+    try:
+        yield _active
+    finally:
+        profiler, _active = _active, None
+        profiler.stop()
+
+
+def add_profiling_arguments(parser):
+    """Add --profile and --trace-memory"""
+    parser.add_argument('--profile', type=str, metavar='PREFIX',
+                        help='Write a CPU profile to PREFIX.pstats and stack samples to PREFIX.collapsed')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='Report peak memory and top allocation sites per phase (slower)')
@@ -0,0 +1,396 @@
+"""
+Stock Reconciliation Engine
+===========================
+One pass over the catalog that compares product stock with batch stock and
+the customer API, classifies every mismatch and, when asked, plans the
+repair for each drifted product in that same pass.
+
+Sources are pluggable and each is read once per run:
+
+- MongoProductSource: product documents
+- BatchTimelineSource: batch stock for every product from one batches query
+- StockViewSource: batch stock from the materialized product_stock_view
+- CustomerApiSource: products as the customer API shows them
+
+Each run also rolls the results up per category (stock, out-of-stock and
+low-stock products, mismatches, largest deltas) in the same loop.
+
+RepairPlanner folds the three fixes of fix_stock_mismatches.py (batch sync,
+stock/total_stock sync, status) into one $set per product and hands the
+plan to StockFixer's compare-and-set bulk writer, so "find and fix drift"
+reads the catalog once instead of once to compare and again to fix.
+"""
+
+from datetime import datetime
+
+from batch_utils import EMPTY_BATCH_INFO
+from stock_projection import build_timelines
+from profiling import profiled
+
+
+class MongoProductSource:
+    def __init__(self, products_collection, product_ids=None, include_deleted=False, batch_size=None,
+                 categories_collection=None):
+        """Products to reconcile (all non-deleted products by default)
+
+        With ``categories_collection`` each product gets its
+        ``category_name``, joined on the server while the products are read.
+        """
+        self.products_collection = products_collection
+        self.product_ids = product_ids
+        self.include_deleted = include_deleted
+        self.batch_size = batch_size
+        self.categories_collection = categories_collection
+
+    @profiled
+    def load(self):
+        query = {} if self.include_deleted else {'isDeleted': {'$ne': True}}
+        if self.product_ids is not None:
+            query['_id'] = {'$in': list(self.product_ids)}
+
+        if self.categories_collection is None:
+            cursor = self.products_collection.find(query)
+            if self.batch_size:
+                cursor = cursor.batch_size(self.batch_size)
+        else:
+            cursor = self.products_collection.aggregate([
+                {'$match': query},
+                {'$lookup': {
+                    'from': self.categories_collection.name,
+                    'localField': 'category_id',
+                    'foreignField': '_id',
+                    'as': '_category'
+                }},
+                {'$addFields': {'category_name': {'$arrayElemAt': ['$_category.category_name', 0]}}},
+                {'$project': {'_category': 0}}
+            ], batchSize=self.batch_size)
+        products = list(cursor)
+        print(f"📦 Found {len(products)} products in cloud database")
+        return products
+
+
+class BatchTimelineSource:
+    def __init__(self, batches_collection, product_ids=None, batch_size=5000):
+        """Batch stock from expiry timelines built with a single query"""
+        self.batches_collection = batches_collection
+        self.product_ids = product_ids
+        self.batch_size = batch_size
+        self.timelines = {}
+
+    @profiled
+    def load(self, now):
+        self.timelines = build_timelines(self.batches_collection, self.product_ids, self.batch_size)
+        print(f"⏳ Built expiry timelines for {len(self.timelines)} products")
+        return {product_id: timeline.batch_info(now) for product_id, timeline in self.timelines.items()}
+
+
+class StockViewSource:
+    def __init__(self, db):
+        """Batch stock from product_stock_view (refreshed before reading)"""
+        self.db = db
+
+    @profiled
+    def load(self, now):
+        from stock_view import StockView
+
+        view = StockView(self.db)
+        view.load()
+        return {product_id: view.batch_info(product_id) for product_id in view.rows}
+
+
+class CustomerApiSource:
+    def __init__(self, session, api_url, page_size=None, controller=None):
+        """Products listed by the customer API (page size probed unless given)
+
+        After load(), ``complete`` is False if some pages could not be
+        fetched; products not seen are then not compared with the API.
+        """
+        self.session = session
+        self.api_url = api_url
+        self.page_size = page_size
+        self.controller = controller
+        self.complete = True
+        self.failed_pages = []
+
+    @profiled
+    def load(self):
+        from api_client import CustomerApiClient
+
+        client = CustomerApiClient(self.session, self.api_url, self.page_size, controller=self.controller)
+        try:
+            all_products = client.fetch_products()
+        except Exception as e:
+            print(f"❌ Error fetching API products: {e}")
+            self.complete = False
+            return []
+
+        self.complete = client.complete
+        self.failed_pages = client.failed_pages
+        print(f"🌐 Found {len(all_products)} products from customer API ({client.describe_stats()})")
+        if not self.complete:
+            print(f"⚠️  Customer API fetch incomplete (pages {self.failed_pages}); "
+                  f"products not returned are not checked against the API")
+        return all_products
+
+
+class CategoryRollup:
+    def __init__(self, top=3):
+        """Per-category totals, filled product by product during the pass"""
+        self.top = top
+        self.categories = {}
+
+    def add(self, product, kind, row, batch_info):
+        category_id = product.get('category_id') or 'uncategorized'
+        entry = self.categories.get(category_id)
+        if entry is None:
+            entry = self.categories[category_id] = {
+                'category_id': category_id,
+                'category_name': product.get('category_name') or 'Unknown',
+                'products': 0,
+                'cloud_stock': 0,
+                'sellable_stock': 0,
+                'out_of_stock': 0,
+                'low_stock': 0,
+                'mismatch_count': 0,
+                'missing_count': 0,
+                'largest_deltas': []
+            }
+
+        stock = int(product.get('stock', 0))
+        entry['products'] += 1
+        entry['cloud_stock'] += stock
+        entry['sellable_stock'] += batch_info['total_stock']
+        if batch_info['total_stock'] <= 0:
+            entry['out_of_stock'] += 1
+        elif batch_info['total_stock'] <= int(product.get('low_stock_threshold', 0) or 0):
+            entry['low_stock'] += 1
+
+        if kind == 'missing':
+            entry['missing_count'] += 1
+        elif kind == 'mismatch':
+            entry['mismatch_count'] += 1
+            # Largest of the cloud vs batch, API and total_stock differences
+            compared = [row['batch_stock'], row['cloud_total_stock']]
+            if row['api_stock'] is not None:
+                compared.append(row['api_stock'])
+            delta = max((row['cloud_stock'] - value for value in compared), key=abs)
+            deltas = entry['largest_deltas']
+            deltas.append({'product_id': row['product_id'], 'sku': row['sku'], 'delta': delta,
+                           'mismatch_type': row['mismatch_type']})
+            deltas.sort(key=lambda item: -abs(item['delta']))
+            del deltas[self.top:]
+
+    def results(self):
+        """Categories with the most drift first"""
+        # category_id mixes ObjectIds, ints and 'uncategorized'; tie-break on its text
+        return sorted(self.categories.values(),
+                      key=lambda entry: (-entry['mismatch_count'], -entry['missing_count'], str(entry['category_id'])))
+
+
+def classify_product(product_id, cloud_product, batch_info, api_product=None, api_checked=True):
+    """Compare one product across sources
+
+    Returns (kind, row) where kind is 'mismatch', 'match', 'missing' or None
+    (not listed by the API, which is expected for inactive or empty
+    products). With ``api_checked`` False the API comparison is skipped.
+    """
+    cloud_stock = int(cloud_product.get('stock', 0))
+    cloud_total_stock = int(cloud_product.get('total_stock', cloud_stock))
+    batch_stock = batch_info['total_stock']
+    product_name = cloud_product.get('product_name', 'Unknown')
+    sku = cloud_product.get('SKU', 'N/A')
+
+    if api_checked and not api_product:
+        # Product exists in cloud but not in API
+        # This could be normal if stock is 0 or status is not active
+        if cloud_stock > 0 and cloud_product.get('status') == 'active':
+            return 'missing', {
+                'product_id': product_id,
+                'product_name': product_name,
+                'sku': sku,
+                'cloud_stock': cloud_stock,
+                'cloud_total_stock': cloud_total_stock,
+                'batch_stock': batch_stock,
+                'status': cloud_product.get('status', 'N/A'),
+                'reason': 'Missing from customer API despite having stock > 0'
+            }
+        return None, None
+
+    api_stock = int(api_product.get('stock', 0)) if api_product else None
+
+    mismatch_type = []
+    if api_product and cloud_stock != api_stock:
+        mismatch_type.append('cloud_vs_api')
+    if cloud_stock != batch_stock:
+        mismatch_type.append('cloud_vs_batch')
+    if cloud_stock != cloud_total_stock:
+        mismatch_type.append('stock_vs_total_stock')
+
+    row = {
+        'product_id': product_id,
+        'product_name': product_name,
+        'sku': sku,
+        'cloud_stock': cloud_stock,
+        'cloud_total_stock': cloud_total_stock,
+        'api_stock': api_stock,
+        'batch_stock': batch_stock,
+        'active_batches': batch_info['active_batches'],
+        'expired_batches': batch_info['expired_batches'],
+        'status': cloud_product.get('status', 'N/A'),
+        'has_mismatch': bool(mismatch_type),
+        'mismatch_type': ', '.join(mismatch_type) if mismatch_type else 'none'
+    }
+    return ('mismatch' if mismatch_type else 'match'), row
+
+
+class ReconciliationEngine:
+    def __init__(self, product_source, batch_source, api_source=None):
+        """Combine the sources; without an API source only database drift is checked"""
+        self.product_source = product_source
+        self.batch_source = batch_source
+        self.api_source = api_source
+        self.products = {}
+        self.batch_infos = {}
+        self.api_products = {}
+
+    @profiled
+    def run(self, repair=None, now=None, alerts=None):
+        """Read every source once and classify each product
+
+        With ``repair`` (a RepairPlanner) each product is also planned for
+        repair from the batch stock already loaded, and with ``alerts``
+        (stock_alerts.StockAlerts) checked against its low-stock threshold.
+        Returns the same result dict as StockComparison.compare_stocks().
+        """
+        now = now or datetime.utcnow()
+
+        cloud_products = self.product_source.load()
+        api_products = self.api_source.load() if self.api_source else None
+        batch_infos = self.batch_source.load(now)
+
+        self.products = {str(p['_id']): p for p in cloud_products}
+        self.batch_infos = batch_infos
+        self.api_products = api_dict = {str(p['_id']): p for p in api_products} if api_products is not None else {}
+        # A partial API listing can't prove a product is missing from it
+        api_complete = api_products is not None and getattr(self.api_source, 'complete', True)
+
+        mismatches = []
+        matches = []
+        missing_from_api = []
+        rollup = CategoryRollup()
+
+        print(f"\n📊 Analyzing {len(self.products)} products...\n")
+
+        for product_id, cloud_product in self.products.items():
+            batch_info = batch_infos.get(product_id, EMPTY_BATCH_INFO)
+
+            kind, row = classify_product(
+                product_id,
+                cloud_product,
+                batch_info,
+                api_dict.get(product_id),
+                api_checked=api_complete or product_id in api_dict
+            )
+            if kind == 'mismatch':
+                mismatches.append(row)
+            elif kind == 'match':
+                matches.append(row)
+            elif kind == 'missing':
+                missing_from_api.append(row)
+            rollup.add(cloud_product, kind, row, batch_info)
+
+            if repair is not None:
+                repair.consider(cloud_product, batch_info['total_stock'])
+            if alerts is not None:
+                alerts.observe(cloud_product, batch_info['total_stock'], now)
+
+        return {
+            'mismatches': mismatches,
+            'matches': matches,
+            'missing_from_api': missing_from_api,
+            'total_checked': len(self.products),
+            'mismatch_count': len(mismatches),
+            'match_count': len(matches),
+            'missing_count': len(missing_from_api),
+            'api_complete': api_complete if self.api_source else None,
+            'categories': rollup.results()
+        }
+
+
+class RepairPlanner:
+    def __init__(self, fixer, batches=True, fields=True, missing=True, fixes=None):
+        """Plan repairs for a StockFixer; each flag enables one kind of fix
+
+        ``fixes`` optionally maps product IDs to the fixes ('batches',
+        'fields', 'missing') allowed for that product; products not in it
+        get none.
+        """
+        self.fixer = fixer
+        self.batches = batches
+        self.fields = fields
+        self.missing = missing
+        self.fixes = fixes
+        self.planned = []
+
+    def _enabled(self, product, kind):
+        if not getattr(self, kind):
+            return False
+        return self.fixes is None or kind in self.fixes.get(str(product['_id']), ())
+
+    def plan_changes(self, product, batch_stock):
+        """Fields to $set on one product, or None
+
+        Same outcome as running --fix-batches, --fix-fields and --fix-missing
+        one after another: the status check sees the stock the batch sync
+        writes.
+        """
+        if product.get('isDeleted') is True:
+            return None
+
+        changes = {}
+        stock = int(product.get('stock', 0))
+        total_stock = int(product.get('total_stock', stock))
+
+        if self._enabled(product, 'batches') and stock != batch_stock:
+            changes['stock'] = batch_stock
+            changes['total_stock'] = batch_stock
+            stock = batch_stock
+        elif self._enabled(product, 'fields') and stock != total_stock:
+            changes['total_stock'] = stock
+
+        if self._enabled(product, 'missing') and stock > 0 and product.get('status', 'unknown') != 'active':
+            changes['status'] = 'active'
+
+        return changes or None
+
+    def consider(self, product, batch_stock):
+        """Plan the repair for a product seen during the pass"""
+        changes = self.plan_changes(product, batch_stock)
+        if not changes:
+            return
+
+        print(f"📦 {product.get('product_name', 'Unknown')} ({product.get('SKU', 'N/A')})")
+        for field, value in changes.items():
+            print(f"   {field}: {product.get(field)} -> {value}")
+        self.planned.append((product, changes))
+
+    def replan(self, product):
+        """Re-plan a product that changed during the write (fresh batch stock)"""
+        batch_stock = self.fixer.calculate_batch_stock(product['_id']) if self._enabled(product, 'batches') else 0
+        return self.plan_changes(product, batch_stock)
+
+    @profiled
+    def apply(self, before_chunk=None):
+        """Write the planned repairs (or report them in dry-run mode)
+
+        ``before_chunk`` runs before every bulk write (see _conditional_update).
+        """
+        print("\n🔧 Applying repairs from this pass...\n")
+
+        fixed_count, conflicts = len(self.planned), []
+        if self.planned and not self.fixer.dry_run:
+            fixed_count, conflicts = self.fixer._conditional_update(self.planned, self.replan, before_chunk)
+
+        self.fixer._report_fix_result(fixed_count, conflicts, [])
+        self.planned = []
+        return fixed_count
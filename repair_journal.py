@@ -0,0 +1,99 @@
+"""
+Repair Undo Journal
+===================
+Streaming NDJSON journal written by StockFixer before each live bulk write.
+
+Only the fields a repair is about to modify are recorded, for the products
+it touches, so writing the journal (and undoing it) scales with the size of
+the repair instead of the database. Values are stored as canonical
+Extended JSON so dates and number types round-trip exactly.
+
+Line format:
+    {"journal": 1, "created_at": ..., "database": ..., "collection": ...}
+    {"_id": ..., "before": {...}, "unset": [...], "after": {...}}
+
+"before" holds prior values, "unset" lists fields that did not exist, and
+"after" holds the values the repair wrote (used to skip undoing products
+that changed again since).
+"""
+
+import os
+import gzip
+from datetime import datetime
+
+from bson import json_util
+
+JOURNAL_VERSION = 1
+JSON_OPTIONS = json_util.CANONICAL_JSON_OPTIONS
+
+
+def default_journal_path():
+    """Timestamped journal file name in the current directory"""
+    return f"stock_fix_journal_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.ndjson.gz"
+
+
+def _open(path, mode):
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+class RepairJournal:
+    def __init__(self, path, database, collection):
+        """Create the journal file and write its header line"""
+        self.path = path
+        self.entries = 0
+        self._file = _open(path, 'w')
+        self._write({
+            'journal': JOURNAL_VERSION,
+            'created_at': datetime.utcnow(),
+            'database': database,
+            'collection': collection
+        })
+        self.flush()
+
+    def _write(self, document):
+        self._file.write(json_util.dumps(document, json_options=JSON_OPTIONS))
+        self._file.write('\n')
+
+    def record(self, product, changes, fields=None):
+        """Record the prior values of the fields a write will modify
+
+        ``fields`` defaults to the keys of ``changes``; pass it when the write
+        also touches fields whose new value isn't known up front.
+        """
+        before = {}
+        unset = []
+        for field in fields or changes:
+            if field in product:
+                before[field] = product[field]
+            else:
+                unset.append(field)
+
+        self._write({'_id': product['_id'], 'before': before, 'unset': unset, 'after': changes})
+        self.entries += 1
+
+    def flush(self):
+        """Push buffered entries to disk before the matching writes run"""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+def read_journal(path):
+    """Return (header, iterator over entries) for a journal file"""
+    handle = _open(path, 'r')
+    header = json_util.loads(handle.readline(), json_options=JSON_OPTIONS)
+    if header.get('journal') != JOURNAL_VERSION:
+        handle.close()
+        raise ValueError(f"Not a stock fix journal: {path}")
+
+    def entries():
+        with handle:
+            for line in handle:
+                if line.strip():
+                    yield json_util.loads(line, json_options=JSON_OPTIONS)
+
+    return header, entries()
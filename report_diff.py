@@ -0,0 +1,184 @@
+"""
+Report Diff
+===========
+Compares two comparison exports and lists what changed between them:
+
+- new: mismatched (or missing from the API) now, not before
+- resolved: mismatched before, not any more
+- persistent: mismatched in both, with the stock values of each side and
+  whether they moved
+
+    python stock_tools.py report diff before.ndjson after.ndjson
+    python stock_tools.py report diff before.json after.json --output diff.ndjson
+
+Both reports are read as streams sorted by product_id and merged in one
+pass, so NDJSON exports (`--export report.ndjson`, optionally `.gz`) are
+diffed in constant memory however large they are. JSON exports are one
+document, so each is loaded and sorted first.
+
+NDJSON export format: a header line with the summary, then one line per
+product sorted by product_id, each tagged with its record kind:
+
+    {"record": "header", "generated_at": "...", "summary": {...}}
+    {"record": "mismatch", "product_id": "PROD-00001", "cloud_stock": 10, ...}
+    {"record": "missing", "product_id": "PROD-00007", ...}
+"""
+
+import gzip
+import json
+import heapq
+
+NDJSON_SUFFIXES = ('.ndjson', '.ndjson.gz', '.jsonl', '.jsonl.gz')
+
+# Report section -> record kind in the NDJSON format
+SECTIONS = (('mismatches', 'mismatch'), ('matches', 'match'), ('missing_from_api', 'missing'))
+
+# Stock values compared for persistent mismatches
+STOCK_FIELDS = ('cloud_stock', 'cloud_total_stock', 'api_stock', 'batch_stock')
+
+
+class ReportOrderError(ValueError):
+    """A streamed report is not sorted by product_id"""
+
+
+def is_ndjson(filename):
+    return filename.endswith(NDJSON_SUFFIXES)
+
+
+def _open(filename, mode):
+    if filename.endswith('.gz'):
+        return gzip.open(filename, mode + 't', encoding='utf-8')
+    return open(filename, mode, encoding='utf-8')
+
+
+def write_ndjson_report(filename, header, mismatches, matches, missing_from_api):
+    """Write an NDJSON export: header line, then all rows sorted by product_id"""
+    def tagged(section, kind):
+        for row in sorted(section, key=lambda row: row['product_id']):
+            yield row['product_id'], kind, row
+
+    sections = (mismatches, matches, missing_from_api)
+    rows = heapq.merge(*[tagged(section, kind) for section, (_name, kind) in zip(sections, SECTIONS)])
+    with _open(filename, 'w') as f:
+        f.write(json.dumps(dict(header, record='header'), default=str) + '\n')
+        for _product_id, kind, row in rows:
+            f.write(json.dumps(dict(row, record=kind), default=str) + '\n')
+
+
+def load_report(filename):
+    """Whole report as the JSON export's dict, whichever format it was written in"""
+    if not is_ndjson(filename):
+        with open(filename, 'r') as f:
+            return json.load(f)
+
+    report = {name: [] for name, _kind in SECTIONS}
+    section_for = {kind: name for name, kind in SECTIONS}
+    with _open(filename, 'r') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            kind = row.pop('record', None)
+            if kind == 'header':
+                report.update(row)
+            elif kind in section_for:
+                report[section_for[kind]].append(row)
+    return report
+
+
+def iter_report(filename):
+    """(product_id, kind, row) for every mismatched or missing product, by product_id
+
+    NDJSON reports are streamed and must already be sorted (the exporter
+    sorts them); JSON reports are loaded and sorted here.
+    """
+    if not is_ndjson(filename):
+        report = load_report(filename)
+        rows = [(row['product_id'], kind, row)
+                for name, kind in SECTIONS if kind != 'match'
+                for row in report.get(name, [])]
+        yield from sorted(rows, key=lambda entry: entry[0])
+        return
+
+    previous = None
+    with _open(filename, 'r') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            kind = row.pop('record', None)
+            if kind not in ('mismatch', 'missing'):
+                continue
+            product_id = row['product_id']
+            if previous is not None and product_id <= previous:
+                raise ReportOrderError(f"{filename} is not sorted by product_id at {product_id}")
+            previous = product_id
+            yield product_id, kind, row
+
+
+def _describe(kind, row):
+    """Mismatch label of one report row"""
+    return 'missing_from_api' if kind == 'missing' else row.get('mismatch_type', 'none')
+
+
+def diff_reports(old_file, new_file):
+    """Merge two reports and yield one change record per product that differs
+
+    Records are dicts with ``change`` ('new', 'resolved' or 'persistent'),
+    the product fields and, for persistent mismatches, ``before``/``after``
+    stock values and ``stock_changed``.
+    """
+    old_rows = iter_report(old_file)
+    new_rows = iter_report(new_file)
+    old = next(old_rows, None)
+    new = next(new_rows, None)
+
+    while old is not None or new is not None:
+        if new is None or (old is not None and old[0] < new[0]):
+            product_id, kind, row = old
+            yield {'change': 'resolved', 'product_id': product_id, 'sku': row.get('sku'),
+                   'product_name': row.get('product_name'), 'was': _describe(kind, row)}
+            old = next(old_rows, None)
+        elif old is None or new[0] < old[0]:
+            product_id, kind, row = new
+            yield {'change': 'new', 'product_id': product_id, 'sku': row.get('sku'),
+                   'product_name': row.get('product_name'), 'now': _describe(kind, row),
+                   'after': {field: row.get(field) for field in STOCK_FIELDS}}
+            new = next(new_rows, None)
+        else:
+            product_id, old_kind, old_row = old
+            _, new_kind, new_row = new
+            before = {field: old_row.get(field) for field in STOCK_FIELDS}
+            after = {field: new_row.get(field) for field in STOCK_FIELDS}
+            yield {'change': 'persistent', 'product_id': product_id, 'sku': new_row.get('sku'),
+                   'product_name': new_row.get('product_name'),
+                   'was': _describe(old_kind, old_row), 'now': _describe(new_kind, new_row),
+                   'before': before, 'after': after, 'stock_changed': before != after}
+            old = next(old_rows, None)
+            new = next(new_rows, None)
+
+
+def summarize_diff(changes, top=10, output=None):
+    """Count the change records, keeping the first ``top`` of each kind
+
+    With ``output`` every record is also written to that NDJSON file, so
+    the full diff never has to be held in memory.
+    """
+    counts = {'new': 0, 'resolved': 0, 'persistent': 0, 'stock_changed': 0}
+    samples = {'new': [], 'resolved': [], 'persistent': []}
+
+    out = _open(output, 'w') if output else None
+    try:
+        for change in changes:
+            kind = change['change']
+            counts[kind] += 1
+            if change.get('stock_changed'):
+                counts['stock_changed'] += 1
+            if len(samples[kind]) < top and (kind != 'persistent' or change['stock_changed']):
+                samples[kind].append(change)
+            if out is not None:
+                out.write(json.dumps(change, default=str) + '\n')
+    finally:
+        if out is not None:
+            out.close()
+    return counts, samples
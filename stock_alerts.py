@@ -0,0 +1,188 @@
+"""
+Low-Stock Alerts
+================
+Evaluates every product's batch stock against its `low_stock_threshold`
+during the reconciliation pass (no extra queries) and emits an event when
+a product crosses below its threshold or recovers:
+
+    python stock_tools.py compare --alerts
+    python stock_tools.py compare --alerts --alert-webhook https://hooks.example/stock
+    python stock_tools.py serve --alerts          # checked on every refresh
+
+- Hysteresis: a low product only recovers once its stock is above
+  threshold + max(1, 20% of threshold), so stock hovering around the
+  threshold does not flap
+- Debounce: a change must be seen in --alert-confirm consecutive runs
+  (default 1), and one product gets at most one event per
+  --alert-cooldown minutes (default 30); a change inside the cooldown
+  fires once it has passed, if it still holds
+- State (per-product low/ok) lives in a JSON file between runs and is only
+  saved after the events were delivered
+
+Events go to an NDJSON file (default stock_alerts.ndjson) or, with
+--alert-webhook, are POSTed as {"events": [...]}. Products without a
+threshold (0 or missing) are not evaluated.
+"""
+
+import os
+import json
+import math
+from datetime import datetime, timedelta
+
+ALERT_STATE_FILE = os.getenv('ALERT_STATE_FILE', 'stock_alert_state.json')
+ALERT_SINK_FILE = os.getenv('ALERT_SINK_FILE', 'stock_alerts.ndjson')
+
+RECOVERY_RATIO = 0.2
+DEFAULT_CONFIRM_RUNS = 1
+DEFAULT_COOLDOWN_MINUTES = 30
+
+CROSSED_BELOW = 'crossed_below'
+RECOVERED = 'recovered'
+
+
+def recovery_level(threshold):
+    """Stock a low product must exceed to count as recovered"""
+    return threshold + max(1, math.ceil(threshold * RECOVERY_RATIO))
+
+
+class StockAlerts:
+    def __init__(self, state_file=ALERT_STATE_FILE, sink_file=ALERT_SINK_FILE, webhook_url=None, session=None,
+                 confirm_runs=DEFAULT_CONFIRM_RUNS, cooldown_minutes=DEFAULT_COOLDOWN_MINUTES):
+        """Low-stock evaluation with hysteresis and debounce, state kept in ``state_file``"""
+        self.state_file = state_file
+        self.sink_file = sink_file
+        self.webhook_url = webhook_url
+        self.session = session
+        self.confirm_runs = max(1, confirm_runs)
+        self.cooldown = timedelta(minutes=cooldown_minutes)
+        self.events = []
+        self.low_count = 0
+        self.state = self._load_state()
+
+    def _load_state(self):
+        try:
+            with open(self.state_file, 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except json.JSONDecodeError:
+            print(f"⚠️  Alert state {self.state_file} is unreadable; starting fresh")
+            return {}
+
+    def observe(self, product, batch_stock, now):
+        """Evaluate one product seen during the pass"""
+        threshold = int(product.get('low_stock_threshold') or 0)
+        if threshold <= 0:
+            return
+
+        if batch_stock <= threshold:
+            self.low_count += 1
+
+        product_id = str(product['_id'])
+        entry = self.state.get(product_id)
+        if entry is None:
+            entry = self.state[product_id] = {'state': 'ok', 'pending': 0, 'last_event_at': None}
+
+        if entry['state'] == 'ok':
+            wants_change = batch_stock <= threshold
+        else:
+            wants_change = batch_stock > recovery_level(threshold)
+        if not wants_change:
+            entry['pending'] = 0
+            return
+
+        entry['pending'] += 1
+        if entry['pending'] < self.confirm_runs:
+            return
+
+        last_event_at = entry['last_event_at']
+        if last_event_at and now - datetime.fromisoformat(last_event_at) < self.cooldown:
+            # Keep it pending; it fires on the first run after the cooldown
+            return
+
+        entry['state'] = 'low' if entry['state'] == 'ok' else 'ok'
+        entry['pending'] = 0
+        entry['last_event_at'] = now.isoformat()
+        self.events.append({
+            'event': CROSSED_BELOW if entry['state'] == 'low' else RECOVERED,
+            'at': now.isoformat(),
+            'product_id': product_id,
+            'product_name': product.get('product_name'),
+            'sku': product.get('SKU'),
+            'category_name': product.get('category_name'),
+            'batch_stock': batch_stock,
+            'threshold': threshold,
+            'recovers_above': recovery_level(threshold)
+        })
+
+    def _deliver(self):
+        """Send the events; returns True when they reached the sink"""
+        if self.webhook_url:
+            session = self.session
+            if session is None:
+                import requests
+                session = requests.Session()
+            try:
+                response = session.post(self.webhook_url, json={'events': self.events}, timeout=10)
+            except Exception as e:
+                print(f"❌ Alert webhook failed: {e}")
+                return False
+            if response.status_code >= 300:
+                print(f"❌ Alert webhook returned status {response.status_code}")
+                return False
+            return True
+
+        with open(self.sink_file, 'a') as f:
+            for event in self.events:
+                f.write(json.dumps(event) + '\n')
+        return True
+
+    def flush(self):
+        """Deliver this run's events and save the state
+
+        If delivery fails the state is not saved, so the same changes are
+        detected (and sent) again on the next run.
+        """
+        crossed = sum(event['event'] == CROSSED_BELOW for event in self.events)
+        recovered = len(self.events) - crossed
+
+        if self.events and not self._deliver():
+            # Forget this run's transitions so they are detected again
+            self.state = self._load_state()
+            self.events = []
+            self.low_count = 0
+            return 0
+
+        tmp_file = f"{self.state_file}.tmp"
+        with open(tmp_file, 'w') as f:
+            json.dump(self.state, f)
+        os.replace(tmp_file, self.state_file)
+
+        print(f"\n🔔 Low stock: {self.low_count} products at or below threshold; "
+              f"{crossed} new low-stock alerts, {recovered} recovered")
+        if self.events:
+            print(f"   Sent to {self.webhook_url or self.sink_file}")
+        sent = len(self.events)
+        self.events = []
+        self.low_count = 0
+        return sent
+
+
+def add_alert_arguments(parser):
+    """Add the low-stock alert options (compare and serve)"""
+    parser.add_argument('--alerts', action='store_true', help='Emit low-stock and recovery alerts during the pass')
+    parser.add_argument('--alert-state', default=ALERT_STATE_FILE, help=f'Alert state file (default {ALERT_STATE_FILE})')
+    parser.add_argument('--alert-sink', default=ALERT_SINK_FILE, help=f'NDJSON file events are appended to (default {ALERT_SINK_FILE})')
+    parser.add_argument('--alert-webhook', type=str, metavar='URL', help='POST events to this URL instead of the NDJSON file')
+    parser.add_argument('--alert-confirm', type=int, default=DEFAULT_CONFIRM_RUNS, metavar='RUNS',
+                        help=f'Runs a change must persist before it is alerted (default {DEFAULT_CONFIRM_RUNS})')
+    parser.add_argument('--alert-cooldown', type=int, default=DEFAULT_COOLDOWN_MINUTES, metavar='MINUTES',
+                        help=f'Minimum minutes between alerts for one product (default {DEFAULT_COOLDOWN_MINUTES})')
+
+
+def alerts_from_args(args, session=None):
+    """StockAlerts configured from add_alert_arguments() flags, or None"""
+    if not getattr(args, 'alerts', False):
+        return None
+    return StockAlerts(args.alert_state, args.alert_sink, args.alert_webhook, session,
+                       args.alert_confirm, args.alert_cooldown)
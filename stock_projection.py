@@ -0,0 +1,145 @@
+"""
+Expiry Timeline & Stock Projection
+==================================
+Builds one sorted expiry-event timeline per product from the batches
+collection, using the same rules as batch_utils.summarize_batches():
+
+- only active batches with quantity_remaining > 0 count
+- a batch is sellable while expiry_date >= the point in time
+- batches without a (parseable) expiry date never drop out
+
+With the timelines built once, "stock at time T" is a binary search and a
+set of future times for the whole catalog is answered in one sweep.
+"""
+
+import heapq
+from bisect import bisect_left
+
+from batch_utils import parse_datetime, ACTIVE_BATCH_QUERY
+
+
+class ExpiryTimeline:
+    def __init__(self, product_id, batches):
+        """Build the timeline from a product's active batch documents"""
+        self.product_id = product_id
+        self.never_expiring = 0
+        self.never_expiring_batches = 0
+
+        events = []
+        for batch in batches:
+            quantity = int(batch.get('quantity_remaining', 0))
+            expiry = batch.get('expiry_date')
+            parsed = parse_datetime(expiry)
+            if parsed is None:
+                # Missing or unparseable dates are treated as non-expiring,
+                # exactly like calculate_batch_stock()
+                self.never_expiring += quantity
+                self.never_expiring_batches += 1
+            else:
+                events.append((parsed, quantity, str(batch.get('_id'))))
+
+        events.sort()
+        self.events = events
+        self.expiry_times = [event[0] for event in events]
+
+        # suffix[i] = quantity still sellable once events[:i] have expired
+        self.suffix = [0] * (len(events) + 1)
+        for i in range(len(events) - 1, -1, -1):
+            self.suffix[i] = self.suffix[i + 1] + events[i][1]
+
+    def _index(self, when):
+        """Number of batches already expired at ``when``"""
+        return bisect_left(self.expiry_times, when)
+
+    def stock_at(self, when):
+        """Sellable stock at a point in time"""
+        return self.never_expiring + self.suffix[self._index(when)]
+
+    def batch_info(self, when):
+        """Same shape as calculate_batch_stock() for the given time"""
+        expired = self._index(when)
+        return {
+            'total_stock': self.never_expiring + self.suffix[expired],
+            'active_batches': self.never_expiring_batches + len(self.events) - expired,
+            'expired_batches': expired
+        }
+
+    def next_drops(self, after, limit):
+        """Next ``limit`` expiry drops for batches still sellable at ``after``"""
+        start = self._index(after)
+        drops = []
+        for i in range(start, min(start + limit, len(self.events))):
+            expiry, quantity, batch_id = self.events[i]
+            drops.append({
+                'product_id': self.product_id,
+                'expires_at': expiry,
+                'quantity': quantity,
+                'batch_id': batch_id,
+                'stock_after': self.never_expiring + self.suffix[i + 1]
+            })
+        return drops
+
+    def iter_drops(self, after):
+        """Iterate drops after ``after`` in time order (for catalog merges)"""
+        for i in range(self._index(after), len(self.events)):
+            expiry, quantity, batch_id = self.events[i]
+            yield expiry, self.product_id, quantity, batch_id, self.never_expiring + self.suffix[i + 1]
+
+
+def build_timelines(batches_collection, product_ids=None, batch_size=5000):
+    """Load active batches in one query and build a timeline per product"""
+    query = dict(ACTIVE_BATCH_QUERY)
+    if product_ids is not None:
+        query['product_id'] = {'$in': list(product_ids)}
+
+    grouped = {}
+    cursor = batches_collection.find(
+        query,
+        {'product_id': 1, 'expiry_date': 1, 'quantity_remaining': 1},
+        batch_size=batch_size
+    )
+    for batch in cursor:
+        if batch.get('product_id') is not None:
+            grouped.setdefault(batch['product_id'], []).append(batch)
+
+    return {product_id: ExpiryTimeline(product_id, batches) for product_id, batches in grouped.items()}
+
+
+def project_stock(timelines, times):
+    """Sweep-line pass: stock per product at each of ``times``
+
+    Each timeline is walked once from the earliest to the latest requested
+    time, so the cost is O(events + products * times) for the whole catalog.
+    Returns {product_id: [stock at times[0], stock at times[1], ...]}.
+    """
+    order = sorted(range(len(times)), key=lambda i: times[i])
+    projection = {}
+
+    for product_id, timeline in timelines.items():
+        values = [0] * len(times)
+        position = 0
+        for i in order:
+            when = times[i]
+            while position < len(timeline.expiry_times) and timeline.expiry_times[position] < when:
+                position += 1
+            values[i] = timeline.never_expiring + timeline.suffix[position]
+        projection[product_id] = values
+
+    return projection
+
+
+def catalog_next_drops(timelines, after, limit):
+    """Next ``limit`` expiry drops across the whole catalog"""
+    merged = heapq.merge(*(timeline.iter_drops(after) for timeline in timelines.values()))
+    drops = []
+    for expiry, product_id, quantity, batch_id, stock_after in merged:
+        drops.append({
+            'product_id': product_id,
+            'expires_at': expiry,
+            'quantity': quantity,
+            'batch_id': batch_id,
+            'stock_after': stock_after
+        })
+        if len(drops) >= limit:
+            break
+    return drops
@@ -0,0 +1,283 @@
+"""
+Stock Health Server
+===================
+Read-only HTTP service that serves the latest reconciliation result from
+memory. A background thread re-runs the comparison on a schedule; requests
+never touch MongoDB or the customer API, however many clients poll.
+
+    python stock_tools.py serve --port 8080 --interval 300
+
+Endpoints (JSON):
+- GET /summary                        counts, run time, API completeness
+- GET /mismatches?sku=&type=&limit=   mismatched and missing products
+- GET /products/<product_id>          per-product detail (like `check`)
+- GET /health                         refresh status, for monitoring
+
+Every response carries an ETag that only changes when a refresh produces a
+different result, so pollers sending If-None-Match get a bodiless 304.
+`generated_at` is when the current result first appeared; /health shows
+when it was last re-checked.
+"""
+
+import json
+import time
+import hashlib
+import threading
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs, unquote
+
+DEFAULT_PORT = 8080
+DEFAULT_INTERVAL = 300
+
+# Rendered responses kept per result (path + query -> ETag, body)
+MAX_CACHED_RESPONSES = 1024
+
+
+def product_detail(product_id, product, batch_info, api_product, api_checked):
+    """Detail for one product, with the fields `check` prints
+
+    Classified by reconcile.classify_product(), so the detail view always
+    agrees with the comparison.
+    """
+    from reconcile import classify_product
+
+    kind, row = classify_product(product_id, product, batch_info, api_product, api_checked)
+    if kind not in ('mismatch', 'match'):
+        # Not listed by the API: still report the database-side drift
+        _kind, row = classify_product(product_id, product, batch_info, api_product, api_checked=False)
+
+    mismatches = row['mismatch_type'].split(', ') if row['has_mismatch'] else []
+    if kind == 'missing':
+        mismatches.append('missing_from_api')
+
+    return {
+        'product_id': product_id,
+        'product_name': product.get('product_name'),
+        'sku': product.get('SKU'),
+        'status': product.get('status'),
+        'cloud': {
+            'stock': row['cloud_stock'],
+            'total_stock': row['cloud_total_stock'],
+            'low_stock_threshold': product.get('low_stock_threshold', 0)
+        },
+        'api': {
+            'checked': api_checked,
+            'visible': api_product is not None if api_checked else None,
+            'stock': row['api_stock']
+        },
+        'batches': {
+            'stock': row['batch_stock'],
+            'active_batches': row['active_batches'],
+            'expired_batches': row['expired_batches']
+        },
+        'mismatch_types': mismatches,
+        'in_sync': not mismatches
+    }
+
+
+class ResultCache:
+    def __init__(self, comparison, interval=DEFAULT_INTERVAL, use_stock_view=False, alerts=None):
+        """Latest reconciliation result, refreshed by a background thread
+
+        With ``alerts`` (stock_alerts.StockAlerts) low-stock alerts are
+        evaluated on every refresh.
+        """
+        self.comparison = comparison
+        self.interval = interval
+        self.use_stock_view = use_stock_view
+        self.alerts = alerts
+
+        self.summary = None
+        self.rows = []
+        self.details = {}
+        self.version = None
+        self.checked_at = None
+        self.last_error = None
+        self.last_refresh_seconds = None
+        self.responses = {}
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def refresh(self):
+        """Run one comparison and swap the result in"""
+        from batch_utils import EMPTY_BATCH_INFO
+
+        started = time.perf_counter()
+        engine = self.comparison.build_engine(use_stock_view=self.use_stock_view)
+        results = engine.run(alerts=self.alerts)
+        if self.alerts is not None:
+            self.alerts.flush()
+
+        api_complete = results['api_complete']
+        details = {}
+        for product_id, product in engine.products.items():
+            api_product = engine.api_products.get(product_id)
+            details[product_id] = product_detail(
+                product_id, product, engine.batch_infos.get(product_id, EMPTY_BATCH_INFO),
+                api_product, api_complete or api_product is not None
+            )
+
+        rows = sorted(
+            [dict(row, kind='mismatch') for row in results['mismatches']] +
+            [dict(row, kind='missing_from_api') for row in results['missing_from_api']],
+            key=lambda row: row['product_id']
+        )
+        summary = {
+            'generated_at': datetime.utcnow().isoformat(),
+            'total_checked': results['total_checked'],
+            'mismatch_count': results['mismatch_count'],
+            'match_count': results['match_count'],
+            'missing_count': results['missing_count'],
+            'api_complete': api_complete
+        }
+        version = hashlib.sha1(
+            json.dumps([api_complete, rows, details], sort_keys=True, default=str).encode('utf-8')
+        ).hexdigest()[:16]
+
+        with self._lock:
+            # An unchanged result keeps its ETag (and generated_at), so
+            # pollers keep getting 304s
+            if version != self.version:
+                self.responses = {}
+                self.summary = summary
+                self.rows = rows
+                self.details = details
+                self.version = version
+            self.checked_at = datetime.utcnow().isoformat()
+            self.last_error = None
+            self.last_refresh_seconds = time.perf_counter() - started
+        print(f"🔄 Refreshed in {self.last_refresh_seconds:.1f}s: {summary['mismatch_count']} mismatches, "
+              f"{summary['missing_count']} missing from API")
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+            except Exception as e:
+                # Keep serving the previous result
+                self.last_error = f"{datetime.utcnow().isoformat()}: {e}"
+                print(f"❌ Refresh failed: {e}")
+            self._stop.wait(self.interval)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='stock-refresh', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def health(self):
+        return {
+            'ready': self.summary is not None,
+            'generated_at': self.summary['generated_at'] if self.summary else None,
+            'checked_at': self.checked_at,
+            'refresh_interval_seconds': self.interval,
+            'last_refresh_seconds': self.last_refresh_seconds,
+            'last_error': self.last_error
+        }
+
+    def render(self, path, query):
+        """(status, ETag, body bytes) for a request, cached per result version"""
+        key = path + '?' + '&'.join(f"{name}={','.join(values)}" for name, values in sorted(query.items()))
+        with self._lock:
+            cached = self.responses.get(key)
+            if cached is not None:
+                return cached
+            version, summary, rows, details = self.version, self.summary, self.rows, self.details
+
+        status, payload = self._build(path, query, summary, rows, details)
+        body = json.dumps(payload, default=str).encode('utf-8')
+        etag = f'"{version}-{hashlib.sha1(key.encode()).hexdigest()[:8]}"'
+        response = (status, etag, body)
+
+        with self._lock:
+            if version == self.version and len(self.responses) < MAX_CACHED_RESPONSES:
+                self.responses[key] = response
+        return response
+
+    def _build(self, path, query, summary, rows, details):
+        if path == '/summary':
+            return 200, summary
+
+        if path == '/mismatches':
+            sku = query.get('sku', [None])[0]
+            kind = query.get('type', [None])[0]
+            limit = query.get('limit', [''])[0]
+            selected = [
+                row for row in rows
+                if (sku is None or row.get('sku') == sku)
+                and (kind is None or kind == row['kind'] or kind in row.get('mismatch_type', '').split(', '))
+            ]
+            if limit.isdigit():
+                selected = selected[:int(limit)]
+            return 200, {'generated_at': summary['generated_at'], 'count': len(selected), 'mismatches': selected}
+
+        if path.startswith('/products/'):
+            product_id = unquote(path[len('/products/'):])
+            detail = details.get(product_id)
+            if detail is None:
+                return 404, {'error': f"Product {product_id} not found"}
+            return 200, dict(detail, generated_at=summary['generated_at'])
+
+        return 404, {'error': 'Unknown endpoint', 'endpoints': ['/summary', '/mismatches', '/products/<id>', '/health']}
+
+
+class StockRequestHandler(BaseHTTPRequestHandler):
+    cache = None
+    server_version = 'StockHealth/1.0'
+
+    def _send(self, status, body, etag=None):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Cache-Control', 'no-cache')
+        if etag:
+            self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        path = url.path.rstrip('/') or '/'
+
+        if path == '/health':
+            health = self.cache.health()
+            self._send(200 if health['ready'] else 503, json.dumps(health).encode('utf-8'))
+            return
+
+        if self.cache.version is None:
+            self._send(503, json.dumps({'error': 'First refresh still running', **self.cache.health()}).encode('utf-8'))
+            return
+
+        status, etag, body = self.cache.render(path, parse_qs(url.query))
+        if status == 200 and etag in self.headers.get('If-None-Match', ''):
+            self._send(304, b'', etag)
+            return
+        self._send(status, body, etag if status == 200 else None)
+
+    def log_request(self, code='-', size='-'):
+        # Pollers would flood the console; log_error still prints through log_message
+        pass
+
+
+def serve(comparison, host='127.0.0.1', port=DEFAULT_PORT, interval=DEFAULT_INTERVAL, use_stock_view=False,
+          alerts=None):
+    """Start the refresh thread and serve until interrupted"""
+    cache = ResultCache(comparison, interval, use_stock_view, alerts)
+    handler = type('Handler', (StockRequestHandler,), {'cache': cache})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+
+    cache.start()
+    print(f"🌐 Serving stock health on http://{host}:{port} (refresh every {interval}s)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n👋 Stopping server")
+    finally:
+        cache.stop()
+        server.server_close()
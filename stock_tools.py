@@ -0,0 +1,605 @@
+"""
+Stock Tools - Unified Command Line
+==================================
+One entry point for the stock comparison and fix tools:
+
+    python stock_tools.py compare --export report.json [--fix [--live]]
+    python stock_tools.py check PROD-00001
+    python stock_tools.py fix --fix-all [--live]
+    python stock_tools.py report show report.json
+    python stock_tools.py report diff before.ndjson after.ndjson
+    python stock_tools.py history drifters --days 7 --min-count 3
+    python stock_tools.py serve --port 8080 --interval 300
+    python stock_tools.py worker --run-id nightly-2026-10-19 --fix --live --yes
+
+Every command in a run shares one MongoClient (pinged once) and one HTTP
+session. pymongo, requests and tabulate are only imported by the commands
+that need them, so --help and report commands start instantly. Use
+--timings to print how long startup, connecting and the command took,
+and --profile / --trace-memory (see profiling.py) to profile the run.
+"""
+
+import time
+
+_STARTED = time.perf_counter()
+
+import sys
+import os
+import json
+from contextlib import contextmanager
+
+from compare_stock import (
+    MONGODB_URI, DATABASE_NAME, API_BASE_URL,
+    add_compare_arguments, add_cassette_arguments, parse_projection_times
+)
+from fix_stock_mismatches import add_fix_arguments
+from db_connection import ConnectionOptions, add_connection_arguments, confirm_mode, HISTORY_DB, HISTORY_RETENTION_DAYS
+from profiling import profile_run, add_profiling_arguments, phase as profiling_phase
+from stock_alerts import add_alert_arguments
+from work_leases import DEFAULT_CHUNK_SIZE, DEFAULT_LEASE_SECONDS
+
+
+class RunContext:
+    def __init__(self, args):
+        """Hold the connections shared by every step of one run"""
+        self.args = args
+        self.timings = [('startup', time.perf_counter() - _STARTED)]
+        self.options = ConnectionOptions.from_args(args)
+        self._client = None
+        self._session = None
+        self.cassette = None
+
+    @contextmanager
+    def phase(self, name):
+        """Record how long a phase of the run takes"""
+        started = time.perf_counter()
+        try:
+            with profiling_phase(name):
+                yield
+        finally:
+            self.timings.append((name, time.perf_counter() - started))
+
+    @property
+    def client(self):
+        """MongoClient, created and pinged on first use"""
+        if self._client is None:
+            with self.phase('connect'):
+                try:
+                    self._client = self.options.client(self.args.mongodb_uri)
+                    self._client.server_info()
+                except Exception as e:
+                    print(f"❌ Failed to connect to MongoDB: {e}")
+                    sys.exit(1)
+            print(f"✅ Connected to MongoDB: {self.args.db_name}")
+        return self._client
+
+    @property
+    def session(self):
+        """HTTP session (with cassette if requested), created on first use"""
+        if self._session is None:
+            from compare_stock import open_session
+            self._session, self.cassette = open_session(self.args)
+        return self._session
+
+    def comparison(self):
+        from compare_stock import StockComparison
+        return StockComparison(
+            db_name=self.args.db_name,
+            api_url=self.args.api_url,
+            session=self.session,
+            client=self.client,
+            options=self.options
+        )
+
+    def fixer(self, dry_run):
+        from fix_stock_mismatches import StockFixer
+        return StockFixer(
+            db_name=self.args.db_name,
+            dry_run=dry_run,
+            journal_path=getattr(self.args, 'journal', None),
+            client=self.client,
+            options=self.options
+        )
+
+    def close(self):
+        if self.cassette:
+            self.cassette.save()
+        if self._client is not None:
+            self._client.close()
+            print("\n✅ Connection closed")
+        self.options.print_traffic()
+
+    def print_timings(self):
+        print("\n⏱️  Timings:")
+        for name, seconds in self.timings:
+            print(f"   {name:<10} {seconds * 1000:8.1f} ms")
+
+
+def cmd_compare(ctx):
+    """Full comparison, optionally fixing drift in the same pass"""
+    from compare_stock import run_comparison
+
+    args = ctx.args
+    projection_times = parse_projection_times(args.parser, args)
+
+    dry_run = not args.live
+    if args.fix and not confirm_mode(dry_run, args.yes):
+        return
+
+    comparison = ctx.comparison()
+    fixer = ctx.fixer(dry_run) if args.fix else None
+    try:
+        repair = None
+        if fixer is not None:
+            from reconcile import RepairPlanner
+            repair = RepairPlanner(fixer)
+
+        # With --fix the repairs are planned during the comparison pass and
+        # written right after it, without reading the catalog again
+        with ctx.phase('compare'):
+            run_comparison(comparison, args, projection_times, repair=repair)
+    finally:
+        if fixer is not None:
+            fixer.close()
+        comparison.close()
+
+
+def cmd_check(ctx):
+    """Detailed check of one product"""
+    comparison = ctx.comparison()
+    try:
+        with ctx.phase('check'):
+            comparison.check_specific_product(ctx.args.product_id)
+    finally:
+        comparison.close()
+
+
+def cmd_fix(ctx):
+    """Run the selected fixes"""
+    from fix_stock_mismatches import run_fixes
+
+    dry_run = not ctx.args.live
+    if not confirm_mode(dry_run, ctx.args.yes):
+        return
+
+    fixer = ctx.fixer(dry_run)
+    try:
+        with ctx.phase('fix'):
+            run_fixes(fixer, ctx.args)
+    finally:
+        fixer.close()
+
+
+def cmd_report_show(ctx):
+    """Summarize an exported comparison report (no database needed)"""
+    from report_diff import load_report
+
+    try:
+        data = load_report(ctx.args.report)
+    except FileNotFoundError:
+        print(f"❌ Report file not found: {ctx.args.report}")
+        return
+    except json.JSONDecodeError:
+        print("❌ Invalid JSON in report file")
+        return
+
+    from tabulate import tabulate
+
+    summary = data.get('summary', {})
+    mismatches = data.get('mismatches', [])
+
+    print(f"\n📂 Report: {ctx.args.report}")
+    print(f"   Generated at: {data.get('generated_at', 'unknown')}")
+    print(f"   Mismatches: {summary.get('total_mismatches', len(mismatches))}")
+    print(f"   Matches: {summary.get('total_matches', len(data.get('matches', [])))}")
+    print(f"   Missing from API: {summary.get('total_missing_from_api', len(data.get('missing_from_api', [])))}")
+    if summary.get('api_complete') is False:
+        print("   ⚠️  Customer API listing was incomplete for this run")
+
+    by_type = {}
+    for item in mismatches:
+        for kind in item.get('mismatch_type', 'none').split(', '):
+            by_type[kind] = by_type.get(kind, 0) + 1
+    if by_type:
+        print("\n   By mismatch type:")
+        for kind, count in sorted(by_type.items(), key=lambda entry: -entry[1]):
+            print(f"   - {kind}: {count}")
+
+    worst = sorted(mismatches, key=lambda item: -abs(item.get('cloud_stock', 0) - item.get('batch_stock', 0)))
+    if worst:
+        table_data = [
+            [item['product_name'][:30], item['sku'], item['cloud_stock'], item.get('api_stock'),
+             item['batch_stock'], item['mismatch_type']]
+            for item in worst[:ctx.args.top]
+        ]
+        headers = ['Product Name', 'SKU', 'Cloud Stock', 'API Stock', 'Batch Stock', 'Mismatch Type']
+        print(f"\n   Largest cloud vs batch deltas (top {ctx.args.top}):")
+        print(tabulate(table_data, headers=headers, tablefmt='grid'))
+
+
+def cmd_report_diff(ctx):
+    """New, resolved and persistent mismatches between two reports (no database needed)"""
+    from report_diff import diff_reports, summarize_diff, ReportOrderError
+
+    args = ctx.args
+    try:
+        counts, samples = summarize_diff(diff_reports(args.before, args.after), args.top, args.output)
+    except FileNotFoundError as e:
+        print(f"❌ Report file not found: {e.filename}")
+        return
+    except ReportOrderError as e:
+        print(f"❌ {e}")
+        return
+    except json.JSONDecodeError:
+        print("❌ Invalid JSON in report file")
+        return
+
+    from tabulate import tabulate
+
+    print(f"\n🔀 {args.before} -> {args.after}")
+    print(f"   New mismatches: {counts['new']}")
+    print(f"   Resolved: {counts['resolved']}")
+    print(f"   Persistent: {counts['persistent']} ({counts['stock_changed']} with changed stock values)")
+
+    if samples['new']:
+        print(f"\n   🆕 New (first {args.top}):")
+        table_data = [[item['product_id'], item['sku'], item['now'], item['after']['cloud_stock'],
+                       item['after']['api_stock'], item['after']['batch_stock']] for item in samples['new']]
+        print(tabulate(table_data, headers=['Product ID', 'SKU', 'Mismatch Type', 'Cloud Stock', 'API Stock', 'Batch Stock'],
+                       tablefmt='grid'))
+
+    if samples['resolved']:
+        print(f"\n   ✅ Resolved (first {args.top}):")
+        table_data = [[item['product_id'], item['sku'], item['was']] for item in samples['resolved']]
+        print(tabulate(table_data, headers=['Product ID', 'SKU', 'Was'], tablefmt='grid'))
+
+    if samples['persistent']:
+        print(f"\n   🔁 Persistent with changed stock (first {args.top}):")
+        table_data = [
+            [item['product_id'], item['sku'], item['now'],
+             f"{item['before']['cloud_stock']} -> {item['after']['cloud_stock']}",
+             f"{item['before']['api_stock']} -> {item['after']['api_stock']}",
+             f"{item['before']['batch_stock']} -> {item['after']['batch_stock']}"]
+            for item in samples['persistent']
+        ]
+        print(tabulate(table_data, headers=['Product ID', 'SKU', 'Mismatch Type', 'Cloud Stock', 'API Stock', 'Batch Stock'],
+                       tablefmt='grid'))
+
+    if args.output:
+        print(f"\n💾 Full diff written to: {args.output}")
+
+
+def cmd_serve(ctx):
+    """Serve the latest comparison result over HTTP, refreshed in the background"""
+    from stock_server import serve
+    from stock_alerts import alerts_from_args
+
+    args = ctx.args
+    comparison = ctx.comparison()
+    try:
+        serve(comparison, args.host, args.port, args.interval, args.use_stock_view, alerts_from_args(args))
+    finally:
+        comparison.close()
+
+
+def cmd_worker(ctx):
+    """Process chunks of a sharded run (see work_leases.py), or show its progress"""
+    from pymongo import ReadPreference
+    from work_leases import WorkQueue, ApiSnapshot, run_worker
+
+    args = ctx.args
+    db = ctx.client.get_database(args.db_name, read_preference=ReadPreference.PRIMARY)
+    queue = WorkQueue(db, args.run_id, args.worker_id, args.lease_seconds)
+
+    if args.status:
+        show_work_status(queue)
+        return
+
+    dry_run = not args.live
+    if args.fix and not confirm_mode(dry_run, args.yes):
+        return
+
+    comparison = ctx.comparison() if args.with_api else None
+    fixer = ctx.fixer(dry_run) if args.fix else None
+    try:
+        with ctx.phase('plan'):
+            queue.plan(db.products, args.chunk_size)
+
+        api_source = None
+        if comparison is not None:
+            api_source = ApiSnapshot(comparison.build_engine().api_source)
+
+        # Repairs read the primary; a compare-only worker honours --read-preference
+        source_db = fixer.db if fixer is not None else ctx.options.read_database(ctx.client, args.db_name)
+        with ctx.phase('work'):
+            run_worker(queue, source_db.products, source_db.batches, api_source, fixer, ctx.options.batch_size,
+                       args.max_chunks, wait=not args.no_wait)
+    finally:
+        if fixer is not None:
+            fixer.close()
+        if comparison is not None:
+            comparison.close()
+
+    show_work_status(queue)
+
+
+def show_work_status(queue):
+    """Print the chunk states, summed results and active leases of a run"""
+    from tabulate import tabulate
+
+    run, counts, totals, leases = queue.status()
+    if run is None:
+        print(f"📭 No run {queue.run_id}")
+        return
+
+    print(f"\n🧩 Run {queue.run_id}: {run['state']}, {run.get('chunk_count', 0)} chunks")
+    print("   " + ', '.join(f"{state} {count}" for state, count in counts.items()))
+    if totals:
+        print("   " + ', '.join(f"{name} {value}" for name, value in totals.items()))
+    if leases:
+        table_data = [
+            [index, owner, attempts, expires.isoformat()[:19], state]
+            for index, owner, attempts, expires, state in leases
+        ]
+        print(tabulate(table_data, headers=['Chunk', 'Owner', 'Attempts', 'Lease Expires (UTC)', 'State'],
+                       tablefmt='grid'))
+
+
+def open_history(ctx):
+    """Open the history store named by --history-db"""
+    from history_store import HistoryStore
+    return HistoryStore(ctx.args.history_db, retention_days=ctx.args.retention_days)
+
+
+def cmd_history_runs(ctx):
+    """List the most recent recorded runs"""
+    from tabulate import tabulate
+
+    store = open_history(ctx)
+    try:
+        rows = store.recent_runs(ctx.args.limit)
+    finally:
+        store.close()
+
+    if not rows:
+        print(f"📭 No runs recorded in {ctx.args.history_db}")
+        return
+    table_data = [
+        [run_id, run_at[:19], source, checked, mismatches, missing,
+         {None: '-', 1: 'yes', 0: 'no'}[api_complete]]
+        for run_id, run_at, source, checked, mismatches, missing, api_complete in rows
+    ]
+    headers = ['Run', 'Run At (UTC)', 'Source', 'Checked', 'Mismatches', 'Missing', 'API Complete']
+    print(tabulate(table_data, headers=headers, tablefmt='grid'))
+
+
+def cmd_history_drifters(ctx):
+    """Products that mismatched in many runs recently"""
+    from datetime import datetime, timedelta
+    from tabulate import tabulate
+
+    args = ctx.args
+    since = datetime.utcnow() - timedelta(days=args.days)
+    store = open_history(ctx)
+    try:
+        rows = store.frequent_drifters(since, args.min_count, args.type, args.limit)
+    finally:
+        store.close()
+
+    print(f"\n📈 Products mismatched in at least {args.min_count} runs in the last {args.days} days"
+          + (f" ({args.type})" if args.type else ""))
+    if not rows:
+        print("   None")
+        return
+    table_data = [
+        [product_id, sku, (name or '')[:30], runs, first[:19], last[:19], kinds]
+        for product_id, sku, name, runs, first, last, kinds in rows
+    ]
+    headers = ['Product ID', 'SKU', 'Product Name', 'Runs', 'First (UTC)', 'Last (UTC)', 'Mismatch Types']
+    print(tabulate(table_data, headers=headers, tablefmt='grid'))
+
+
+def cmd_history_product(ctx):
+    """Mismatch history of one product"""
+    from tabulate import tabulate
+
+    store = open_history(ctx)
+    try:
+        rows = store.product_history(ctx.args.product_id)
+    finally:
+        store.close()
+
+    if not rows:
+        print(f"✅ {ctx.args.product_id} has no recorded mismatches")
+        return
+    print(f"\n🔎 {ctx.args.product_id} first mismatched at {rows[0][0][:19]} UTC ({rows[0][1]})")
+    print(f"   Last mismatch: {rows[-1][0][:19]} UTC, {len(set(row[0] for row in rows))} runs in total")
+    headers = ['Run At (UTC)', 'Mismatch Type', 'Cloud Stock', 'Total Stock', 'API Stock', 'Batch Stock']
+    print(tabulate([[row[0][:19]] + list(row[1:]) for row in rows[-ctx.args.limit:]], headers=headers, tablefmt='grid'))
+
+
+def cmd_history_types(ctx):
+    """Mismatch rows per day and type"""
+    from datetime import datetime, timedelta
+    from tabulate import tabulate
+
+    since = datetime.utcnow() - timedelta(days=ctx.args.days)
+    store = open_history(ctx)
+    try:
+        rows = store.type_counts(since)
+    finally:
+        store.close()
+
+    print(f"\n📊 Mismatches per day and type in the last {ctx.args.days} days")
+    if not rows:
+        print("   None")
+        return
+    days = sorted({day for day, _kind, _count in rows})
+    kinds = sorted({kind for _day, kind, _count in rows})
+    counts = {(day, kind): count for day, kind, count in rows}
+    table_data = [[day] + [counts.get((day, kind), 0) for kind in kinds] for day in days]
+    print(tabulate(table_data, headers=['Day (UTC)'] + kinds, tablefmt='grid'))
+
+
+def cmd_history_import(ctx):
+    """Backfill the store from exported JSON reports"""
+    store = open_history(ctx)
+    try:
+        for report_file in ctx.args.reports:
+            try:
+                run_id = store.import_report(report_file)
+            except (OSError, ValueError) as e:
+                print(f"❌ Could not import {report_file}: {e}")
+                continue
+            print(f"🗃️  {report_file} -> run {run_id}")
+    finally:
+        store.close()
+
+
+def cmd_history_prune(ctx):
+    """Apply the retention period and compact the store"""
+    store = open_history(ctx)
+    try:
+        size_before = os.path.getsize(ctx.args.history_db)
+        removed = store.prune(ctx.args.retention_days)
+        print(f"🗑️  Removed {removed} runs older than {ctx.args.retention_days} days")
+        if ctx.args.compact:
+            store.compact()
+            size_after = os.path.getsize(ctx.args.history_db)
+            print(f"🗜️  Compacted: {size_before / 1024:,.0f} KiB -> {size_after / 1024:,.0f} KiB")
+    finally:
+        store.close()
+
+
+def build_parser():
+    """Build the argument parser with all subcommands"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description='PANNRamyeonCorner stock comparison and fix tools')
+    parser.add_argument('--mongodb-uri', default=MONGODB_URI, help='MongoDB connection URI')
+    parser.add_argument('--db-name', default=DATABASE_NAME, help='Database name')
+    parser.add_argument('--api-url', default=API_BASE_URL, help='API base URL')
+    parser.add_argument('--timings', action='store_true', help='Print startup, connect and command timings')
+    add_connection_arguments(parser)
+    add_profiling_arguments(parser)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    compare = commands.add_parser('compare', help='Compare stock across database, batches and customer API')
+    add_compare_arguments(compare)
+    add_cassette_arguments(compare)
+    compare.add_argument('--fix', action='store_true', help='Fix batch, stock/total_stock and status drift found in the same pass')
+    compare.add_argument('--live', action='store_true', help='With --fix: execute fixes (default is dry-run)')
+    compare.add_argument('--journal', type=str, help='With --fix: undo journal file for live fixes')
+    compare.add_argument('--yes', action='store_true', help='Skip the live-mode confirmation prompt (for cron)')
+    compare.set_defaults(handler=cmd_compare)
+
+    check = commands.add_parser('check', help='Check one product in detail')
+    check.add_argument('product_id', help='Product ID, e.g. PROD-00001')
+    add_cassette_arguments(check)
+    check.set_defaults(handler=cmd_check)
+
+    fix = commands.add_parser('fix', help='Fix stock mismatches (dry-run unless --live)')
+    add_fix_arguments(fix)
+    fix.add_argument('--yes', action='store_true', help='Skip the live-mode confirmation prompt (for cron)')
+    fix.set_defaults(handler=cmd_fix)
+
+    report = commands.add_parser('report', help='Work with exported comparison reports')
+    report_commands = report.add_subparsers(dest='report_command', required=True)
+    show = report_commands.add_parser('show', help='Summarize an exported report')
+    show.add_argument('report', help='Report JSON file')
+    show.add_argument('--top', type=int, default=10, help='Number of largest mismatches to list')
+    show.set_defaults(handler=cmd_report_show)
+    diff = report_commands.add_parser('diff', help='New, resolved and persistent mismatches between two reports')
+    diff.add_argument('before', help='Earlier report (JSON or NDJSON)')
+    diff.add_argument('after', help='Later report (JSON or NDJSON)')
+    diff.add_argument('--top', type=int, default=10, help='Number of products to list per change kind')
+    diff.add_argument('--output', type=str, help='Write every change as NDJSON to this file')
+    diff.set_defaults(handler=cmd_report_diff)
+
+    serve = commands.add_parser('serve', help='Read-only HTTP service with cached comparison results')
+    serve.add_argument('--host', default='127.0.0.1', help='Address to listen on (default 127.0.0.1)')
+    serve.add_argument('--port', type=int, default=8080, help='Port to listen on (default 8080)')
+    serve.add_argument('--interval', type=int, default=300, help='Seconds between background refreshes (default 300)')
+    serve.add_argument('--use-stock-view', action='store_true',
+                       help='Read batch stock from the incrementally maintained product_stock_view')
+    add_alert_arguments(serve)
+    add_cassette_arguments(serve)
+    serve.set_defaults(handler=cmd_serve)
+
+    worker = commands.add_parser('worker', help='Process chunks of a run shared by several workers')
+    worker.add_argument('--run-id', required=True, help='Run name shared by every worker of the run')
+    worker.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help=f'Products per chunk when the run is planned (default {DEFAULT_CHUNK_SIZE})')
+    worker.add_argument('--lease-seconds', type=int, default=DEFAULT_LEASE_SECONDS,
+                        help=f'Chunk lease length; chunks of a crashed worker are reclaimed after it (default {DEFAULT_LEASE_SECONDS})')
+    worker.add_argument('--worker-id', type=str, help='Name shown as chunk owner (default host:pid)')
+    worker.add_argument('--with-api', action='store_true', help='Also compare with the customer API (listing fetched once per worker)')
+    worker.add_argument('--fix', action='store_true', help='Repair batch, stock/total_stock and status drift in each chunk')
+    worker.add_argument('--live', action='store_true', help='With --fix: execute fixes (default is dry-run)')
+    worker.add_argument('--journal', type=str, help='With --fix: undo journal file for live fixes')
+    worker.add_argument('--yes', action='store_true', help='Skip the live-mode confirmation prompt (for cron)')
+    worker.add_argument('--max-chunks', type=int, help='Stop after this many chunks')
+    worker.add_argument('--no-wait', action='store_true',
+                        help="Exit when nothing is claimable instead of waiting to take over other workers' chunks")
+    worker.add_argument('--status', action='store_true', help="Show the run's progress and exit")
+    add_cassette_arguments(worker)
+    worker.set_defaults(handler=cmd_worker)
+
+    history = commands.add_parser('history', help='Query the run history recorded with --history-db')
+    history.add_argument('--history-db', default=HISTORY_DB, help=f'History store file (default {HISTORY_DB})')
+    history.add_argument('--retention-days', type=int, default=HISTORY_RETENTION_DAYS,
+                         help=f'Keep runs for this many days (default {HISTORY_RETENTION_DAYS})')
+    history_commands = history.add_subparsers(dest='history_command', required=True)
+
+    runs = history_commands.add_parser('runs', help='List recent runs')
+    runs.add_argument('--limit', type=int, default=20, help='Number of runs to list')
+    runs.set_defaults(handler=cmd_history_runs)
+
+    drifters = history_commands.add_parser('drifters', help='Products that mismatched in many runs')
+    drifters.add_argument('--days', type=int, default=7, help='Look back this many days')
+    drifters.add_argument('--min-count', type=int, default=3, help='Minimum number of runs with a mismatch')
+    drifters.add_argument('--type', type=str, help='Only this mismatch type, e.g. cloud_vs_batch')
+    drifters.add_argument('--limit', type=int, default=50, help='Number of products to list')
+    drifters.set_defaults(handler=cmd_history_drifters)
+
+    product = history_commands.add_parser('product', help='Mismatch history of one product')
+    product.add_argument('product_id', help='Product ID or SKU')
+    product.add_argument('--limit', type=int, default=20, help='Number of most recent rows to list')
+    product.set_defaults(handler=cmd_history_product)
+
+    types = history_commands.add_parser('types', help='Mismatches per day and type')
+    types.add_argument('--days', type=int, default=30, help='Look back this many days')
+    types.set_defaults(handler=cmd_history_types)
+
+    history_import = history_commands.add_parser('import', help='Backfill from exported JSON reports')
+    history_import.add_argument('reports', nargs='+', help='Report JSON files')
+    history_import.set_defaults(handler=cmd_history_import)
+
+    prune = history_commands.add_parser('prune', help='Delete runs past the retention period')
+    prune.add_argument('--compact', action='store_true', help='VACUUM the store afterwards to reclaim space')
+    prune.set_defaults(handler=cmd_history_prune)
+
+    return parser
+
+
+def main():
+    """Main entry point"""
+    parser = build_parser()
+    args = parser.parse_args()
+    args.parser = parser
+
+    if getattr(args, 'record', False) and not args.cassette:
+        parser.error('--record requires --cassette')
+
+    with profile_run(args):
+        ctx = RunContext(args)
+        try:
+            args.handler(ctx)
+        finally:
+            ctx.close()
+            if args.timings:
+                ctx.print_timings()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,256 @@
+"""
+Materialized Product Stock View
+===============================
+Maintains a `product_stock_view` collection holding, per product:
+
+- batch_stock: sellable stock from active, non-expired batches
+- active_batches / expired_batches: same counts as calculate_batch_stock()
+- next_expiry: when the next batch drops out of batch_stock
+
+The view is kept up to date incrementally instead of re-aggregating all
+batches on every comparison:
+
+1. Batches with updated_at newer than the stored watermark are recounted
+2. Products whose next_expiry has passed are recounted
+3. Optionally, a change stream on batches applies changes as they happen
+
+The indexes these queries need are created by this script (run it once
+with --rebuild), never by the tools that read the view. Deleted batches
+and batches without updated_at are only picked up by a change stream or a
+--rebuild. A rebuild upserts every row in place and
+then drops rows of products that no longer have batches, so readers never
+see an empty view.
+"""
+
+import sys
+import os
+import time
+from datetime import datetime
+
+from batch_utils import EMPTY_BATCH_INFO
+from stock_projection import build_timelines
+
+# Configuration
+MONGODB_URI = os.getenv('MONGODB_URI', 'mongodb://localhost:27017/')
+DATABASE_NAME = os.getenv('DATABASE_NAME', 'pos_system')
+
+VIEW_COLLECTION = 'product_stock_view'
+STATE_COLLECTION = 'product_stock_view_state'
+STATE_ID = 'watermark'
+
+
+class StockView:
+    def __init__(self, db):
+        """Wrap the view and state collections of a database
+
+        Always on the primary, even if ``db`` reads from secondaries: a
+        refresh writes the view and must read back what it wrote.
+        """
+        from pymongo import ReadPreference
+
+        self.db = db.with_options(read_preference=ReadPreference.PRIMARY)
+        self.batches_collection = self.db.batches
+        self.view_collection = self.db[VIEW_COLLECTION]
+        self.state_collection = self.db[STATE_COLLECTION]
+        self.rows = {}
+
+    def ensure_indexes(self):
+        """Index the watermark query and the expiry scan (maintenance command only)"""
+        # Serves the latest-updated_at lookup and covers the changed-product distinct
+        self.batches_collection.create_index([('updated_at', 1), ('product_id', 1)])
+        self.view_collection.create_index('next_expiry')
+
+    def _latest_batch_update(self):
+        """Highest updated_at currently stored on any batch"""
+        latest = self.batches_collection.find_one(
+            {'updated_at': {'$ne': None}},
+            {'updated_at': 1},
+            sort=[('updated_at', -1)]
+        )
+        return latest['updated_at'] if latest else None
+
+    def _recount(self, product_ids=None, now=None):
+        """Recompute view rows for some products (all when None)"""
+        from pymongo import ReplaceOne
+
+        now = now or datetime.utcnow()
+        timelines = build_timelines(self.batches_collection, product_ids)
+        targets = timelines.keys() if product_ids is None else product_ids
+
+        operations = []
+        for product_id in targets:
+            timeline = timelines.get(product_id)
+            if timeline:
+                info = timeline.batch_info(now)
+                upcoming = timeline.next_drops(now, 1)
+                next_expiry = upcoming[0]['expires_at'] if upcoming else None
+            else:
+                info = EMPTY_BATCH_INFO
+                next_expiry = None
+
+            operations.append(ReplaceOne({'_id': product_id}, {
+                '_id': product_id,
+                'batch_stock': info['total_stock'],
+                'active_batches': info['active_batches'],
+                'expired_batches': info['expired_batches'],
+                'next_expiry': next_expiry,
+                'refreshed_at': now
+            }, upsert=True))
+
+        for start in range(0, len(operations), 1000):
+            self.view_collection.bulk_write(operations[start:start + 1000], ordered=False)
+
+        return len(operations)
+
+    def rebuild(self):
+        """Recompute the whole view in place"""
+        # Take the watermark first so writes during the rebuild are re-read
+        watermark = self._latest_batch_update()
+        started = datetime.utcnow()
+        # BSON dates keep milliseconds; compare against what gets stored
+        started = started.replace(microsecond=started.microsecond // 1000 * 1000)
+        count = self._recount(now=started)
+        # Rows not rewritten by this rebuild (or a concurrent recount) belong
+        # to products without batches any more
+        self.view_collection.delete_many({'refreshed_at': {'$lt': started}})
+        self._save_watermark(watermark)
+        print(f"🔄 Rebuilt {VIEW_COLLECTION}: {count} products")
+        return count
+
+    def _save_watermark(self, watermark):
+        self.state_collection.replace_one(
+            {'_id': STATE_ID},
+            {'_id': STATE_ID, 'batches_updated_at': watermark, 'refreshed_at': datetime.utcnow()},
+            upsert=True
+        )
+
+    def refresh(self):
+        """Apply batch changes since the watermark and due expiries"""
+        state = self.state_collection.find_one({'_id': STATE_ID})
+        if not state:
+            return self.rebuild()
+
+        watermark = state.get('batches_updated_at')
+        new_watermark = self._latest_batch_update()
+
+        changed = set()
+        if new_watermark is not None:
+            # $gte: writes sharing the watermark timestamp may have landed
+            # after the last refresh; recounting them again is harmless
+            query = {'updated_at': {'$gte': watermark}} if watermark is not None else {}
+            changed.update(self.batches_collection.distinct('product_id', query))
+
+        expired = self.view_collection.distinct('_id', {'next_expiry': {'$lte': datetime.utcnow()}})
+        changed.update(expired)
+        changed.discard(None)
+
+        count = self._recount(list(changed)) if changed else 0
+        self._save_watermark(new_watermark if new_watermark is not None else watermark)
+        print(f"🔄 Refreshed {VIEW_COLLECTION}: {count} products recounted ({len(expired)} due to expiry)")
+        return count
+
+    def load(self, refresh=True):
+        """Refresh (optionally) and load every row into memory for O(1) lookups"""
+        if refresh:
+            self.refresh()
+        self.rows = {row['_id']: row for row in self.view_collection.find({})}
+        return self.rows
+
+    def batch_info(self, product_id):
+        """Same shape as calculate_batch_stock(), read from the loaded view"""
+        row = self.rows.get(product_id)
+        if not row:
+            return dict(EMPTY_BATCH_INFO)
+        return {
+            'total_stock': row['batch_stock'],
+            'active_batches': row['active_batches'],
+            'expired_batches': row['expired_batches']
+        }
+
+    def watch(self, idle_seconds=60):
+        """Follow a change stream on batches and recount products as they change
+
+        Needs a replica set (Atlas always is). Delete events carry only the
+        batch _id, so the product of every batch is kept in memory (loaded
+        once, updated from the stream) to recount just that product.
+        """
+        print("👀 Watching batches for changes (Ctrl+C to stop)...")
+        pipeline = [{'$match': {'operationType': {'$in': ['insert', 'update', 'replace', 'delete']}}}]
+
+        with self.batches_collection.watch(pipeline, full_document='updateLookup') as stream:
+            # Loaded after the stream opened, so no batch falls in between
+            batch_products = {
+                batch['_id']: batch.get('product_id')
+                for batch in self.batches_collection.find({}, {'product_id': 1})
+            }
+            last_expiry_check = time.monotonic()
+            while stream.alive:
+                change = stream.try_next()
+                if change is None:
+                    if time.monotonic() - last_expiry_check >= idle_seconds:
+                        self.refresh()
+                        last_expiry_check = time.monotonic()
+                    time.sleep(1)
+                    continue
+
+                batch_id = change['documentKey']['_id']
+                if change['operationType'] == 'delete':
+                    product_id = batch_products.pop(batch_id, None)
+                else:
+                    # fullDocument is None if the batch was deleted since
+                    document = change.get('fullDocument') or {}
+                    product_id = document.get('product_id', batch_products.get(batch_id))
+                    previous = batch_products.get(batch_id)
+                    batch_products[batch_id] = product_id
+                    if previous is not None and previous != product_id:
+                        # Batch moved to another product: recount both
+                        self._recount([previous])
+
+                if product_id is not None:
+                    self._recount([product_id])
+                    self._save_watermark(self._latest_batch_update())
+
+
+def main():
+    """Main entry point"""
+    import argparse
+    from pymongo import MongoClient
+
+    parser = argparse.ArgumentParser(description='Maintain the materialized product_stock_view collection')
+    parser.add_argument('--mongodb-uri', default=MONGODB_URI, help='MongoDB connection URI')
+    parser.add_argument('--db-name', default=DATABASE_NAME, help='Database name')
+    parser.add_argument('--rebuild', action='store_true', help='Recompute the whole view from batches')
+    parser.add_argument('--watch', action='store_true', help='Keep the view updated from a batches change stream')
+
+    args = parser.parse_args()
+
+    try:
+        client = MongoClient(args.mongodb_uri, serverSelectionTimeoutMS=5000)
+        client.server_info()
+        print(f"✅ Connected to MongoDB: {args.db_name}")
+    except Exception as e:
+        print(f"❌ Failed to connect to MongoDB: {e}")
+        sys.exit(1)
+
+    view = StockView(client[args.db_name])
+
+    try:
+        # Only this maintenance command changes indexes; the comparison and
+        # the fixer just read (and refresh) the view
+        view.ensure_indexes()
+        if args.rebuild:
+            view.rebuild()
+        else:
+            view.refresh()
+
+        if args.watch:
+            view.watch()
+    except KeyboardInterrupt:
+        print("\nStopped.")
+    finally:
+        client.close()
+        print("\n✅ Connection closed")
+
+
+if __name__ == '__main__':
+    main()
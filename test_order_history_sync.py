@@ -7,11 +7,22 @@ import requests
 import json
 from datetime import datetime
 
+from api_client import RequestController
+from profiling import profiled, profile_run, add_profiling_arguments
+
 # Configuration
 import os
 API_BASE_URL = os.getenv("API_BASE_URL", "https://pann-pos.onrender.com/api/v1")
 CUSTOMER_EMAIL = os.getenv("CUSTOMER_EMAIL", "customer@gmail.com")
 CUSTOMER_PASSWORD = os.getenv("CUSTOMER_PASSWORD")  # Set via environment variable
+HTTP_CASSETTE = os.getenv("HTTP_CASSETTE")  # Optional cassette file for offline runs
+HTTP_CASSETTE_MODE = os.getenv("HTTP_CASSETTE_MODE", "replay")  # "record" or "replay"
+
+# Shared HTTP session (a cassette can be mounted on it for record/replay)
+session = requests.Session()
+
+# Retries with backoff while the Render backend cold-starts or throttles
+api = RequestController(session, max_concurrency=1)
 
 # Test Results
 results = {
@@ -47,14 +58,17 @@ def print_warning(message):
     results["warnings"].append(message)
 
 
+@profiled
 def login_customer():
     """Login as customer and get access token."""
     print_header("Test 1: Customer Login")
     
     try:
-        response = requests.post(
+        # Never replayed: a retried login could authenticate twice
+        response = api.post(
             f"{API_BASE_URL}/auth/customer/login/",
             json={"email": CUSTOMER_EMAIL, "password": CUSTOMER_PASSWORD},
+            retry=False,
             timeout=10
         )
         
@@ -77,13 +91,14 @@ def login_customer():
         return None
 
 
+@profiled
 def test_order_history(access_token):
     """Test fetching order history."""
     print_header("Test 2: Fetch Order History")
     
     try:
         headers = {"Authorization": f"Bearer {access_token}"}
-        response = requests.get(
+        response = api.get(
             f"{API_BASE_URL}/online/orders/history/",
             headers=headers,
             timeout=10
@@ -227,6 +242,7 @@ def test_status_info(order):
     return all_present
 
 
+@profiled
 def test_order_status_endpoint(access_token, order_id):
     """Test individual order status endpoint."""
     print_header("Test 7: Individual Order Status Endpoint")
@@ -237,7 +253,7 @@ def test_order_status_endpoint(access_token, order_id):
     
     try:
         headers = {"Authorization": f"Bearer {access_token}"}
-        response = requests.get(
+        response = api.get(
             f"{API_BASE_URL}/online/orders/{order_id}/status/",
             headers=headers,
             timeout=10
@@ -304,6 +320,18 @@ def print_summary():
 
 def main():
     """Run all tests."""
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='Order history synchronization test (configured via environment variables)')
+    add_profiling_arguments(parser)
+    args = parser.parse_args()
+    
+    with profile_run(args):
+        run_suite()
+
+
+def run_suite():
+    """Print the banner, run the tests and the summary."""
     print("\n")
     print("╔════════════════════════════════════════════════════════════╗")
     print("║     Order History Database Synchronization Test Suite     ║")
@@ -313,18 +341,36 @@ def main():
     print(f"Customer Email: {CUSTOMER_EMAIL}")
     print(f"Test Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     
-    if not CUSTOMER_PASSWORD:
+    cassette = None
+    if HTTP_CASSETTE:
+        from http_cassette import use_cassette
+        cassette = use_cassette(session, HTTP_CASSETTE, HTTP_CASSETTE_MODE)
+        print(f"Cassette: {HTTP_CASSETTE} ({HTTP_CASSETTE_MODE})")
+    
+    # Replayed runs never send the password anywhere, so it is not required
+    replaying = cassette is not None and cassette.mode == "replay"
+    if not CUSTOMER_PASSWORD and not replaying:
         print("\n❌ ERROR: CUSTOMER_PASSWORD environment variable is not set")
         print("   Set it using: export CUSTOMER_PASSWORD='your_password'")
         print_summary()
         return
     
-    # Run tests
+    try:
+        run_tests()
+    finally:
+        if cassette:
+            cassette.save()
+    
+    print_summary()
+
+
+@profiled
+def run_tests():
+    """Run the test sequence against the API (live or cassette)."""
     access_token = login_customer()
     
     if not access_token:
         print("\n❌ Cannot proceed without access token")
-        print_summary()
         return
     
     order = test_order_history(access_token)
@@ -340,8 +386,6 @@ def main():
             test_order_status_endpoint(access_token, order_id)
     else:
         print_warning("Cannot run further tests without an order")
-    
-    print_summary()
 
 
 if __name__ == "__main__":
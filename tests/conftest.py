@@ -0,0 +1,90 @@
+"""Shared fixtures for the stock tool tests"""
+
+import os
+import sys
+import json
+
+import pytest
+import requests
+from requests.adapters import BaseAdapter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+TEST_MONGODB_URI = os.getenv('TEST_MONGODB_URI', 'mongodb://localhost:27017/')
+
+
+class FakeBackend(BaseAdapter):
+    """Customer API stand-in: serves ``products`` page by page
+
+    ``page_cap`` silently caps the page size while echoing the requested
+    limit back, like a backend with a hard maximum it doesn't report.
+    """
+
+    def __init__(self, products, page_cap=None, echo_limit=True, report_total=True):
+        super().__init__()
+        self.products = products
+        self.page_cap = page_cap
+        self.echo_limit = echo_limit
+        self.report_total = report_total
+        self.requests = []
+
+    def send(self, request, **kwargs):
+        from urllib.parse import urlsplit, parse_qs
+
+        self.requests.append((request.method, request.url))
+        url = urlsplit(request.url)
+        query = parse_qs(url.query)
+        requested = int(query.get('limit', ['100'])[0])
+        page = int(query.get('page', ['1'])[0])
+        limit = min(requested, self.page_cap) if self.page_cap else requested
+
+        items = self.products[(page - 1) * limit:page * limit]
+        pagination = {'page': page, 'has_next': page * limit < len(self.products)}
+        if self.report_total:
+            pagination['total'] = len(self.products)
+        if self.echo_limit:
+            pagination['limit'] = requested
+        body = {'success': True, 'data': {'products': items, 'pagination': pagination}}
+
+        response = requests.Response()
+        response.status_code = 200
+        response.reason = 'OK'
+        response.headers['Content-Type'] = 'application/json'
+        response._content = json.dumps(body).encode('utf-8')
+        response.encoding = 'utf-8'
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+def fake_session(backend):
+    session = requests.Session()
+    session.mount('http://', backend)
+    session.mount('https://', backend)
+    return session
+
+
+@pytest.fixture
+def catalog():
+    return [{'_id': f"PROD-{i:05d}", 'product_name': f"Product {i}", 'stock': i % 7} for i in range(57)]
+
+
+@pytest.fixture
+def mongo_db():
+    """Scratch database on a local mongod (TEST_MONGODB_URI); skipped without one"""
+    from pymongo import MongoClient
+
+    client = MongoClient(TEST_MONGODB_URI, serverSelectionTimeoutMS=1000)
+    try:
+        client.server_info()
+    except Exception:
+        pytest.skip(f"No mongod at {TEST_MONGODB_URI}")
+
+    name = f"stock_tools_test_{os.getpid()}"
+    client.drop_database(name)
+    yield client[name]
+    client.drop_database(name)
+    client.close()
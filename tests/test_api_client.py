@@ -0,0 +1,90 @@
+"""Page size probing of CustomerApiClient against a fake paginated backend"""
+
+import pytest
+
+from conftest import FakeBackend, fake_session
+from api_client import CustomerApiClient
+
+API = 'http://api.test/api'
+
+
+def fetch(backend):
+    client = CustomerApiClient(fake_session(backend), API)
+    return client, client.fetch_products()
+
+
+@pytest.mark.parametrize('report_total', [True, False], ids=['concurrent', 'sequential'])
+def test_capped_backend_echoing_requested_limit(catalog, report_total):
+    # Serves 20 per page but claims to have honoured limit=1000
+    backend = FakeBackend(catalog, page_cap=20, report_total=report_total)
+    client, products = fetch(backend)
+
+    assert client.complete
+    assert [p['_id'] for p in products] == [p['_id'] for p in catalog]
+    assert client.stats['limit'] == 20
+
+
+@pytest.mark.parametrize('report_total', [True, False], ids=['concurrent', 'sequential'])
+def test_capped_backend_without_limit(catalog, report_total):
+    backend = FakeBackend(catalog, page_cap=25, echo_limit=False, report_total=report_total)
+    client, products = fetch(backend)
+
+    assert [p['_id'] for p in products] == [p['_id'] for p in catalog]
+    assert client.stats['limit'] == 25
+
+
+def test_single_page_catalog(catalog):
+    backend = FakeBackend(catalog)
+    client, products = fetch(backend)
+
+    assert len(products) == len(catalog)
+    assert len(backend.requests) == 1
+    # Only the fields the tools use are kept
+    assert set(products[0]) == {'_id', 'stock'}
+
+
+def test_half_open_allows_one_trial():
+    import time
+    from api_client import RequestController, CircuitOpenError
+
+    controller = RequestController(None, reset_timeout=0.0)
+    controller.opened_at = time.monotonic() - 1
+
+    assert controller._acquire() is True
+    controller._release()
+    with pytest.raises(CircuitOpenError):
+        controller._acquire()
+
+    # A request that was in flight before the breaker opened doesn't end the trial
+    controller._record(False)
+    with pytest.raises(CircuitOpenError):
+        controller._acquire()
+
+    controller._record(True, trial=True)
+    assert controller.opened_at is None
+    assert controller._acquire() is False
+    controller._release()
+
+
+def test_post_is_not_retried(catalog):
+    import requests
+    from api_client import RequestController
+
+    class Unavailable(FakeBackend):
+        def send(self, request, **kwargs):
+            self.requests.append((request.method, request.url))
+            response = requests.Response()
+            response.status_code = 503
+            response._content = b'{}'
+            response.request = request
+            return response
+
+    backend = Unavailable(catalog)
+    controller = RequestController(fake_session(backend), base_delay=0.0, failure_threshold=10)
+
+    assert controller.post(f"{API}/auth/customer/login/", json={}).status_code == 503
+    assert len(backend.requests) == 1
+
+    assert controller.get(f"{API}/customer/products/").status_code == 503
+    assert len(backend.requests) == 1 + 1 + controller.max_retries
+    assert controller.stats['retries'] == controller.max_retries
@@ -0,0 +1,45 @@
+"""History archival against a local mongod: duplicates survive, crashes don't duplicate"""
+
+from datetime import datetime, timedelta
+
+from conftest import TEST_MONGODB_URI
+from archive_history import HistoryArchiver, ARCHIVE_MARKER
+
+OLD = datetime(2025, 6, 3, 12, 0)
+SALE = {'used_at': OLD, 'quantity': 2, 'order_id': 'ORD-1'}
+
+
+def archive(mongo_db, tmp_path):
+    archiver = HistoryArchiver(mongodb_uri=TEST_MONGODB_URI, db_name=mongo_db.name, dry_run=False,
+                               checkpoint_file=str(tmp_path / 'checkpoint.json'))
+    try:
+        archiver.run(older_than_days=90, only=['usage_history'], measure=False)
+    finally:
+        archiver.close()
+
+
+def test_identical_entries_are_all_archived(mongo_db, tmp_path):
+    recent = {'used_at': (datetime.utcnow() - timedelta(days=1)).replace(microsecond=0), 'quantity': 5}
+    mongo_db.batches.insert_one({'_id': 'B1', 'product_id': 'P1',
+                                 'usage_history': [dict(SALE), dict(SALE), recent]})
+
+    archive(mongo_db, tmp_path)
+
+    bucket = mongo_db.batches_usage_history_archive.find_one({'_id': 'B1|2025-06'})
+    assert bucket['entries'] == [SALE, SALE]
+    assert mongo_db.batches.find_one({'_id': 'B1'})['usage_history'] == [recent]
+
+
+def test_copy_from_an_interrupted_run_is_not_repeated(mongo_db, tmp_path):
+    # Crashed between copy and removal: marked entry in place, bucket already has it
+    mongo_db.batches.insert_one({'_id': 'B1', 'product_id': 'P1',
+                                 'usage_history': [dict(SALE, **{ARCHIVE_MARKER: 'crashed'})]})
+    mongo_db.batches_usage_history_archive.insert_one({
+        '_id': 'B1|2025-06', 'parent_id': 'B1', 'product_id': 'P1', 'bucket': '2025-06',
+        'entries': [SALE], 'archive_runs': ['crashed']
+    })
+
+    archive(mongo_db, tmp_path)
+
+    assert mongo_db.batches_usage_history_archive.find_one({'_id': 'B1|2025-06'})['entries'] == [SALE]
+    assert mongo_db.batches.find_one({'_id': 'B1'})['usage_history'] == []
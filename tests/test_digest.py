@@ -0,0 +1,125 @@
+"""Merkle range digests: range trees in memory, changed-product detection against a local mongod"""
+
+import pytest
+
+from digest import build_levels, client_hash, row_key, _changed_rows, DigestSnapshot, RangeDigest, CLIENT_HASH
+
+
+def rows_for(stocks):
+    return {product_id: client_hash(row_key(product_id, stock, stock, 'active', stock))
+            for product_id, stock in stocks.items()}
+
+
+def catalog_stocks(count=40):
+    return {f"PROD-{i:05d}": i % 9 for i in range(count)}
+
+
+def test_equal_catalogs_have_equal_ranges():
+    first = build_levels(rows_for(catalog_stocks()), leaf_size=4, fanout=3)
+    second = build_levels(rows_for(catalog_stocks()), leaf_size=4, fanout=3)
+    assert first == second
+    assert len(first) == 3 and len(first[-1]['digests']) == 10
+
+
+def test_single_change_touches_one_range_per_level():
+    stocks = catalog_stocks()
+    before = build_levels(rows_for(stocks), leaf_size=4, fanout=3)
+    stocks['PROD-00017'] += 1
+    after = build_levels(rows_for(stocks), leaf_size=4, fanout=3)
+
+    changed = [[i for i, (old, new) in enumerate(zip(b['digests'], a['digests'])) if old != new]
+               for b, a in zip(before, after)]
+    # Leaf 4 holds PROD-00016..19; its parents are range 1 and range 0
+    assert changed == [[0], [1], [4]]
+    assert [level['bounds'] for level in before] == [level['bounds'] for level in after]
+
+
+def test_changed_rows_reports_added_removed_and_rehashed():
+    before = {'A': 1, 'B': 2, 'C': 3}
+    after = {'A': 1, 'B': 5, 'D': 4}
+    assert _changed_rows(before, after) == ['B', 'C', 'D']
+
+
+def test_snapshot_round_trip(tmp_path):
+    snapshot = DigestSnapshot(rows_for(catalog_stocks()), CLIENT_HASH)
+    path = str(tmp_path / 'digest.json.gz')
+    snapshot.save(path)
+
+    loaded = DigestSnapshot.load(path)
+    assert loaded.rows == snapshot.rows and loaded.root == snapshot.root
+    assert loaded.ids_in_range('PROD-00010', 'PROD-00013') == ['PROD-00010', 'PROD-00011', 'PROD-00012']
+
+
+@pytest.fixture
+def catalog_db(mongo_db):
+    mongo_db.products.insert_many([
+        {'_id': product_id, 'stock': stock, 'total_stock': stock, 'status': 'active'}
+        for product_id, stock in catalog_stocks(600).items()
+    ])
+    return mongo_db
+
+
+def test_unchanged_catalog_reports_nothing(catalog_db):
+    digest = RangeDigest(catalog_db)
+    previous = digest.snapshot()
+
+    changed, current = RangeDigest(catalog_db).diff(previous)
+    assert changed == []
+    assert current.root == previous.root
+
+
+def test_single_changed_product_is_found(catalog_db):
+    previous = RangeDigest(catalog_db).snapshot()
+    catalog_db.products.update_one({'_id': 'PROD-00321'}, {'$inc': {'stock': 1}})
+
+    digest = RangeDigest(catalog_db)
+    changed, current = digest.diff(previous)
+    assert changed == ['PROD-00321']
+    if digest.hash_mode != CLIENT_HASH:
+        # Only the changed leaf range was pulled
+        assert digest.stats['rows_pulled'] <= 256
+
+
+class WithoutServerHashing:
+    """products collection of a server lacking $toHashedIndexKey/$bitXor"""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.name = collection.name
+
+    def aggregate(self, *args, **kwargs):
+        from pymongo.errors import OperationFailure
+        raise OperationFailure("Unrecognized expression '$toHashedIndexKey'")
+
+    def find(self, *args, **kwargs):
+        return self.collection.find(*args, **kwargs)
+
+
+def client_digest(db):
+    digest = RangeDigest(db)
+    digest.products_collection = WithoutServerHashing(db.products)
+    return digest
+
+
+def test_falls_back_to_client_hashing(catalog_db):
+    previous = client_digest(catalog_db).snapshot()
+    assert previous.hash_mode == CLIENT_HASH
+
+    catalog_db.products.update_one({'_id': 'PROD-00042'}, {'$set': {'status': 'inactive'}})
+    catalog_db.products.delete_one({'_id': 'PROD-00500'})
+    changed, current = client_digest(catalog_db).diff(previous)
+
+    assert changed == ['PROD-00042', 'PROD-00500']
+    assert current.hash_mode == CLIENT_HASH
+
+
+def test_switching_hash_mode_forces_a_full_comparison(catalog_db):
+    previous = client_digest(catalog_db).snapshot()
+    digest = RangeDigest(catalog_db)
+    if not digest._server_supported():
+        pytest.skip("Server hashing needs MongoDB 7.0+")
+
+    changed, current = digest.diff(previous)
+    # Hashes of the two modes never agree: every product is re-verified
+    assert len(changed) == 600
+    assert current.hash_mode != CLIENT_HASH
@@ -0,0 +1,94 @@
+"""FIFO replay of usage_history on in-memory batches, and reading the usage archive back in"""
+
+from datetime import datetime
+
+from conftest import TEST_MONGODB_URI
+from fifo_audit import audit_product, FifoAuditor
+
+
+def day(n):
+    return datetime(2026, 3, n, 12, 0)
+
+
+def batch(batch_id, received, quantity, remaining, usage, expiry=None):
+    return {'_id': batch_id, 'product_id': 'P1', 'date_received': received, 'expiry_date': expiry,
+            'quantity_received': quantity, 'quantity_remaining': remaining, 'usage_history': usage}
+
+
+def sale(n, quantity, order_id):
+    return {'used_at': day(n), 'quantity_used': quantity, 'order_id': order_id}
+
+
+def kinds(findings):
+    return sorted((finding['batch_id'], finding['type']) for finding in findings)
+
+
+def test_fifo_consumption_has_no_findings():
+    batches = [
+        batch('B1', day(1), 5, 0, [sale(3, 2, 'O1'), sale(4, 3, 'O2')]),
+        batch('B2', day(2), 5, 4, [sale(5, 1, 'O3')])
+    ]
+    findings, records = audit_product('P1', batches)
+    assert findings == []
+    assert records == 3
+
+
+def test_sale_split_across_batches_is_not_a_double_deduction():
+    # O2 drains the older batch and takes the rest from the next one
+    batches = [
+        batch('B1', day(1), 5, 0, [sale(3, 4, 'O1'), sale(4, 1, 'O2')]),
+        batch('B2', day(2), 5, 3, [sale(4, 2, 'O2')])
+    ]
+    findings, _records = audit_product('P1', batches)
+    assert findings == []
+
+
+def test_out_of_order_sales_are_replayed_in_time_order():
+    # Usage arrays are not sorted; B2 was used while B1 still had stock
+    batches = [
+        batch('B1', day(1), 5, 2, [sale(6, 1, 'O3'), sale(3, 2, 'O1')]),
+        batch('B2', day(2), 5, 4, [sale(4, 1, 'O2')])
+    ]
+    findings, records = audit_product('P1', batches)
+    assert kinds(findings) == [('B2', 'out_of_order')]
+    assert records == 3
+
+
+def test_over_and_double_deduction():
+    batches = [batch('B1', day(1), 3, 0, [sale(3, 2, 'O1'), sale(3, 2, 'O1')])]
+    findings, _records = audit_product('P1', batches)
+    assert kinds(findings) == [('B1', 'double_deduction'), ('B1', 'over_deduction'), ('B1', 'remaining_mismatch')]
+
+
+def test_consumed_before_received_and_after_expiry():
+    batches = [batch('B1', day(5), 5, 3, [sale(2, 1, 'O1'), sale(9, 1, 'O2')], expiry=day(8))]
+    findings, _records = audit_product('P1', batches)
+    assert kinds(findings) == [('B1', 'consumed_before_received'), ('B1', 'expired_consumed')]
+
+
+def test_untimed_usage_still_counts_toward_the_remainder():
+    batches = [batch('B1', day(1), 5, 2, [sale(3, 2, 'O1'), {'quantity_used': 1, 'order_id': 'O2'}])]
+    findings, records = audit_product('P1', batches)
+    assert findings == []
+    assert records == 2
+
+
+def test_archived_usage_is_read_back(mongo_db):
+    mongo_db.batches.insert_many([
+        batch('B1', day(1), 5, 0, [sale(4, 3, 'O2')]),
+        batch('B2', day(2), 5, 5, [])
+    ])
+    mongo_db.batches_usage_history_archive.insert_one({
+        '_id': 'B1|2026-03', 'parent_id': 'B1', 'product_id': 'P1', 'bucket': '2026-03',
+        'entries': [sale(3, 2, 'O1')], 'archive_runs': ['run']
+    })
+
+    auditor = FifoAuditor(TEST_MONGODB_URI, mongo_db.name)
+    try:
+        (product_id, batches), = auditor.stream_batches()
+    finally:
+        auditor.client.close()
+
+    assert product_id == 'P1'
+    assert [entry['order_id'] for entry in batches[0]['usage_history']] == ['O1', 'O2']
+    assert audit_product(product_id, batches)[0] == []
@@ -0,0 +1,101 @@
+"""Compare-and-set repairs against a local mongod"""
+
+from datetime import datetime
+
+import pytest
+
+from conftest import TEST_MONGODB_URI
+from fix_stock_mismatches import StockFixer, CAS_MAX_RETRIES
+
+
+@pytest.fixture
+def fixer(mongo_db, tmp_path):
+    fixer = StockFixer(TEST_MONGODB_URI, mongo_db.name, dry_run=False, journal_path=str(tmp_path / 'journal.ndjson'),
+                       client=mongo_db.client)
+    yield fixer
+    fixer.close()
+
+
+@pytest.fixture
+def product(mongo_db):
+    document = {'_id': 'PROD-1', 'product_name': 'Ramyeon', 'stock': 10, 'total_stock': 10,
+                'updated_at': datetime(2026, 1, 1)}
+    mongo_db.products.insert_one(document)
+    return document
+
+
+def sell(mongo_db, quantity):
+    mongo_db.products.update_one({'_id': 'PROD-1'}, {'$inc': {'stock': -quantity, 'total_stock': -quantity},
+                                                     '$set': {'updated_at': datetime.utcnow()}})
+
+
+def test_write_lost_to_a_sale_is_replanned_from_the_new_value(mongo_db, fixer, product):
+    replanned = []
+
+    def replan(current):
+        replanned.append(current['stock'])
+        return {'total_stock': current['stock'] + 1}
+
+    sales = iter([3])
+
+    def sale_before_first_write():
+        # A sale lands between planning and the first bulk write only
+        for quantity in sales:
+            sell(mongo_db, quantity)
+
+    applied, conflicts = fixer._conditional_update([(product, {'total_stock': 11})], replan, sale_before_first_write)
+
+    assert (applied, conflicts) == (1, [])
+    assert replanned == [7]
+    current = mongo_db.products.find_one({'_id': 'PROD-1'})
+    assert (current['stock'], current['total_stock']) == (7, 8)
+
+
+def test_product_still_changing_after_the_retries_is_reported(mongo_db, fixer, product):
+    replanned = []
+
+    def replan(current):
+        replanned.append(current['stock'])
+        return {'total_stock': current['stock'] + 1}
+
+    # A sale before every write: the compare-and-set never matches
+    applied, conflicts = fixer._conditional_update([(product, {'total_stock': 11})], replan,
+                                                   lambda: sell(mongo_db, 1))
+
+    assert (applied, conflicts) == (0, ['PROD-1'])
+    assert len(replanned) == CAS_MAX_RETRIES
+    current = mongo_db.products.find_one({'_id': 'PROD-1'})
+    assert current['stock'] == current['total_stock'] == 10 - (CAS_MAX_RETRIES + 1)
+
+
+def test_replan_finding_nothing_to_fix_stops_the_retries(mongo_db, fixer, product):
+    applied, conflicts = fixer._conditional_update([(product, {'total_stock': 11})], lambda current: None,
+                                                   lambda: sell(mongo_db, 1))
+    assert (applied, conflicts) == (0, [])
+
+
+@pytest.mark.parametrize('journal_name', ['journal.ndjson', 'journal.ndjson.gz'])
+def test_undo_journal_restores_newest_first_and_skips_moved_products(mongo_db, product, tmp_path, journal_name):
+    mongo_db.products.insert_one({'_id': 'PROD-2', 'product_name': 'Kimchi', 'stock': 4, 'total_stock': 6,
+                                  'updated_at': datetime(2026, 1, 1)})
+    journal_path = str(tmp_path / journal_name)
+
+    repair = StockFixer(TEST_MONGODB_URI, mongo_db.name, dry_run=False, journal_path=journal_path,
+                        client=mongo_db.client)
+    # Two repairs of PROD-1 (batch sync, then a status fix) and one of PROD-2
+    repair._conditional_update([(product, {'stock': 8, 'total_stock': 8})], lambda current: None)
+    repaired = mongo_db.products.find_one({'_id': 'PROD-1'})
+    repair._conditional_update([(repaired, {'status': 'active'})], lambda current: None)
+    other = mongo_db.products.find_one({'_id': 'PROD-2'})
+    repair._conditional_update([(other, {'total_stock': 4})], lambda current: None)
+    repair.close()
+
+    # PROD-2 sells after the repair: undoing it would overwrite the sale
+    mongo_db.products.update_one({'_id': 'PROD-2'}, {'$inc': {'stock': -1, 'total_stock': -1}})
+
+    undo = StockFixer(TEST_MONGODB_URI, mongo_db.name, dry_run=False, client=mongo_db.client)
+    assert undo.undo_journal(journal_path) == 2
+
+    restored = mongo_db.products.find_one({'_id': 'PROD-1'})
+    assert restored == product
+    assert mongo_db.products.find_one({'_id': 'PROD-2'})['total_stock'] == 3
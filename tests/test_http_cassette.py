@@ -0,0 +1,89 @@
+"""Record / replay round trip of http_cassette"""
+
+import threading
+
+import pytest
+import requests
+
+from conftest import FakeBackend
+from http_cassette import Cassette, CassetteAdapter, CassetteMissError, use_cassette, RECORD, REPLAY
+
+API = 'http://api.test/api'
+
+
+def record_fixture(path, products):
+    """Record two product pages and a repeated first page through the fake backend"""
+    session = requests.Session()
+    cassette = use_cassette(session, path, RECORD)
+    session.get_adapter(API)._live = FakeBackend(products)
+
+    session.get(f"{API}/customer/products/", params={'page': 1, 'limit': 50})
+    session.get(f"{API}/customer/products/", params={'limit': 50, 'page': 2})
+    cassette.save()
+    return cassette
+
+
+def test_record_then_replay(tmp_path, catalog):
+    path = str(tmp_path / 'products.json.gz')
+    recorded = record_fixture(path, catalog)
+    assert recorded.request_count() == 2
+
+    session = requests.Session()
+    cassette = use_cassette(session, path, REPLAY)
+    assert cassette.request_count() == 2
+
+    # Query parameter order does not matter for the lookup
+    first = session.get(f"{API}/customer/products/?limit=50&page=1").json()
+    second = session.get(f"{API}/customer/products/?page=2&limit=50").json()
+    assert [p['_id'] for p in first['data']['products']] == [p['_id'] for p in catalog[:50]]
+    assert [p['_id'] for p in second['data']['products']] == [p['_id'] for p in catalog[50:]]
+    assert second['data']['pagination']['has_next'] is False
+
+    with pytest.raises(CassetteMissError):
+        session.get(f"{API}/customer/products/?page=3&limit=50")
+
+
+def test_replay_walks_responses_in_order(tmp_path):
+    path = str(tmp_path / 'poll.json.gz')
+    cassette = Cassette(path, RECORD)
+    for status in (503, 200):
+        response = requests.Response()
+        response.status_code = status
+        response._content = b'{}'
+        cassette.record('GET', f"{API}/health", response)
+    cassette.save()
+
+    replay = Cassette(path, REPLAY)
+    assert [replay.play('GET', f"{API}/health")['status'] for _ in range(3)] == [503, 200, 200]
+
+
+def test_concurrent_replay_plays_each_response_once(tmp_path):
+    path = str(tmp_path / 'many.json.gz')
+    cassette = Cassette(path, RECORD)
+    for index in range(200):
+        response = requests.Response()
+        response.status_code = 200
+        response._content = str(index).encode()
+        cassette.record('GET', f"{API}/page", response)
+    cassette.save()
+
+    replay = Cassette(path, REPLAY)
+    adapter = CassetteAdapter(replay)
+    bodies = []
+    lock = threading.Lock()
+
+    def worker():
+        session = requests.Session()
+        session.mount('http://', adapter)
+        for _ in range(25):
+            body = session.get(f"{API}/page").text
+            with lock:
+                bodies.append(body)
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(bodies, key=int) == [str(index) for index in range(200)]
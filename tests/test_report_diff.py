@@ -0,0 +1,101 @@
+"""Streaming report diff over JSON and NDJSON exports"""
+
+import json
+
+import pytest
+
+from report_diff import write_ndjson_report, load_report, iter_report, diff_reports, summarize_diff, ReportOrderError
+
+HEADER = {'generated_at': '2026-10-19T02:00:00', 'summary': {'total_mismatches': 2}}
+
+
+def row(product_id, cloud_stock, batch_stock, mismatch_type='cloud_vs_batch'):
+    return {'product_id': product_id, 'sku': f"SKU-{product_id[-3:]}", 'product_name': product_id,
+            'cloud_stock': cloud_stock, 'cloud_total_stock': cloud_stock, 'api_stock': cloud_stock,
+            'batch_stock': batch_stock, 'mismatch_type': mismatch_type}
+
+
+BEFORE = {
+    'mismatches': [row('PROD-003', 5, 4), row('PROD-001', 9, 7), row('PROD-004', 2, 1)],
+    'matches': [row('PROD-002', 3, 3, 'none')],
+    'missing_from_api': [row('PROD-006', 1, 1, 'missing')]
+}
+AFTER = {
+    'mismatches': [row('PROD-001', 9, 7), row('PROD-003', 5, 2), row('PROD-005', 8, 6)],
+    'matches': [row('PROD-004', 1, 1, 'none')],
+    'missing_from_api': [row('PROD-006', 1, 1, 'missing'), row('PROD-002', 3, 3, 'missing')]
+}
+
+
+def export(tmp_path, name, report):
+    path = str(tmp_path / name)
+    if name.endswith('.json'):
+        with open(path, 'w') as f:
+            json.dump(dict(HEADER, **report), f)
+    else:
+        write_ndjson_report(path, HEADER, report['mismatches'], report['matches'], report['missing_from_api'])
+    return path
+
+
+@pytest.mark.parametrize('suffix', ['.json', '.ndjson', '.ndjson.gz'])
+def test_ndjson_export_round_trips(tmp_path, suffix):
+    report = load_report(export(tmp_path, f"report{suffix}", BEFORE))
+    assert report['generated_at'] == HEADER['generated_at']
+    for section in ('mismatches', 'matches', 'missing_from_api'):
+        key = lambda item: item['product_id']
+        assert sorted(report[section], key=key) == sorted(BEFORE[section], key=key)
+
+
+def test_ndjson_export_is_sorted_and_tagged(tmp_path):
+    path = export(tmp_path, 'report.ndjson', BEFORE)
+    with open(path) as f:
+        lines = [json.loads(line) for line in f]
+    assert lines[0]['record'] == 'header'
+    assert [(line['product_id'], line['record']) for line in lines[1:]] == [
+        ('PROD-001', 'mismatch'), ('PROD-002', 'match'), ('PROD-003', 'mismatch'), ('PROD-004', 'mismatch'),
+        ('PROD-006', 'missing')
+    ]
+
+
+@pytest.mark.parametrize('old_name, new_name', [
+    ('before.json', 'after.json'),
+    ('before.ndjson', 'after.ndjson.gz'),
+    ('before.json', 'after.ndjson')
+])
+def test_diff_reports_added_removed_and_changed(tmp_path, old_name, new_name):
+    changes = list(diff_reports(export(tmp_path, old_name, BEFORE), export(tmp_path, new_name, AFTER)))
+    by_product = {change['product_id']: change for change in changes}
+
+    assert [change['product_id'] for change in changes] == ['PROD-001', 'PROD-002', 'PROD-003', 'PROD-004',
+                                                             'PROD-005', 'PROD-006']
+    assert by_product['PROD-001']['change'] == 'persistent' and not by_product['PROD-001']['stock_changed']
+    assert by_product['PROD-002']['change'] == 'new' and by_product['PROD-002']['now'] == 'missing_from_api'
+    assert by_product['PROD-003']['stock_changed']
+    assert (by_product['PROD-003']['before']['batch_stock'], by_product['PROD-003']['after']['batch_stock']) == (4, 2)
+    assert by_product['PROD-004'] == {'change': 'resolved', 'product_id': 'PROD-004', 'sku': 'SKU-004',
+                                      'product_name': 'PROD-004', 'was': 'cloud_vs_batch'}
+    assert by_product['PROD-005']['change'] == 'new' and by_product['PROD-005']['now'] == 'cloud_vs_batch'
+    assert by_product['PROD-006']['was'] == by_product['PROD-006']['now'] == 'missing_from_api'
+
+
+def test_summarize_diff_counts_and_writes_every_change(tmp_path):
+    changes = diff_reports(export(tmp_path, 'before.ndjson', BEFORE), export(tmp_path, 'after.ndjson', AFTER))
+    output = str(tmp_path / 'diff.ndjson')
+    counts, samples = summarize_diff(changes, top=1, output=output)
+
+    assert counts == {'new': 2, 'resolved': 1, 'persistent': 3, 'stock_changed': 1}
+    assert [change['product_id'] for change in samples['persistent']] == ['PROD-003']
+    assert len(samples['new']) == 1
+    with open(output) as f:
+        assert len(f.readlines()) == 6
+
+
+def test_unsorted_ndjson_is_rejected(tmp_path):
+    path = str(tmp_path / 'unsorted.ndjson')
+    with open(path, 'w') as f:
+        for line in ({'record': 'header'}, dict(row('PROD-002', 1, 0), record='mismatch'),
+                     dict(row('PROD-001', 1, 0), record='mismatch')):
+            f.write(json.dumps(line) + '\n')
+
+    with pytest.raises(ReportOrderError):
+        list(iter_report(path))
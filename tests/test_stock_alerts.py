@@ -0,0 +1,84 @@
+"""Low-stock alert state machine: hysteresis, confirm count, cooldown and failed delivery"""
+
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+from stock_alerts import StockAlerts, CROSSED_BELOW, RECOVERED
+
+PRODUCT = {'_id': 'PROD-1', 'product_name': 'Ramyeon', 'low_stock_threshold': 10}
+START = datetime(2026, 10, 1, 8, 0)
+
+
+@pytest.fixture
+def make_alerts(tmp_path):
+    def make(**kwargs):
+        return StockAlerts(state_file=str(tmp_path / 'state.json'), sink_file=str(tmp_path / 'alerts.ndjson'),
+                           **kwargs)
+    return make
+
+
+def feed(alerts, stocks, minutes=60):
+    """One run per stock value, ``minutes`` apart; the events fired per run"""
+    fired = []
+    for run, stock in enumerate(stocks):
+        alerts.observe(PRODUCT, stock, START + timedelta(minutes=run * minutes))
+        fired.append([event['event'] for event in alerts.events])
+        alerts.flush()
+    return fired
+
+
+def test_stock_hovering_around_the_threshold_alerts_once(make_alerts):
+    # Recovery needs stock above 10 + 2 = 12
+    fired = feed(make_alerts(), [11, 10, 11, 12, 9, 12, 13, 12, 13])
+    assert fired == [[], [CROSSED_BELOW], [], [], [], [], [RECOVERED], [], []]
+
+
+def test_change_must_persist_for_the_confirm_count(make_alerts):
+    fired = feed(make_alerts(confirm_runs=3), [9, 9, 11, 9, 9, 9, 9])
+    assert fired == [[], [], [], [], [], [CROSSED_BELOW], []]
+
+
+def test_cooldown_holds_the_change_until_it_has_passed(make_alerts):
+    # Runs 10 minutes apart with a 30 minute cooldown
+    fired = feed(make_alerts(cooldown_minutes=30), [5, 20, 20, 20, 5], minutes=10)
+    assert fired == [[CROSSED_BELOW], [], [], [RECOVERED], []]
+
+
+def test_change_reverted_inside_the_cooldown_never_fires(make_alerts):
+    fired = feed(make_alerts(cooldown_minutes=30), [5, 20, 5, 5, 5], minutes=10)
+    assert fired == [[CROSSED_BELOW], [], [], [], []]
+
+
+def test_products_without_threshold_are_ignored(make_alerts):
+    alerts = make_alerts()
+    alerts.observe({'_id': 'PROD-2', 'low_stock_threshold': 0}, 0, START)
+    assert alerts.events == [] and alerts.state == {}
+
+
+def test_state_survives_between_runs_and_events_reach_the_sink(make_alerts, tmp_path):
+    feed(make_alerts(), [5])
+    fired = feed(make_alerts(), [5, 20])
+    assert fired == [[], [RECOVERED]]
+
+    with open(tmp_path / 'alerts.ndjson') as f:
+        events = [json.loads(line) for line in f]
+    assert [(event['event'], event['batch_stock'], event['recovers_above']) for event in events] == [
+        (CROSSED_BELOW, 5, 12), (RECOVERED, 20, 12)
+    ]
+
+
+class FailingSession:
+    def post(self, *args, **kwargs):
+        raise ConnectionError("webhook down")
+
+
+def test_failed_delivery_detects_the_change_again(make_alerts):
+    alerts = make_alerts(webhook_url='http://hooks.test/stock', session=FailingSession())
+    alerts.observe(PRODUCT, 5, START)
+    assert alerts.flush() == 0
+
+    retry = make_alerts()
+    retry.observe(PRODUCT, 5, START + timedelta(minutes=5))
+    assert [event['event'] for event in retry.events] == [CROSSED_BELOW]
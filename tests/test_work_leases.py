@@ -0,0 +1,134 @@
+"""Chunk leases against a local mongod: expiry, re-claim and fencing of stale holders"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from conftest import TEST_MONGODB_URI
+from work_leases import WorkQueue, LeaseLost, process_chunk, DONE
+
+
+@pytest.fixture
+def products(mongo_db):
+    mongo_db.products.insert_many([
+        {'_id': f"PROD-{i:03d}", 'product_name': f"Product {i}", 'stock': 5, 'total_stock': 5, 'status': 'active',
+         'updated_at': datetime(2026, 1, 1)}
+        for i in range(10)
+    ])
+    return mongo_db.products
+
+
+def queue(mongo_db, worker_id):
+    return WorkQueue(mongo_db, 'run-1', worker_id=worker_id, lease_seconds=60)
+
+
+def expire(mongo_db, lease):
+    mongo_db.work_chunks.update_one({'_id': lease.chunk['_id']},
+                                    {'$set': {'lease_expires_at': datetime.utcnow() - timedelta(seconds=1)}})
+
+
+def test_expired_lease_is_reclaimed_and_stale_holder_rejected(mongo_db, products):
+    first, second = queue(mongo_db, 'a'), queue(mongo_db, 'b')
+    first.plan(products, chunk_size=100)
+
+    stale = first.claim()
+    assert second.claim() is None
+
+    expire(mongo_db, stale)
+    fresh = second.claim()
+    assert fresh.chunk['_id'] == stale.chunk['_id']
+    assert fresh.chunk['token'] == stale.chunk['token'] + 1
+
+    with pytest.raises(LeaseLost):
+        stale.renew()
+    with pytest.raises(LeaseLost):
+        stale.complete({'checked': 0})
+
+    fresh.complete({'checked': 10})
+    assert mongo_db.work_chunks.find_one({'_id': fresh.chunk['_id']})['state'] == DONE
+
+
+def test_stale_holder_writes_no_repairs(mongo_db, products, tmp_path):
+    from fix_stock_mismatches import StockFixer
+
+    first, second = queue(mongo_db, 'a'), queue(mongo_db, 'b')
+    first.plan(products, chunk_size=100)
+    stale = first.claim()
+    expire(mongo_db, stale)
+    second.claim()
+
+    # No batches: every product would be repaired to stock 0
+    fixer = StockFixer(TEST_MONGODB_URI, mongo_db.name, dry_run=False, journal_path=str(tmp_path / 'journal.ndjson'),
+                       client=mongo_db.client)
+    with pytest.raises(LeaseLost):
+        process_chunk(first, stale, products, mongo_db.batches, fixer=fixer)
+
+    assert products.count_documents({'stock': 5}) == 10
+
+
+def test_lease_lost_between_bulk_writes_stops_the_repairs(mongo_db, products, tmp_path, monkeypatch):
+    import fix_stock_mismatches
+    from fix_stock_mismatches import StockFixer
+
+    monkeypatch.setattr(fix_stock_mismatches, 'BULK_CHUNK_SIZE', 4)
+    first, second = queue(mongo_db, 'a'), queue(mongo_db, 'b')
+    first.plan(products, chunk_size=100)
+    lease = first.claim()
+
+    renew = lease.renew
+
+    def renew_then_lose():
+        # The lease runs out (long pause) while the first bulk write is in flight
+        renew()
+        expire(mongo_db, lease)
+        second.claim()
+
+    monkeypatch.setattr(lease, 'renew', renew_then_lose)
+    fixer = StockFixer(TEST_MONGODB_URI, mongo_db.name, dry_run=False, journal_path=str(tmp_path / 'journal.ndjson'),
+                       client=mongo_db.client)
+    with pytest.raises(LeaseLost):
+        process_chunk(first, lease, products, mongo_db.batches, fixer=fixer)
+
+    assert products.count_documents({'stock': 0}) == 4
+
+
+def test_planner_taken_over_joins_the_new_plan(mongo_db, products):
+    first, second = queue(mongo_db, 'a'), queue(mongo_db, 'b')
+    first.ensure_indexes()
+    assert first._take_planning()
+
+    # The first planner stalls past its planning lease and is taken over
+    mongo_db.work_runs.update_one({'_id': 'run-1'},
+                                  {'$set': {'planning_expires_at': datetime.utcnow() - timedelta(seconds=1)}})
+    run = second.plan(products, chunk_size=4)
+    assert run['state'] == 'running' and run['chunk_count'] == 3
+
+    assert first._write_plan(products, chunk_size=4) is False
+    assert first.plan(products, chunk_size=4)['planned_by'] == 'b'
+    assert mongo_db.work_chunks.count_documents({'run_id': 'run-1'}) == 3
+
+
+def test_stale_planner_writing_after_takeover_leaves_the_new_plan_alone(mongo_db, products, monkeypatch):
+    first, second = queue(mongo_db, 'a'), queue(mongo_db, 'b')
+    first.ensure_indexes()
+    assert first._take_planning()
+
+    mongo_db.work_runs.update_one({'_id': 'run-1'},
+                                  {'$set': {'planning_expires_at': datetime.utcnow() - timedelta(seconds=1)}})
+    second.plan(products, chunk_size=4)
+    leased = second.claim()
+    second.claim().complete({'checked': 4})
+
+    # The first planner passed its planning check just before the takeover
+    # and only now deletes and writes chunks
+    monkeypatch.setattr(first, '_holds_planning', lambda: True)
+    assert first._write_plan(products, chunk_size=4) is False
+
+    chunks = {chunk['index']: chunk for chunk in mongo_db.work_chunks.find({'run_id': 'run-1'})}
+    assert len(chunks) == 3
+    assert chunks[0]['state'] == 'leased' and chunks[0]['token'] == leased.chunk['token']
+    assert chunks[1]['state'] == DONE
+    leased.renew()
+
+    first.plan(products, chunk_size=4)
+    assert first.claim().chunk['index'] == 2
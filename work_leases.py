@@ -0,0 +1,386 @@
+"""
+Work Leases
+===========
+Splits one reconciliation run over any number of workers, on one host or
+many. The run's product _id space is cut into chunks kept in MongoDB;
+workers claim a chunk with an expiring lease, reconcile it (and repair it
+with --fix), mark it done and claim the next one:
+
+    python stock_tools.py worker --run-id nightly-2026-10-19 --fix --live --yes   # on every host
+    python stock_tools.py worker --run-id nightly-2026-10-19 --status
+
+- work_runs: one document per run ({_id: run id, state, plan_token,
+  chunk_count, ...}); the first worker to insert it plans the chunks, the
+  others wait for it
+- work_chunks: one document per chunk ({run_id, plan_token, index, lower,
+  upper, state, owner, token, lease_expires_at, attempts, result}); chunk i holds
+  the products with lower <= _id < upper, and the first and last chunk are
+  open-ended, so products created during the run are covered too
+
+A claim is one find_one_and_update, so two workers never hold the same
+chunk. Each claim increments the chunk's fencing token; the lease is
+renewed in the background and every later write (renew, done) must match
+owner and token. A worker whose lease ran out (crash, long pause) loses
+the chunk to the next claim. Repairs renew the lease before every bulk
+write of products and stop with LeaseLost at the first one after it was
+lost, so a stale worker never writes over the new owner (each bulk write
+takes far less than the lease). Repairs are compare-and-set writes that
+re-plan from the current document, so a chunk reprocessed after a crash
+finds nothing left to fix: each product is repaired once per run.
+
+Planning is leased the same way (planning_expires_at): a worker that finds
+the planner gone takes the planning over and bumps the run's plan_token.
+Chunks are written with their planner's plan_token and only chunks of the
+run's current plan_token are claimed, counted or shown, so a planner that
+was taken over can neither start the run nor touch the new planner's
+chunks (it only deletes older generations); it joins the new plan.
+
+Leases are timed with the workers' clocks; keep the hosts NTP-synced and
+the lease (default 300 s) far above any clock skew.
+"""
+
+import os
+import time
+import socket
+import threading
+from datetime import datetime, timedelta
+
+from profiling import profiled
+
+RUNS_COLLECTION = 'work_runs'
+CHUNKS_COLLECTION = 'work_chunks'
+
+DEFAULT_CHUNK_SIZE = 1000
+DEFAULT_LEASE_SECONDS = 300
+POLL_SECONDS = 5
+
+PENDING = 'pending'
+LEASED = 'leased'
+DONE = 'done'
+
+
+class LeaseLost(Exception):
+    """The chunk's lease expired and another worker may have claimed it"""
+
+
+def default_worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class ChunkLease:
+    def __init__(self, queue, chunk):
+        """A claimed chunk, renewed by a background thread while held"""
+        self.queue = queue
+        self.chunk = chunk
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def filter(self):
+        """Matches the chunk only while this claim still owns it"""
+        return {'_id': self.chunk['_id'], 'state': LEASED, 'owner': self.chunk['owner'], 'token': self.chunk['token']}
+
+    def renew(self):
+        """Extend the lease; raises LeaseLost if it was taken over"""
+        now = datetime.utcnow()
+        result = self.queue.chunks.update_one(
+            dict(self.filter, lease_expires_at={'$gt': now}),
+            {'$set': {'lease_expires_at': now + self.queue.lease}}
+        )
+        if result.matched_count == 0:
+            self.lost = True
+            raise LeaseLost(f"Lease on chunk {self.chunk['index']} of run {self.chunk['run_id']} was lost")
+
+    def _heartbeat(self):
+        while not self._stop.wait(self.queue.lease.total_seconds() / 3):
+            try:
+                self.renew()
+            except LeaseLost:
+                return
+            except Exception as e:
+                # A failed renewal is retried; the lease only lapses if they keep failing
+                print(f"⚠️  Lease renewal failed: {e}")
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._heartbeat, name='lease-heartbeat', daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        return False
+
+    def complete(self, result):
+        """Mark the chunk done with its result counts"""
+        updated = self.queue.chunks.update_one(self.filter, {
+            '$set': {'state': DONE, 'done_at': datetime.utcnow(), 'result': result},
+            '$unset': {'lease_expires_at': ''}
+        })
+        if updated.matched_count == 0:
+            self.lost = True
+            raise LeaseLost(f"Lease on chunk {self.chunk['index']} of run {self.chunk['run_id']} was lost")
+
+
+class WorkQueue:
+    def __init__(self, db, run_id, worker_id=None, lease_seconds=DEFAULT_LEASE_SECONDS):
+        """Chunk queue of one run, stored in ``db`` (use the primary)"""
+        self.db = db
+        self.runs = db[RUNS_COLLECTION]
+        self.chunks = db[CHUNKS_COLLECTION]
+        self.run_id = run_id
+        self.worker_id = worker_id or default_worker_id()
+        self.lease = timedelta(seconds=lease_seconds)
+        # Planning generation whose chunks this queue works on (see plan())
+        self.plan_token = None
+
+    def ensure_indexes(self):
+        self.chunks.create_index([('run_id', 1), ('plan_token', 1), ('state', 1), ('index', 1)])
+        self.chunks.create_index([('run_id', 1), ('plan_token', 1), ('index', 1)], unique=True)
+
+    # Planning
+
+    def _split(self, products_collection, chunk_size):
+        """Chunk boundaries: every chunk_size-th product _id (read from the _id index)"""
+        bounds = []
+        cursor = products_collection.find({}, {'_id': 1}).sort('_id', 1).batch_size(10000)
+        for position, product in enumerate(cursor):
+            if position and position % chunk_size == 0:
+                bounds.append(product['_id'])
+        lowers = [None] + bounds
+        uppers = bounds + [None]
+        return list(zip(lowers, uppers))
+
+    def _take_planning(self):
+        """Become the run's planner: create the run, or take over from a crashed planner
+
+        Every planner gets the next plan_token; it fences the chunks it writes.
+        """
+        from pymongo import ReturnDocument
+        from pymongo.errors import DuplicateKeyError
+
+        now = datetime.utcnow()
+        try:
+            self.runs.insert_one({'_id': self.run_id, 'state': 'planning', 'planned_by': self.worker_id,
+                                  'plan_token': 1, 'created_at': now, 'planning_expires_at': now + self.lease})
+            self.plan_token = 1
+            return True
+        except DuplicateKeyError:
+            pass
+        taken = self.runs.find_one_and_update(
+            {'_id': self.run_id, 'state': 'planning', 'planning_expires_at': {'$lt': now}},
+            {'$set': {'planned_by': self.worker_id, 'planning_expires_at': now + self.lease},
+             '$inc': {'plan_token': 1}},
+            return_document=ReturnDocument.AFTER
+        )
+        if taken is None:
+            return False
+        self.plan_token = taken['plan_token']
+        return True
+
+    def _planning_filter(self):
+        """Matches the run only while it is still being planned under our plan_token"""
+        return {'_id': self.run_id, 'state': 'planning', 'planned_by': self.worker_id, 'plan_token': self.plan_token}
+
+    def _holds_planning(self):
+        """Extend the planning lease; False once another worker took the planning over"""
+        result = self.runs.update_one(self._planning_filter(),
+                                      {'$set': {'planning_expires_at': datetime.utcnow() + self.lease}})
+        return result.matched_count == 1
+
+    def _write_plan(self, products_collection, chunk_size):
+        """Write this planner's chunks and start the run; False if the planning was taken over
+
+        Chunks carry the plan_token of their planner and only those of the
+        run's current plan_token are ever claimed, so a planner that was taken
+        over can't disturb the new plan: its own chunks are never used, and it
+        only deletes chunks of older (crashed) planners.
+        """
+        ranges = self._split(products_collection, chunk_size)
+        if not self._holds_planning():
+            return False
+
+        # Leftovers of crashed planners; never claimed (older plan_token)
+        self.chunks.delete_many({'run_id': self.run_id, 'plan_token': {'$lt': self.plan_token}})
+        self.chunks.insert_many([
+            {'_id': f"{self.run_id}:{self.plan_token}:{index:05d}", 'run_id': self.run_id,
+             'plan_token': self.plan_token, 'index': index, 'lower': lower, 'upper': upper, 'state': PENDING,
+             'owner': None, 'token': 0, 'attempts': 0}
+            for index, (lower, upper) in enumerate(ranges)
+        ])
+
+        # Starting the run is the fence: it only matches our plan_token
+        started = self.runs.update_one(self._planning_filter(), {
+            '$set': {'state': 'running', 'chunk_count': len(ranges), 'chunk_size': chunk_size},
+            '$unset': {'planning_expires_at': ''}
+        })
+        if started.matched_count == 0:
+            self.chunks.delete_many({'run_id': self.run_id, 'plan_token': self.plan_token})
+            return False
+        print(f"🧩 Planned run {self.run_id}: {len(ranges)} chunks of up to {chunk_size} products")
+        return True
+
+    @profiled
+    def plan(self, products_collection, chunk_size=DEFAULT_CHUNK_SIZE):
+        """Create the run's chunks, or wait for the worker that is creating them"""
+        self.ensure_indexes()
+        while True:
+            run = self.runs.find_one({'_id': self.run_id})
+            if run is not None and run['state'] != 'planning':
+                self.plan_token = run.get('plan_token')
+                return run
+            if self._take_planning():
+                if not self._write_plan(products_collection, chunk_size):
+                    print(f"⏳ Planning of run {self.run_id} was taken over; joining that plan")
+                continue
+            time.sleep(1)
+
+    def _chunks_filter(self, **conditions):
+        """Chunks of the run's current plan"""
+        if self.plan_token is None:
+            run = self.runs.find_one({'_id': self.run_id}) or {}
+            self.plan_token = run.get('plan_token') if run.get('state') != 'planning' else None
+        return dict(conditions, run_id=self.run_id, plan_token=self.plan_token)
+
+    # Claiming
+
+    def claim(self):
+        """Lease the next pending (or expired) chunk; None if there is none right now"""
+        from pymongo import ReturnDocument
+
+        now = datetime.utcnow()
+        chunk = self.chunks.find_one_and_update(
+            self._chunks_filter(**{'$or': [{'state': PENDING}, {'state': LEASED, 'lease_expires_at': {'$lt': now}}]}),
+            {
+                '$set': {'state': LEASED, 'owner': self.worker_id, 'lease_expires_at': now + self.lease,
+                         'claimed_at': now},
+                '$inc': {'token': 1, 'attempts': 1}
+            },
+            sort=[('index', 1)],
+            return_document=ReturnDocument.AFTER
+        )
+        return ChunkLease(self, chunk) if chunk is not None else None
+
+    def chunk_query(self, chunk):
+        """Product query selecting one chunk's _id range"""
+        bounds = {}
+        if chunk['lower'] is not None:
+            bounds['$gte'] = chunk['lower']
+        if chunk['upper'] is not None:
+            bounds['$lt'] = chunk['upper']
+        return {'_id': bounds} if bounds else {}
+
+    def finish_if_done(self):
+        """Mark the run done once every chunk is; returns True when it is"""
+        if self.chunks.count_documents(self._chunks_filter(state={'$ne': DONE})):
+            return False
+        self.runs.update_one({'_id': self.run_id, 'state': 'running'},
+                             {'$set': {'state': DONE, 'finished_at': datetime.utcnow()}})
+        return True
+
+    # Status
+
+    def status(self):
+        """Run document, per-state chunk counts, summed results and active leases"""
+        run = self.runs.find_one({'_id': self.run_id})
+        counts = {PENDING: 0, LEASED: 0, DONE: 0}
+        totals = {}
+        leases = []
+        now = datetime.utcnow()
+        for chunk in self.chunks.find(self._chunks_filter()).sort('index', 1):
+            state = chunk['state']
+            if state == LEASED and chunk['lease_expires_at'] < now:
+                state = 'expired'
+            counts[state] = counts.get(state, 0) + 1
+            for name, value in (chunk.get('result') or {}).items():
+                totals[name] = totals.get(name, 0) + value
+            if chunk['state'] == LEASED:
+                leases.append((chunk['index'], chunk['owner'], chunk['attempts'], chunk['lease_expires_at'], state))
+        return run, counts, totals, leases
+
+
+class ApiSnapshot:
+    def __init__(self, api_source):
+        """Customer API listing loaded once per worker and reused for every chunk"""
+        self.api_source = api_source
+        self.products = None
+        self.complete = True
+
+    def load(self):
+        if self.products is None:
+            self.products = self.api_source.load()
+            self.complete = getattr(self.api_source, 'complete', True)
+        return self.products
+
+
+@profiled
+def process_chunk(queue, lease, products_collection, batches_collection, api_source=None, fixer=None,
+                  batch_size=None):
+    """Reconcile (and with ``fixer`` repair) the products of one leased chunk"""
+    from reconcile import ReconciliationEngine, MongoProductSource, BatchTimelineSource, RepairPlanner
+
+    query = dict(queue.chunk_query(lease.chunk), isDeleted={'$ne': True})
+    product_ids = [product['_id'] for product in products_collection.find(query, {'_id': 1})]
+
+    planner = RepairPlanner(fixer) if fixer is not None else None
+    engine = ReconciliationEngine(
+        MongoProductSource(products_collection, product_ids, batch_size=batch_size),
+        BatchTimelineSource(batches_collection, product_ids, batch_size or 5000),
+        api_source
+    )
+    results = engine.run(repair=planner)
+
+    repaired = 0
+    if planner is not None:
+        # Renewed before every bulk write: each write starts with a full lease
+        # ahead of it, and the first one after the chunk was lost raises
+        # LeaseLost instead of writing
+        repaired = planner.apply(before_chunk=lease.renew)
+
+    return {
+        'checked': results['total_checked'],
+        'mismatches': results['mismatch_count'],
+        'missing_from_api': results['missing_count'],
+        'repaired': repaired
+    }
+
+
+def run_worker(queue, products_collection, batches_collection, api_source=None, fixer=None, batch_size=None,
+               max_chunks=None, wait=True):
+    """Claim and process chunks until the run is done (or ``max_chunks`` were processed)
+
+    With ``wait`` the worker stays until every chunk is done, so it can
+    take over the chunks of workers that crash.
+    """
+    processed = 0
+    totals = {}
+    print(f"👷 Worker {queue.worker_id} joined run {queue.run_id}")
+
+    while max_chunks is None or processed < max_chunks:
+        lease = queue.claim()
+        if lease is None:
+            if queue.finish_if_done() or not wait:
+                break
+            time.sleep(POLL_SECONDS)
+            continue
+
+        chunk = lease.chunk
+        retry = f" (attempt {chunk['attempts']})" if chunk['attempts'] > 1 else ''
+        print(f"\n🧩 Chunk {chunk['index']}{retry}")
+        try:
+            with lease:
+                result = process_chunk(queue, lease, products_collection, batches_collection, api_source, fixer,
+                                       batch_size)
+                lease.complete(result)
+        except LeaseLost as e:
+            print(f"⚠️  {e}; leaving it to its new owner")
+            continue
+
+        processed += 1
+        for name, value in result.items():
+            totals[name] = totals.get(name, 0) + value
+
+    print(f"\n✅ Worker {queue.worker_id} processed {processed} chunks: "
+          + ', '.join(f"{name} {value}" for name, value in totals.items()))
+    return totals